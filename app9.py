@@ -1,20 +1,68 @@
 import os
 import streamlit as st
-import pandas as pd
-import math
 import json
-import google.generativeai as genai
-from PIL import Image
+import time
+from functools import partial
 
 # ================= 配置区 =================
-# 1. 代理设置 (请确认您的端口号)
-os.environ["HTTP_PROXY"] = "http://127.0.0.1:8890"
-os.environ["HTTPS_PROXY"] = "http://127.0.0.1:8890"
+# 1. 代理设置 (默认直连；需要时设置 CKD_LLM_PROXY，如 http://127.0.0.1:8890。仅作用于 Gemini 后端自身的连接)
+LLM_PROXY = os.environ.get("CKD_LLM_PROXY", "")
 
 # 2. 公司品牌配置
 COMPANY_NAME = "GenAI Health Tech"
 LOGO_URL = "https://img.icons8.com/color/96/caduceus.png" 
 
+# 3. 知识库检索配置 (每次报告只带入与患者分期相关的 top-k 指南段落)
+KB_TOP_K = int(os.environ.get("CKD_KB_TOP_K", 6))
+KB_TOKEN_BUDGET = int(os.environ.get("CKD_KB_TOKEN_BUDGET", 1500))
+
+# 4. 模型后端与报告缓存 (相同病例 + 相同知识库版本 + 相同模型 → 直接复用报告)
+#    CKD_LLM_BACKEND=http + CKD_LLM_BASE_URL 可切换到本地替身服务 (python -m ckd.standin_server)
+LLM_BACKEND = os.environ.get("CKD_LLM_BACKEND", "gemini")
+LLM_BASE_URL = os.environ.get("CKD_LLM_BASE_URL", "")
+LLM_TIMEOUT = float(os.environ.get("CKD_LLM_TIMEOUT", 120))
+LLM_MAX_RETRIES = int(os.environ.get("CKD_LLM_MAX_RETRIES", 2))
+MODEL_NAME = os.environ.get("CKD_LLM_MODEL", "gemini-3-pro-preview" if LLM_BACKEND == "gemini" else "standin")
+REPORT_CACHE_TTL_HOURS = 24 * 7
+
+# 5. 病例库 (下拉框分页展示，避免百万级 id 一次性塞进 selectbox)
+PATIENT_DB_PATH = "cleaned_kidney_data.csv"
+PATIENT_PAGE_SIZE = 100
+
+# 6. 报告流式渲染 (边生成边显示各卡片；设为 0 则等待完整响应后一次性渲染)
+REPORT_STREAMING = os.environ.get("CKD_REPORT_STREAMING", "1") != "0"
+
+# 7. 多图并行提取 (每组图片一次模型调用，线程池并发；设为 0 则所有图片一次性提交)
+EXTRACTION_PARALLEL = os.environ.get("CKD_EXTRACTION_PARALLEL", "1") != "0"
+EXTRACTION_GROUP_SIZE = int(os.environ.get("CKD_EXTRACTION_GROUP_SIZE", 1))
+EXTRACTION_MAX_WORKERS = int(os.environ.get("CKD_EXTRACTION_MAX_WORKERS", 4))
+
+# 8. 化验单图片预处理 (摆正 → 灰度 → 限制最长边 → JPEG 重压缩)
+IMAGE_MAX_EDGE = int(os.environ.get("CKD_IMAGE_MAX_EDGE", 1600))
+IMAGE_GRAYSCALE = os.environ.get("CKD_IMAGE_GRAYSCALE", "1") != "0"
+IMAGE_JPEG_QUALITY = int(os.environ.get("CKD_IMAGE_JPEG_QUALITY", 80))
+
+# 9. 性能指标 (分阶段耗时 / token；滚动日志与 metrics.prom 写在缓存目录)
+METRICS_PORT = int(os.environ.get("CKD_METRICS_PORT", 0))        # >0 时暴露 http://host:port/metrics
+METRICS_HOST = os.environ.get("CKD_METRICS_HOST", "127.0.0.1")   # 默认只监听本机；需被 Prometheus 远程抓取时设为 0.0.0.0
+ADMIN_PANEL = os.environ.get("CKD_ADMIN_PANEL", "0") == "1"       # 侧边栏显示 p50/p95 面板
+
+# 10. 本地 KDIGO 规则引擎 (热图绿 / 黄、KFRE 5 年 < 3%、无转诊指征的常规病例直接出模板报告，不调用模型；设为 0 则全部调用模型)
+LLM_GATING = os.environ.get("CKD_LLM_GATING", "1") != "0"
+# 11. 纯文本病历先走本地正则解析 (年龄 / 性别 / 肌酐或 eGFR / uACR 齐全时不调用模型；设为 0 则全部交给模型)
+NOTE_FAST_PATH = os.environ.get("CKD_NOTE_FAST_PATH", "1") != "0"
+
+# 12. 随访历史 (同一病例 ID 的多次化验；有记录时展示真实 eGFR / KFRE 走势，eGFR 年变化计入转诊判断)
+HISTORY_CHART_POINTS = int(os.environ.get("CKD_HISTORY_CHART_POINTS", 50))
+
+# 13. 模型调用全局限流 (所有会话共享：并发上限 + 每分钟请求数，0 表示不限速；相同请求进行中时跨会话合并为一次调用)
+LLM_MAX_CONCURRENCY = int(os.environ.get("CKD_LLM_MAX_CONCURRENCY", 4))
+LLM_RATE_PER_MINUTE = float(os.environ.get("CKD_LLM_RATE_PER_MINUTE", 0))
+LLM_QUEUE_TIMEOUT = float(os.environ.get("CKD_LLM_QUEUE_TIMEOUT", 300))
+
+# 14. 报告导出 (HTML / PDF 在后台线程池生成；批量导出时并行的病例数。PDF 需安装 reportlab)
+EXPORT_MAX_WORKERS = int(os.environ.get("CKD_EXPORT_MAX_WORKERS", 4))
+
 # ================= 0. 页面与样式配置 =================
 st.set_page_config(
     page_title=f"{COMPANY_NAME} - CKD Agent",
@@ -40,158 +88,229 @@ st.markdown("""
     </style>
 """, unsafe_allow_html=True)
 
-# ================= 1. 核心算法区 (KFRE Model 3) =================
-def calculate_kfre_precise(age, sex, egfr, acr):
-    """同时返回 2年 和 5年 风险 (Tangri et al. 2011)"""
-    try:
-        age = float(age)
-        egfr = float(egfr)
-        acr = float(acr)
-        is_male = 1.0 if str(sex).lower() in ['male', '男', 'm', '1'] else 0.0
-        acr_val = acr if acr > 0 else 1.0
-        
-        log_acr = math.log(acr_val)
-        age_scaled = age / 10.0
-        egfr_scaled = egfr / 5.0
-
-        # 系数
-        beta_age = -0.2167; mean_age = 7.0355
-        beta_sex = 0.2694; mean_sex = 0.56422
-        beta_egfr = -0.55418; mean_egfr = 7.2216
-        beta_acr = 0.45608; mean_acr = 5.2774
-
-        lp = (beta_age * (age_scaled - mean_age)) + \
-             (beta_sex * (is_male - mean_sex)) + \
-             (beta_egfr * (egfr_scaled - mean_egfr)) + \
-             (beta_acr * (log_acr - mean_acr))
-
-        S0_5yr = 0.9240; risk_5yr = 1.0 - math.pow(S0_5yr, math.exp(lp))
-        S0_2yr = 0.9832; risk_2yr = 1.0 - math.pow(S0_2yr, math.exp(lp))
-
-        return {"2yr": round(risk_2yr * 100, 2), "5yr": round(risk_5yr * 100, 2)}
-    except Exception as e:
-        return {"error": str(e)}
-
-# ================= 2. 辅助计算工具 (CKD-EPI 2021) =================
-def calculate_egfr_ckdepi(scr_umol, age, sex_str):
-    """根据肌酐(umol/L)计算 eGFR"""
-    try:
-        scr_mgdl = float(scr_umol) / 88.4
-        age_val = float(age)
-        is_male = str(sex_str).lower() in ['male', '男', 'm', '1']
-        
-        kappa = 0.9 if is_male else 0.7
-        alpha = -0.302 if is_male else -0.241
-        
-        factor1 = min(scr_mgdl / kappa, 1) ** alpha
-        factor2 = max(scr_mgdl / kappa, 1) ** -1.209
-        factor3 = 0.993 ** age_val
-        factor4 = 1.018 if not is_male else 1.0
-        
-        egfr = 142 * factor1 * factor2 * factor3 * factor4
-        return round(egfr, 1)
-    except:
-        return None
-
-# ================= 2.1 新增：单位标准化工具函数 =================
-def standardize_uacr(value, unit):
-    if value is None: return None
-    try:
-        val = float(value)
-        u = str(unit).lower().strip()
-        if u in ["mg/g", "ug/mg", "μg/mg"]: return val
-        elif any(x in u for x in ["mg/mmol", "g/mol", "mg/mm"]): return round(val * 8.84, 2)
-        elif "g/g" in u: return val * 1000
-        else: return val
-    except: return None
+# ================= 1. 核心算法区 (KFRE Model 3 / CKD-EPI 2021) =================
+# 评分 / 单位换算 / 提取 / 报告渲染都在 ckd 包内，页面只负责编排。
+# 重依赖按需导入：PIL 只在上传图片时、google.generativeai 只在 Gemini 后端创建时、pyarrow 只在读写病例库缓存时。
+# 标量与批量向量化版本统一放在 ckd.scoring，整队列评分请用 score_cohort
+from ckd.scoring import calculate_kfre_precise, calculate_egfr_ckdepi
+from ckd.units import recompute_uacr, standardize_creatinine, standardize_uacr  # 含批量版本，统一放在 ckd.units
+from ckd.knowledge import retrieve_with_version
+from ckd.report_cache import CACHE_DIR, ReportCache, normalize_patient, report_cache_key
+from ckd.staging import assess
+from ckd.patient_store import PatientStore, patient_from_record
+from ckd.history import HistoryStore
+from ckd.cohort import BREAKDOWNS, UPDATE_MODES, CohortStats, breakdown_rows, risk_histogram_spec, stage_matrix_spec
+from ckd.streaming import IncrementalJSONObjectParser
+from ckd.whatif import HORIZONS, surface_for, what_if, whatif_surface_spec
+from ckd.export import ExportWorker, available_formats, build_document, parse_ids, prepare_from_store
+from ckd.extraction import EXTRACTION_PROMPT, extract_with_backend, extraction_cache_key
+from ckd.images import content_hash, preprocess_image
+from ckd.gate import GATE
+from ckd.llm import get_backend
+from ckd.metrics import get_registry, stage, start_metrics_server
+from ckd.report import (build_expert_prompt, build_rule_report, finish_report, format_bp, history_trend_spec,
+                        make_report_slots, render_report_field, risk_color_for, risk_trajectory_spec)
+
+
+@st.cache_resource
+def get_metrics():
+    """分阶段耗时 / 计数器 (所有会话共用)；滚动日志在第一次记录时才创建"""
+    return get_registry()
+
+
+@st.cache_resource
+def get_report_cache():
+    """进程级共享的报告缓存 (所有会话、所有重跑共用)"""
+    return ReportCache(ttl_seconds=REPORT_CACHE_TTL_HOURS * 3600)
+
+
+@st.cache_resource
+def get_extraction_cache():
+    """化验单提取结果缓存：相同图片内容 + 相同描述直接复用，不再调用模型"""
+    return ReportCache(db_path=os.path.join(CACHE_DIR, "extractions.sqlite"),
+                       ttl_seconds=REPORT_CACHE_TTL_HOURS * 3600)
+
+
+@st.cache_resource
+def get_patient_store():
+    """病例库只解析一次；每次取用时检查文件 mtime，变化才重建"""
+    return PatientStore(PATIENT_DB_PATH)
+
+
+@st.cache_resource
+def get_cohort_stats():
+    """队列聚合按数据文件版本落盘；文件只追加时增量更新，打开队列页只需一次 stat"""
+    return CohortStats(PATIENT_DB_PATH)
+
+
+@st.cache_resource
+def get_history_store():
+    """随访历史库 (SQLite)：写入时增量维护趋势，读取只查一行"""
+    return HistoryStore()
+
+
+@st.cache_resource
+def get_export_worker():
+    """报告导出后台线程池 (进程内共享)；文件写在缓存目录 exports/ 下"""
+    return ExportWorker(max_workers=EXPORT_MAX_WORKERS)
+
+
+@st.cache_resource
+def get_llm(api_key):
+    """模型客户端 (含 genai.configure / GenerativeModel) 在进程内只创建一次，重跑页面直接复用"""
+    GATE.configure(max_concurrency=LLM_MAX_CONCURRENCY, rate_per_minute=LLM_RATE_PER_MINUTE,
+                   queue_timeout=LLM_QUEUE_TIMEOUT)
+    return get_backend(LLM_BACKEND, model_name=MODEL_NAME, api_key=api_key, base_url=LLM_BASE_URL,
+                       proxy=LLM_PROXY, timeout=LLM_TIMEOUT, max_retries=LLM_MAX_RETRIES)
 
 # ================= 3. 智能提取助手 (支持多图 & 单位换算) =================
+# 提示词与单次 / 并行提取逻辑在 ckd.extraction；报告卡片渲染在 ckd.report
 def extract_data_with_gemini(user_input, image_list=None):
-    extraction_prompt = """
-    你是一个专业的医疗数据录入员。请综合阅读【所有上传的图片】和文本，将分散在不同图片上的信息拼凑成一个完整的患者档案。
-    【数值与单位必须分离】
-    在提取 JSON 时，"value" 字段只能包含纯数字（支持小数点），严禁包含文字符号。"unit" 字段单独存放单位。
-    
-    【🔍 视觉扫描策略】
-    1. **基本信息**：寻找 年龄 (Age) 和 性别 (Sex)。
-    2. **生化指标**：寻找 血肌酐 (Creatinine) 和 eGFR。
-    3. **血压和血糖**：
-       - 血压 (BP): 寻找如 "135/85", "BP: 120/70" 等。分离为 sbp 和 dbp。
-       - 血糖: 寻找 糖化血红蛋白 (HbA1c) 或 空腹血糖 (Glucose/Glu)。
-    4. **uACR**: 寻找 "uACR"、"尿微量白蛋白/肌酐比值"。
-    5. **尿液组分**: 尿微量白蛋白 (u_albumin_raw), 尿肌酐 (u_creatinine_raw)。
-
-    【返回 JSON 结构】
-    {
-        "age": 数字, "sex": "Str", "egfr_stated": 数字,
-        "blood_pressure": { "sbp": 数字, "dbp": 数字 }, 
-        "hba1c": { "value": 数字, "unit": "%" },
-        "glucose": { "value": 数字, "unit": "Str" },
-        "creatinine_raw": { "value": 数字, "unit": "Str" },
-        "uacr_raw": { "value": 数字, "unit": "Str" },
-        "u_albumin_raw": { "value": 数字, "unit": "Str" },
-        "u_creatinine_raw": { "value": 数字, "unit": "Str" },
-        "report_summary": "简述提取情况，若血压/血糖缺失请注明。"
-    } 
-    请直接返回 JSON 字符串，不要包含 Markdown 格式。
-    """
     try:
-        inputs = [extraction_prompt]
-        if user_input: inputs.append(f"用户补充描述: {user_input}")
-        if image_list:
-            for i, img in enumerate(image_list):
-                inputs.append(f"【图片 {i+1}】")
-                inputs.append(img)
-        
-        response = model.generate_content(inputs)
-        clean_json = response.text.replace("```json", "").replace("```", "").strip()
-        return json.loads(clean_json)
+        # 多张化验单：每张单独提取并发执行，再在本地合并 (冲突记入 _conflicts)；
+        # 纯文本描述先本地解析，字段齐全时不调用模型
+        return extract_with_backend(get_llm(API_KEY), user_input, image_list, parallel=EXTRACTION_PARALLEL,
+                                    group_size=EXTRACTION_GROUP_SIZE, max_workers=EXTRACTION_MAX_WORKERS,
+                                    local_parser=NOTE_FAST_PATH)
     except Exception as e:
         st.error(f"AI 提取失败: {e}")
         return None
 
+# ================= 3.1 What-if 敏感性分析 =================
+@st.fragment
+def render_whatif(patient, color):
+    """局部重跑：拖动滑块只重跑这个面板 (查缓存的风险曲面 + 两次标量 KFRE)，不触发提取与报告"""
+    with st.expander("🧪 What-if 敏感性分析：治疗后 uACR / eGFR 变化对风险的影响", expanded=False):
+        c1, c2, c3 = st.columns([2, 2, 1.2])
+        uacr_pct = c1.slider("uACR 变化 (%)", -90, 100, 0, step=5, key="whatif_uacr_pct",
+                             help="如 SGLT2i / RASi 治疗后 uACR 下降 30-50%")
+        egfr_delta = c2.slider("eGFR 变化 (ml/min/1.73m²)", -30.0, 20.0, 0.0, step=1.0, key="whatif_egfr_delta")
+        horizon = c3.radio("时限", list(HORIZONS), format_func=HORIZONS.get, key="whatif_horizon")
+        with stage("whatif"):
+            surface = surface_for(patient['age'], patient['sex'])
+            result = what_if(patient['age'], patient['sex'], patient['egfr'], patient['uacr'], egfr_delta, uacr_pct)
+            spec = whatif_surface_spec(surface, horizon, result, color)
+        base, scen = result["baseline"], result["scenario"]
+        if "error" in scen:
+            st.warning(f"情景风险计算失败: {scen['error']}")
+            return
+        m1, m2, m3 = st.columns(3)
+        m1.metric("情景 eGFR / uACR", f"{scen['egfr']} / {scen['uacr']}")
+        m2.metric("情景 5 年风险", f"{scen['5yr']}%", f"{scen['5yr'] - base['5yr']:+.2f}%", delta_color="inverse")
+        m3.metric("情景 2 年风险", f"{scen['2yr']}%", f"{scen['2yr'] - base['2yr']:+.2f}%", delta_color="inverse")
+        st.vega_lite_chart(spec)
+        st.caption(f"风险曲面按 {surface['age']:g} 岁 / {'男' if surface['male'] else '女'} 预先计算并缓存；"
+                   "细线为等风险线，圆点为当前值，菱形为情景值")
+
+# ================= 3.2 报告导出 (后台线程池) =================
+@st.fragment(run_every=1.0)
+def poll_export_job(job_id):
+    """导出进行中时每秒只刷新进度条；完成后整页重跑一次以显示下载按钮"""
+    job = get_export_worker().get(job_id)
+    if job is None or job.finished:
+        st.rerun()
+    st.progress(job.progress, text=f"{'正在取消' if job.cancelled else '正在后台导出'}… {job.summary()}")
+    if job.batch and st.button("⏹️ 取消导出", key=f"export_cancel_{job_id}", disabled=job.cancelled,
+                               help="尚未开始的病例不再导出，已完成的文件照常打包"):
+        get_export_worker().cancel(job_id)
+
+
+def show_export_job(job_id):
+    job = get_export_worker().get(job_id)
+    if job is None:
+        return
+    if not job.finished:
+        poll_export_job(job_id)
+        return
+    st.caption(f"{'⏹️ 导出已取消' if job.cancelled else '✅ 导出完成'}：{job.summary()}")
+    for pid, err in job.failed[:5]:
+        st.warning(f"病例 {pid}: {err}")
+    for path in job.downloads:
+        name = os.path.basename(path)
+        with open(path, "rb") as f:
+            st.download_button(f"⬇️ 下载 {name}", f.read(), file_name=name, key=f"export_dl_{job_id}_{name}")
+
+
+@st.fragment
+def render_export_panel(doc, doc_key):
+    """单份导出：点击只重跑本面板，渲染与写文件在后台线程完成"""
+    with st.expander("📄 导出报告 (HTML / PDF)", expanded=False):
+        formats = st.multiselect("导出格式", available_formats(), default=["html"], key="export_formats")
+        jobs = st.session_state.setdefault('export_jobs', {})
+        if st.button("生成导出文件", key="export_submit", disabled=not formats):
+            jobs[doc_key] = get_export_worker().submit_document(doc, formats).id
+        if doc_key in jobs:
+            show_export_job(jobs[doc_key])
+        if "pdf" not in available_formats():
+            st.caption("PDF 导出需安装 reportlab；HTML 可在浏览器中直接打印为 PDF")
+
 # ================= 4. 主界面逻辑 =================
 # 不要直接写 KEY，改为从 Streamlit 的“秘密管理”中读取
 try:
     API_KEY = st.secrets["GEMINI_API_KEY"]
 except:
-    # 如果本地运行没有配置 secrets，可以留个后手手动输入
-    API_KEY = st.sidebar.text_input("🔑 请输入 API Key", type="password")
+    # 如果本地运行没有配置 secrets，可以留个后手手动输入 (替身服务等 HTTP 后端不需要)
+    API_KEY = st.sidebar.text_input("🔑 请输入 API Key", type="password") if LLM_BACKEND == "gemini" else ""
 
-if not API_KEY:
+if LLM_BACKEND == "gemini" and not API_KEY:
     st.warning("👈 请在左侧侧边栏输入 API Key，或者在 Streamlit 后台配置 Secrets")
     st.stop()
 
-genai.configure(api_key=API_KEY)
-model = genai.GenerativeModel('gemini-3-pro-preview') 
+# 后端实例按配置在进程内共享，重跑页面不会重复创建客户端
+llm = get_llm(API_KEY)
 
 st.title("🧬 智能慢性肾病早筛系统")
 st.caption(f"Benchmark: Roche KlinRisk | Powered by {COMPANY_NAME}")
 
-tab1, tab2 = st.tabs(["📂 数据库选择", "✨ 智能录入 (多图识别)"])
+tab1, tab2, tab3 = st.tabs(["📂 数据库选择", "✨ 智能录入 (多图识别)", "📊 队列分析"])
 current_patient = None
 
 # --- Tab 1: 数据库模式 ---
 with tab1:
+    store = None
     try:
-        df = pd.read_csv("cleaned_kidney_data.csv")
-        patient_list = df['id'].tolist()
+        with stage("patient_store_load"):
+            store = get_patient_store()
+            store.refresh()
+    except Exception as e:
+        st.error(f"病例库加载失败 ({PATIENT_DB_PATH}): {e}")
+
+    if store is not None:
+        c_search, c_page = st.columns([3, 1])
+        with c_search:
+            id_query = st.text_input("🔎 按病例 ID 前缀搜索", placeholder=f"共 {len(store)} 例，留空则按顺序分页")
+        n_match = store.count(id_query)
+        n_pages = max(1, -(-n_match // PATIENT_PAGE_SIZE))
+        with c_page:
+            page_no = st.number_input(f"页码 (共 {n_pages} 页)", min_value=1, max_value=n_pages, value=1)
+
+        patient_list = store.page(int(page_no) - 1, PATIENT_PAGE_SIZE, id_query)
+        if not patient_list:
+            st.info("没有匹配的病例 ID")
         selected_id = st.selectbox("选择标准病例 ID", patient_list)
         
-        raw_patient = df[df['id'] == selected_id].iloc[0]
+        with stage("patient_lookup"):
+            raw_patient = store.get(selected_id)
         
-        current_patient = {
-            "age": raw_patient['age'], "sex": raw_patient['sex'],
-            "egfr": raw_patient['egfr'], "uacr": raw_patient['uacr'],
-            "source": f"Database ID: {selected_id}",
-            "htn": raw_patient.get('htn', 'Unknown'), 
-            "dm": raw_patient.get('dm', 'Unknown'), 
-            "bp": {"sbp": raw_patient.get('sbp'), "dbp": raw_patient.get('dbp')} if 'sbp' in raw_patient else None,
-            "glucose": None, 
-            "hba1c": None
-        }
-    except Exception as e:
-        pass
+        if raw_patient is not None:
+            current_patient = patient_from_record(raw_patient, selected_id)
+
+        # 批量导出：后台并行，优先复用报告缓存；需要模型的病例按 batch 优先级排队，不挤占页面请求
+        with st.expander("📦 批量导出报告", expanded=False):
+            ids_text = st.text_area("病例 ID (逗号、空格或换行分隔)", key="batch_export_ids",
+                                    placeholder=f"留空则导出当前页全部 {len(patient_list)} 例")
+            batch_formats = st.multiselect("导出格式", available_formats(), default=["html"], key="batch_export_formats")
+            cached_only = st.checkbox("仅复用已缓存的报告 (没有缓存且需要模型的病例跳过，不调用模型)",
+                                      key="batch_export_cached_only")
+            if st.button("开始批量导出", key="batch_export_submit", disabled=not batch_formats):
+                prepare = partial(prepare_from_store, store, llm=llm, report_cache=get_report_cache(),
+                                  model_name=MODEL_NAME, history=get_history_store(), company=COMPANY_NAME,
+                                  kb_top_k=KB_TOP_K, kb_budget=KB_TOKEN_BUDGET, gating=LLM_GATING,
+                                  cached_only=cached_only)
+                ids = parse_ids(ids_text) or patient_list
+                st.session_state['batch_export_job'] = get_export_worker().submit_batch(ids, prepare, batch_formats).id
+            if st.session_state.get('batch_export_job'):
+                show_export_job(st.session_state['batch_export_job'])
 
 # --- Tab 2: 智能录入模式 (支持多图) ---
 with tab2:
@@ -204,13 +323,36 @@ with tab2:
 
     if extract_btn:
         with st.spinner("Gemini 正在阅读所有化验单..."):
-            image_contents = []
-            if uploaded_files:
-                for f in uploaded_files:
-                    image_contents.append(Image.open(f))
+            raw_files = [f.getvalue() for f in uploaded_files or []]
+            if raw_files:
                 with col_preview:
-                    st.image(image_contents[0], caption=f"共上传 {len(image_contents)} 张", use_column_width=True)
-            st.session_state['raw_data_cache'] = extract_data_with_gemini(user_text, image_contents)
+                    st.image(raw_files[0], caption=f"共上传 {len(raw_files)} 张", use_column_width=True)
+
+            extraction_cache = get_extraction_cache()
+            extract_key = extraction_cache_key(
+                user_text, [content_hash(b) for b in raw_files], MODEL_NAME, EXTRACTION_PROMPT,
+                max_edge=IMAGE_MAX_EDGE, grayscale=IMAGE_GRAYSCALE, quality=IMAGE_JPEG_QUALITY)
+            raw_data = extraction_cache.get(extract_key)
+            if raw_data is not None:
+                get_metrics().increment("llm_calls_avoided", reason="extraction_cache")
+                st.caption("⚡ 相同化验单与描述，已复用上次提取结果 (未调用模型)")
+            else:
+                image_contents, bytes_in, bytes_out = [], 0, 0
+                for b in raw_files:
+                    blob, _, img_stats = preprocess_image(b, IMAGE_MAX_EDGE, IMAGE_GRAYSCALE, IMAGE_JPEG_QUALITY)
+                    image_contents.append(blob)
+                    bytes_in += img_stats["original_bytes"]
+                    bytes_out += img_stats["sent_bytes"]
+                if raw_files:
+                    st.session_state['img_bytes_in'] = st.session_state.get('img_bytes_in', 0) + bytes_in
+                    st.session_state['img_bytes_out'] = st.session_state.get('img_bytes_out', 0) + bytes_out
+                    st.caption(f"🗜️ 图片预处理：{bytes_in / 1024:.0f} KB → {bytes_out / 1024:.0f} KB "
+                               f"(节省 {1 - bytes_out / max(bytes_in, 1):.0%})")
+                raw_data = extract_data_with_gemini(user_text, image_contents)
+                # 部分失败 (某组图片 / 模型补全出错) 的结果不缓存，下次上传相同内容时重新提取
+                if raw_data and not raw_data.get("_errors"):
+                    extraction_cache.put(extract_key, raw_data)
+            st.session_state['raw_data_cache'] = raw_data
 
     if st.session_state.get('raw_data_cache'):
         raw_data = st.session_state['raw_data_cache']
@@ -234,35 +376,17 @@ with tab2:
         u_cre = raw_data.get("u_creatinine_raw") or {}
         
         # 1. 优先逻辑：利用原始白蛋白 + 原始肌酐进行精准重算
-        # 只有当两个字典都不为空，且都有 "value" 时才计算
-        if isinstance(u_alb, dict) and isinstance(u_cre, dict) and u_alb.get("value") and u_cre.get("value"):
-            try:
-                alb_val = float(u_alb["value"])
-                cre_val = float(u_cre["value"])
-                # 预处理单位字符串：去除空格、转小写、处理特殊字符
-                cre_unit = str(u_cre.get("unit", "")).lower().replace(" ", "")
-                
-                # 识别 umol/L 并强制转换为 mmol/L
-                if any(x in cre_unit for x in ["umol", "μmol", "um/l", "μm/l"]):
-                    cre_val = cre_val / 1000.0
-                
-                # 计算比值 (mg/mmol)
-                if cre_val > 0: # 防止除以0
-                    ratio_mg_mmol = alb_val / cre_val
-                    # 转换为标准单位 mg/g
-                    temp_patient["uacr"] = round(ratio_mg_mmol * 8.84, 2)
-                    calc_success = True
-                    
-                    st.success(f"✅ 原始值重算成功：uACR 为 **{temp_patient['uacr']} mg/g**")
-                    
-                    if temp_patient["uacr"] > 300:
-                        st.error("🚨 警告：该患者处于 A3 期 (重度增加)，属于极高危状态！")
-                    elif temp_patient["uacr"] >= 30:
-                        st.warning("⚠️ 提示：该患者处于 A2 期 (中度增加)。")
-            except Exception as e:
-                # 计算出错也不要崩，直接pass
-                print(f"uACR calc error: {e}")
-                pass
+        recomputed = recompute_uacr(u_alb, u_cre)
+        if recomputed is not None:
+            temp_patient["uacr"] = recomputed
+            calc_success = True
+            
+            st.success(f"✅ 原始值重算成功：uACR 为 **{temp_patient['uacr']} mg/g**")
+            
+            if temp_patient["uacr"] > 300:
+                st.error("🚨 警告：该患者处于 A3 期 (重度增加)，属于极高危状态！")
+            elif temp_patient["uacr"] >= 30:
+                st.warning("⚠️ 提示：该患者处于 A2 期 (中度增加)。")
 
         # 2. 备选逻辑：如果无法重算，则使用 AI 直接提取的 uACR 值
         if not calc_success:
@@ -277,19 +401,27 @@ with tab2:
                         st.info(f"✅ 提取 uACR 成功: {std_val} mg/g")
 
         # 3. 冲突核验：如果 AI 提取的汇总值与我们重算的值差异过大，发出预警
-        if calc_success and raw_data.get("uacr_raw", {}).get("value"):
+        if calc_success and (raw_data.get("uacr_raw") or {}).get("value"):
             extracted_val = standardize_uacr(raw_data["uacr_raw"]["value"], raw_data["uacr_raw"].get("unit"))
             if extracted_val and abs(temp_patient["uacr"] - extracted_val) / extracted_val > 0.2:
                 st.warning(f"⚖️ 数据冲突提醒：重算值 ({temp_patient['uacr']}) 与报告汇总值 ({extracted_val}) 差异较大，请手动核对原始图片。")
 
-        # eGFR 自动补算
+        # eGFR 自动补算 (肌酐先统一到 umol/L：化验单常见 mg/dL)
         cr = raw_data.get("creatinine_raw", {})
         if temp_patient["egfr"] is None and cr and cr.get("value") and temp_patient["age"] and temp_patient["sex"]:
-            temp_patient["egfr"] = calculate_egfr_ckdepi(cr["value"], temp_patient["age"], temp_patient["sex"])
+            scr_umol = standardize_creatinine(cr["value"], cr.get("unit"))
+            temp_patient["egfr"] = calculate_egfr_ckdepi(scr_umol, temp_patient["age"], temp_patient["sex"])
             if temp_patient["egfr"]: st.info(f"💡 eGFR 自动补算: {temp_patient['egfr']}")
 
         st.write(f"**识别摘要**: {raw_data.get('report_summary')}")
 
+        # 多图合并：不同化验单取值不一致 / 部分图片提取失败时提示人工核对
+        for c in raw_data.get("_conflicts") or []:
+            cands = "；".join(f"{', '.join(x['sources'])}: {x['value']}" for x in c["candidates"])
+            st.warning(f"⚖️ 多图取值冲突 `{c['field']}`：{cands} → 已采用 {c['chosen']}")
+        for err in raw_data.get("_errors") or []:
+            st.warning(f"⚠️ {err['source']} 提取失败，已跳过：{err['error']}")
+
         # 缺项检查
         missing = []
         if not temp_patient["age"]: missing.append("年龄")
@@ -337,6 +469,11 @@ with tab2:
                 safe_a1c = float(raw_a1c) if raw_a1c is not None else 0.0
                 new_hba1c = st.number_input("HbA1c (%)", value=safe_a1c)
 
+            # 填写病例 ID 后本次结果计入随访历史 (可与数据库病例 ID 相同，用于录入复查结果)
+            c4, c5 = st.columns(2)
+            with c4: new_pid = st.text_input("病例 ID (可选，计入随访记录)")
+            with c5: new_date = st.date_input("检验日期")
+
             if st.form_submit_button("✅ 提交并分析"):
                 bp_data = {"sbp": new_sbp, "dbp": new_dbp} if new_sbp > 0 else None
                 hba1c_data = {"value": new_hba1c, "unit": "%"} if new_hba1c > 0 else None
@@ -344,13 +481,46 @@ with tab2:
                     "age": new_age, "sex": new_sex, "egfr": new_egfr, "uacr": new_uacr,
                     "bp": bp_data, "hba1c": hba1c_data, 
                     "glucose": temp_patient.get("glucose"),
-                    "source": "AI + Manual Edit"
+                    "source": "AI + Manual Edit",
+                    "patient_id": new_pid.strip() or None,
+                    "taken_at": new_date.isoformat(),
                 }
                 st.rerun()
 
     if st.session_state.get('confirmed_patient'):
         current_patient = st.session_state['confirmed_patient']
 
+# --- Tab 3: 队列分析 (物化聚合，不逐例计算) ---
+with tab3:
+    try:
+        with stage("cohort_load"):
+            cohort_stats = get_cohort_stats()
+            cohort = cohort_stats.refresh()
+        total = cohort["n"]
+        stage_n = cohort["stage"]
+        advanced = sum(v for k, v in stage_n.items() if k.split(" ")[0] in ("G3a", "G3b", "G4", "G5"))
+        refer = sum(g["refer_n"] for g in cohort["groups"]["sex"].values())
+        m1, m2, m3 = st.columns(3)
+        with m1: st.metric("队列人数", f"{total:,}")
+        with m2: st.metric("eGFR < 60 (G3a-G5)", f"{advanced / total:.1%}" if total else "—")
+        with m3: st.metric("KFRE 5年 ≥ 3%", f"{refer / total:.1%}" if total else "—")
+
+        c_matrix, c_hist = st.columns(2)
+        with c_matrix:
+            st.markdown("#### KDIGO 分期矩阵 (人数)")
+            st.vega_lite_chart(stage_matrix_spec(cohort))
+        with c_hist:
+            st.markdown("#### KFRE 5 年风险分布")
+            st.vega_lite_chart(risk_histogram_spec(cohort))
+
+        dim = st.radio("分组维度", list(BREAKDOWNS), format_func=BREAKDOWNS.get, horizontal=True)
+        st.dataframe(breakdown_rows(cohort, dim), hide_index=True)
+        upd = cohort_stats.last_update
+        st.caption(f"聚合随数据文件版本缓存 · 最近一次更新：{UPDATE_MODES[upd['mode']]}，"
+                   f"读入 {upd['rows']:,} 行，用时 {upd['seconds']:.2f}s")
+    except Exception as e:
+        st.warning(f"队列统计不可用: {e}")
+
 # ================= 5. 分析与报告生成 =================
 if current_patient:
     st.markdown("---")
@@ -360,8 +530,7 @@ if current_patient:
     with c2: st.metric("eGFR", f"{current_patient['egfr']} ml/min")
     with c3: st.metric("uACR", f"{current_patient['uacr']} mg/g")
     
-    bp_dict = current_patient.get('bp') or {}
-    bp_str = f"{bp_dict.get('sbp', '?')}/{bp_dict.get('dbp', '?')}" if bp_dict.get('sbp') else "未见数据"
+    bp_str = format_bp(current_patient)
     with c4: st.metric("当前血压", bp_str)
 
     glu_str_list = []
@@ -370,7 +539,27 @@ if current_patient:
     with c5: st.metric("代谢指标", " / ".join(glu_str_list) if glu_str_list else "未见数据")
 
     with st.spinner("正在进行 KFRE 风险演算..."):
-        risks = calculate_kfre_precise(current_patient['age'], current_patient['sex'], current_patient['egfr'], current_patient['uacr'])
+        with stage("kfre"):
+            risks = calculate_kfre_precise(current_patient['age'], current_patient['sex'], current_patient['egfr'], current_patient['uacr'])
+        # 随访历史：新录入的结果先写入 (同一会话同一结果只写一次)，再取增量维护的趋势
+        trend = None
+        patient_id = current_patient.get("patient_id")
+        if patient_id:
+            try:
+                with stage("history"):
+                    history = get_history_store()
+                    if current_patient.get("taken_at"):
+                        entry = (patient_id, current_patient["taken_at"], current_patient['egfr'], current_patient['uacr'])
+                        recorded = st.session_state.setdefault('history_recorded', set())
+                        if entry not in recorded:
+                            history.add_result(*entry, risks=risks)
+                            recorded.add(entry)
+                    trend = history.trend(patient_id)
+            except Exception as e:
+                st.warning(f"随访历史读写失败: {e}")
+        with stage("rule_engine"):
+            assessment = assess(current_patient['egfr'], current_patient['uacr'], risks,
+                                egfr_slope=trend["egfr_slope"] if trend else None)
     
     if "error" not in risks:
         risk_5yr = risks['5yr']
@@ -378,134 +567,163 @@ if current_patient:
         
         with col_dash:
             st.markdown("### 📉 5年肾衰风险")
-            risk_color = "#2E7D32" if risk_5yr < 3 else "#F9A825" if risk_5yr < 5 else "#D32F2F"
+            risk_color = risk_color_for(risk_5yr)
             st.markdown(f"<h1 style='color:{risk_color};font-size:72px;margin:0;'>{risk_5yr}%</h1>", unsafe_allow_html=True)
             st.info(f"🚨 **2年近期风险**: {risks['2yr']}%")
+            if assessment["heatmap"]:
+                st.caption(f"KDIGO 分期 **{assessment['gfr_category']}{assessment['albuminuria_category']}** · "
+                           f"热图{assessment['risk_level']} · 监测 {assessment['monitoring']}")
+            for reason in assessment["referral"]:
+                st.warning(f"🏥 {reason}")
             
-            chart_data = pd.DataFrame({
-                "Year": ["Y0","Y1","Y2","Y3","Y4","Y5"], 
-                "Risk": [0, risk_5yr*0.2, risks['2yr'], risk_5yr*0.6, risk_5yr*0.8, risk_5yr]
-            })
-            st.area_chart(chart_data, x="Year", y="Risk", color=risk_color)
+            if trend and trend["n"] >= 2:
+                slope = f"{trend['egfr_slope']:+.1f}/年" if trend["egfr_slope"] is not None else "随访不足 90 天"
+                risk_change = f"{trend['risk_5yr_change']:+.2f}%" if trend["risk_5yr_change"] is not None else "—"
+                st.caption(f"随访 {trend['n']} 次 ({trend['first_date']} → {trend['last_date']}) · eGFR 年变化 {slope} · "
+                           f"较首次下降 {trend['egfr_decline_pct']:.1f}% · 5年风险变化 {risk_change}")
+                st.vega_lite_chart(history_trend_spec(history.series(patient_id, limit=HISTORY_CHART_POINTS), risk_color))
+            else:
+                st.vega_lite_chart(risk_trajectory_spec(risks, risk_color))
+
+        # What-if 面板放在两栏下方，但先于报告生成执行，不必等模型返回
+        with st.container():
+            render_whatif(current_patient, risk_color)
 
         with col_rpt:
             st.markdown("### 📋 AI 临床决策支持报告")
             
-            # 读取知识库
-            try:
-                with open("kdigo_guidelines_2024.txt", "r", encoding="utf-8") as f: kb_kdigo = f.read()
-                with open("中国慢性肾脏病早期评价与管理指南 (2023).txt", "r", encoding="utf-8") as f: kb_china = f.read()
-                with open("Comprehensive Clinical Nephrology .txt", "r", encoding="utf-8") as f: kb_ccn = f.read()
-                kb_all = f"{kb_kdigo}\n\n{kb_china}\n\n{kb_ccn}"
-            except: 
-                kb_all = "知识库文件缺失，请检查路径。"
+            # 常规病例由本地规则引擎出报告；用户点击按钮后该病例改走模型
+            force_key = json.dumps(normalize_patient(current_patient), sort_keys=True)
+            forced = st.session_state.setdefault('force_llm_report', set())
+            use_template = LLM_GATING and assessment["routine"] and force_key not in forced
+
+            if use_template:
+                kb_all, kb_version = "", "rules"
+            else:
+                # 检索知识库：本地 BM25 索引 (源文件 mtime 变化时自动重建)，只取相关段落
+                try:
+                    with stage("kb_retrieval") as m:
+                        kb_all, kb_version = retrieve_with_version(current_patient, k=KB_TOP_K, token_budget=KB_TOKEN_BUDGET)
+                        m["kb_chars"] = len(kb_all)
+                    if not kb_all: kb_all = "知识库文件缺失，请检查路径。"
+                except Exception:
+                    kb_all = "知识库文件缺失，请检查路径。"
+                    kb_version = "missing"
             
-            # 【关键修复】构建详细结构的 Prompt，强制模型输出对象而非字符串
-            expert_prompt = f"""
-            你是一位专业的肾脏病专家。请基于以下知识库分析患者情况。
-            知识库：{kb_all}
-            患者数据：Age {current_patient['age']}, eGFR {current_patient['egfr']}, uACR {current_patient['uacr']}, BP {bp_str}
-            
-            请严格按照以下 JSON 结构输出 (不要 Markdown):
-            {{
-                "expert_assessment": {{ "content": "专家深度综述..." }},
-                "diagnosis": {{ "summary": "诊断结论", "detail": "详细分期说明", "citation": "依据" }},
-                "referral": {{ "advice": "转诊建议", "citation": "依据" }},
-                "medications": [
-                    {{ "drug": "SGLT2i/RASi等", "status": "推荐/不推荐/待评估", "reason": "...", "citation": "..." }}
-                ],
-                "lifestyle": {{ "advice": "...", "citation": "..." }}
-            }}
-            """
+            # 【关键修复】构建详细结构的 Prompt，强制模型输出对象而非字符串 (模板见 ckd.report)
+            expert_prompt = build_expert_prompt(current_patient, kb_all, bp_str)
 
+            raw_text = ""
+            parser = IncrementalJSONObjectParser()
+            report_source = None
             try:
-                # 配置模型输出
-                safe_config = genai.types.GenerationConfig(
-                    temperature=0.2,
-                    response_mime_type="application/json"
-                )
-
-                with st.spinner("Gemini 正在进行深度推理..."):
-                    res = model.generate_content(expert_prompt, generation_config=safe_config)
-                    report = json.loads(res.text)
-                
-                # --- 0. 专家点评 ---
-                assess = report.get('expert_assessment', {})
-                # 容错处理：如果 assess 是字符串（虽然不太可能），转为字典
-                if isinstance(assess, str): assess = {"content": assess}
-                
-                st.markdown(f"""
-                <div class="expert-card">
-                    <h4 style="margin:0 0 10px 0; color:#F57F17; font-size:1.1em;">🧠 首席专家深度综述</h4>
-                    <p style="margin:0; color:#333; line-height:1.6; font-size:1.05em; font-weight:500;">
-                        {assess.get('content', '未生成点评内容')}
-                    </p>
-                </div>
-                """, unsafe_allow_html=True)
-
-                # --- 1. 诊断与转诊 ---
-                # 【容错修复】检查类型，如果是字符串，手动包装成字典，防止报错
-                diag = report.get('diagnosis', {})
-                if isinstance(diag, str): diag = {"summary": diag, "detail": "详见综述", "citation": "N/A"}
-                
-                ref = report.get('referral', {})
-                if isinstance(ref, str): ref = {"advice": ref, "citation": "N/A"}
-
-                c1, c2 = st.columns(2)
-                with c1:
-                    st.markdown(f"""
-                    <div style="background-color:#E3F2FD; padding:15px; border-radius:10px; border-left: 5px solid #2196F3; margin-bottom:15px;">
-                        <h4 style="margin:0; color:#0D47A1;">🩺 诊断: {diag.get('summary', '未知')}</h4>
-                        <p style="margin:8px 0; color:#333;">{diag.get('detail', '暂无详情')}</p>
-                        <div style="font-size:0.85em; color:#546E7A; border-top:1px dashed #BBDEFB; padding-top:5px;">📚 {diag.get('citation', 'N/A')}</div>
-                    </div>
-                    """, unsafe_allow_html=True)
-                with c2:
-                    st.markdown(f"""
-                    <div style="background-color:#E8F5E9; padding:15px; border-radius:10px; border-left: 5px solid #4CAF50; margin-bottom:15px;">
-                        <h4 style="margin:0; color:#1B5E20;">🏥 转诊建议</h4>
-                        <p style="margin:8px 0; color:#333;">{ref.get('advice', '暂无建议')}</p>
-                        <div style="font-size:0.85em; color:#558B2F; border-top:1px dashed #C8E6C9; padding-top:5px;">📚 {ref.get('citation', 'N/A')}</div>
-                    </div>
-                    """, unsafe_allow_html=True)
-
-                # --- 2. 药物列表 ---
-                st.markdown("#### 💊 循证用药筛查")
-                meds = report.get("medications", [])
-                
-                for drug in meds:
-                    # 【容错修复】如果 drug 是字符串（比如 AI 返回了文本列表），将其转化为对象
-                    if isinstance(drug, str):
-                        drug = {"drug": drug, "status": "提示", "reason": "详情请见综述", "citation": "N/A"}
-                        
-                    is_positive = "推荐" in drug.get('status', '') and "不" not in drug.get('status', '')
-                    icon, color = ("✅", "#1B5E20") if is_positive else ("⚠️", "#B71C1C")
-                    st.markdown(f"""
-                    <div style="border:1px solid #eee; background-color:#FAFAFA; padding:12px; border-radius:8px; margin-bottom:10px;">
-                        <div style="display:flex; justify-content:space-between; align-items:center;">
-                            <strong>{icon} {drug.get('drug')}</strong>
-                            <span style="background-color:{color}; color:white; padding:2px 8px; border-radius:12px; font-size:0.8em;">{drug.get('status')}</span>
-                        </div>
-                        <div style="margin-top:8px; color:#444;">{drug.get('reason')}</div>
-                        <div style="margin-top:5px; font-size:0.8em; color:#999; text-align:right;">📖 依据: {drug.get('citation', 'N/A')}</div>
-                    </div>
-                    """, unsafe_allow_html=True)
-
-                # --- 3. 生活方式 ---
-                life = report.get('lifestyle', {})
-                # 【容错修复】
-                if isinstance(life, str): life = {"advice": life, "citation": "N/A"}
-                
-                st.markdown("#### 🥗 生活方式管理")
-                st.markdown(f"""
-                <div style="border-left: 3px solid #FF9800; padding-left:10px; color:#555;">
-                    {life.get('advice', '暂无建议')}<br>
-                    <span style="font-size:0.8em; color:#999;">📖 {life.get('citation', 'N/A')}</span>
-                </div>
-                """, unsafe_allow_html=True)
+                report_cache = get_report_cache()
+                cache_key = report_cache_key(current_patient, kb_version, MODEL_NAME)
+                report = None if use_template else report_cache.get(cache_key)
+                slots = make_report_slots()
+                if use_template:
+                    # 同一会话内同一病例只计一次 (不走规则时，后续重跑本来也会命中报告缓存)
+                    counted = st.session_state.setdefault('rule_report_counted', set())
+                    if force_key not in counted:
+                        counted.add(force_key)
+                        get_metrics().increment("llm_calls_avoided", reason="rule_engine")
+                    st.caption("📋 常规管理病例：已按本地 KDIGO 规则生成报告，未调用模型")
+                    report, report_source = build_rule_report(current_patient, assessment, risks), "rule"
+                    for key, value in report.items():
+                        render_report_field(slots, key, value)
+                elif report is not None:
+                    get_metrics().increment("llm_calls_avoided", reason="report_cache")
+                    st.caption("⚡ 已命中报告缓存 (相同病例与知识库版本)，未重新调用模型")
+                    report_source = "cache"
+                    for key, value in report.items(): render_report_field(slots, key, value)
+                elif REPORT_STREAMING:
+                    # 流式模式：每个字段一闭合就先画出对应卡片
+                    parse_s = 0.0
+                    with st.spinner("Gemini 正在进行深度推理..."), \
+                         stage("llm_report", streaming=True, request_chars=len(expert_prompt)) as m:
+                        t_start = time.perf_counter()
+                        # 配置模型输出：JSON 模式，低温度
+                        get_metrics().increment("llm_calls", kind="report")
+                        stream = llm.generate(expert_prompt, json_output=True, temperature=0.2, stream=True)
+                        for text in stream:
+                            m.setdefault("ttfb_s", round(time.perf_counter() - t_start, 4))
+                            t0 = time.perf_counter()
+                            events = parser.feed(text)
+                            parse_s += time.perf_counter() - t0
+                            for path, value in events:
+                                render_report_field(slots, path, value)
+                        m.update(response_chars=len(stream.text), **stream.usage)
+                    get_metrics().record("json_parse", parse_s, source="report", streaming=True)
+                    raw_text = parser.text
+                    report = parser.result if parser.done else json.loads(raw_text)
+                    report_cache.put(cache_key, report)
+                    report_source = "llm"
+                else:
+                    with st.spinner("Gemini 正在进行深度推理..."):
+                        with stage("llm_report", streaming=False, request_chars=len(expert_prompt)) as m:
+                            get_metrics().increment("llm_calls", kind="report")
+                            res = llm.generate(expert_prompt, json_output=True, temperature=0.2)
+                            m.update(response_chars=len(res.text), **res.usage)
+                        raw_text = res.text
+                        with stage("json_parse", source="report"):
+                            report = json.loads(raw_text)
+                    report_cache.put(cache_key, report)
+                    report_source = "llm"
+                    for key, value in report.items(): render_report_field(slots, key, value)
+                finish_report(slots)
 
             except Exception as e:
                 st.error(f"决策引擎异常: {e}")
 
-                if 'res' in locals(): st.text_area("原始响应内容", res.text)
-
+                raw_text = raw_text or parser.text
+                if raw_text: st.text_area("原始响应内容", raw_text)
+
+            if report_source:
+                render_export_panel(build_document(current_patient, risks, assessment, report, report_source,
+                                                   trend=trend, company=COMPANY_NAME), f"{force_key}|{report_source}")
+
+            if use_template:
+                # 回调在下一次重跑之前执行，点击后直接走模型，不会先再渲染一遍模板
+                st.button("🧠 仍然生成 AI 专家报告", on_click=forced.add, args=(force_key,))
+
+
+# ================= 6. 侧边栏：缓存统计 =================
+report_cache = get_report_cache()
+extraction_cache = get_extraction_cache()
+with st.sidebar.expander("⚡ 缓存统计", expanded=False):
+    for label, cache in [("报告", report_cache), ("化验单提取", extraction_cache)]:
+        st.caption(
+            f"**{label}** 内存命中 {cache.stats['memory_hits']} · 磁盘命中 {cache.stats['disk_hits']} · "
+            f"未命中 {cache.stats['misses']} · 命中率 {cache.hit_rate:.0%}"
+        )
+    metrics = get_metrics()
+    st.caption(
+        f"**模型调用** 实际 {metrics.counter('llm_calls') - metrics.counter('llm_calls_coalesced')} 次 · "
+        f"跨会话合并 {metrics.counter('llm_calls_coalesced')} 次 · 规则引擎免调用 "
+        f"{metrics.counter('llm_calls_avoided', reason='rule_engine')} 次 · 本地解析免调用 "
+        f"{metrics.counter('llm_calls_avoided', reason='note_parser')} 次 · 缓存免调用 "
+        f"{metrics.counter('llm_calls_avoided', reason='report_cache') + metrics.counter('llm_calls_avoided', reason='extraction_cache')} 次"
+    )
+    gate_stats = GATE.limiter.stats
+    if gate_stats["active"] or gate_stats["queued"]:
+        st.caption(f"**模型调用队列** 进行中 {gate_stats['active']} · 排队 {gate_stats['queued']}")
+    img_in, img_out = st.session_state.get('img_bytes_in', 0), st.session_state.get('img_bytes_out', 0)
+    if img_in:
+        st.caption(f"**图片预处理** 累计节省 {(img_in - img_out) / 1024:.0f} KB ({1 - img_out / img_in:.0%})")
+    if st.button("清空缓存"):
+        report_cache.clear()
+        extraction_cache.clear()
+
+# ================= 7. 性能指标导出 / 管理面板 =================
+if METRICS_PORT:
+    start_metrics_server(METRICS_PORT, METRICS_HOST)
+
+if ADMIN_PANEL:
+    with st.sidebar.expander("📊 性能指标 (p50 / p95)", expanded=False):
+        rows = get_metrics().summary()
+        if rows:
+            st.dataframe([{k: round(v, 1) if isinstance(v, float) else v for k, v in r.items()} for r in rows],
+                         hide_index=True)
+        else:
+            st.caption("暂无数据")
+        st.download_button("导出 Prometheus 文本", get_metrics().render_prometheus(), file_name="ckd_metrics.prom")
@@ -0,0 +1 @@
+"""性能基准套件，入口见 benchmarks/run.py。"""
@@ -0,0 +1,116 @@
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from benchmarks.common import REPO_DIR
+
+APP_PATH = os.path.join(REPO_DIR, "app9.py")
+
+
+def start_standin(report_latency=0.0, extract_latency=0.0):
+    """在后台线程启动 LLM 替身服务 (端口随机)，作为整页重跑时的假模型"""
+    from ckd.standin_server import make_server
+    server = make_server("127.0.0.1", 0, report_latency=report_latency, extract_latency=extract_latency,
+                         jitter=0.0, chunk_delay=0.0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def _timed(fn):
+    t0 = time.perf_counter()
+    fn()
+    return time.perf_counter() - t0
+
+
+def _summary(name, samples, **extra):
+    samples = sorted(samples)
+    out = {
+        "scenario": name,
+        "runs": len(samples),
+        "min_s": samples[0],
+        "median_s": samples[len(samples) // 2],
+        "p95_s": samples[min(len(samples) - 1, int(round(0.95 * (len(samples) - 1))))],
+        "max_s": samples[-1],
+    }
+    out.update(extra)
+    print(f"  {name:32s} median {out['median_s'] * 1e3:9.1f} ms   p95 {out['p95_s'] * 1e3:9.1f} ms   (n={len(samples)})")
+    return out
+
+
+def _new_app(AppTest):
+    at = AppTest.from_file(APP_PATH, default_timeout=120)
+    at.secrets["GEMINI_API_KEY"] = "benchmark"
+    return at
+
+
+def _check(at, scenario):
+    if at.exception:
+        raise RuntimeError(f"{scenario}: 页面脚本异常 {at.exception[0].value}")
+
+
+def run(reruns=10, report_latency=0.0, extract_latency=0.0):
+    """用 Streamlit AppTest 驱动 app9.py 整页重跑，LLM 由本地替身服务代替"""
+    # CKD_CACHE_DIR 在 ckd.report_cache 导入时读取一次；已被提前导入时临时目录不生效，基准会写进 (并读到) 真实缓存
+    if "ckd.report_cache" in sys.modules:
+        raise RuntimeError("ckd.report_cache 已在整页基准之前导入，无法隔离缓存目录；请在新进程中运行")
+    cache_dir = tempfile.mkdtemp(prefix="ckd-bench-cache-")
+    server = start_standin(report_latency, extract_latency)
+    host, port = server.server_address
+    env = {
+        "CKD_LLM_BACKEND": "http",
+        "CKD_LLM_BASE_URL": f"http://{host}:{port}",
+        "CKD_CACHE_DIR": cache_dir,
+    }
+    old_env = {k: os.environ.get(k) for k in env}
+    os.environ.update(env)
+    old_cwd = os.getcwd()
+    os.chdir(REPO_DIR)
+    try:
+        from streamlit.testing.v1 import AppTest
+        results = []
+
+        # Tab 1：冷启动 (进程内首次执行，含模块导入、病例库解析、知识库索引)
+        at = _new_app(AppTest)
+        cold = _timed(at.run)
+        _check(at, "tab1_cold_start")
+        results.append(_summary("tab1_cold_start", [cold]))
+
+        # Tab 1：无交互重跑 (报告命中缓存)
+        samples = []
+        for _ in range(reruns):
+            samples.append(_timed(at.run))
+            _check(at, "tab1_rerun_cached")
+        results.append(_summary("tab1_rerun_cached", samples))
+
+        # Tab 1：切换病例 (每次都是新病例 → 完整报告链路)
+        ids = list(at.selectbox[0].options)
+        samples = []
+        for pid in ids[1:reruns + 1]:
+            samples.append(_timed(lambda: at.selectbox[0].select(pid).run()))
+            _check(at, "tab1_switch_patient")
+        results.append(_summary("tab1_switch_patient", samples, report_latency_s=report_latency))
+
+        # Tab 2：文本录入 → 提取 → 提交表单 (每轮文本不同，避免命中提取缓存)
+        extract_samples, submit_samples = [], []
+        for i in range(reruns):
+            at = _new_app(AppTest)
+            at.run()
+            at.text_area[0].input(f"基准测试病例 {i} 男 62岁").run()
+            button = next(b for b in at.button if "提取" in b.label)
+            extract_samples.append(_timed(lambda: button.click().run()))
+            _check(at, "tab2_extract")
+            submit = next(b for b in at.button if "提交并分析" in b.label)
+            submit_samples.append(_timed(lambda: submit.click().run()))
+            _check(at, "tab2_submit")
+        results.append(_summary("tab2_extract", extract_samples, extract_latency_s=extract_latency))
+        results.append(_summary("tab2_submit_and_report", submit_samples, report_latency_s=report_latency))
+        return results
+    finally:
+        os.chdir(old_cwd)
+        for k, v in old_env.items():
+            if v is None: os.environ.pop(k, None)
+            else: os.environ[k] = v
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,48 @@
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from benchmarks.common import measure
+
+DAY = 86400.0
+
+
+def run(patients=100_000, results_per_patient=20, lookups=2000, repeat=5):
+    """随访历史库：批量导入后，单病例趋势读取 / 新结果写入 / 明细读取的单次耗时"""
+    from ckd.history import HistoryStore
+
+    tmp = tempfile.mkdtemp(prefix="ckd-bench-history-")
+    store = HistoryStore(os.path.join(tmp, "history.sqlite"))
+    rng = random.Random(0)
+    try:
+        t0 = time.perf_counter()
+        rows = ({"patient_id": p, "taken_at": 1.5e9 + k * 90 * DAY, "egfr": 90 - k * rng.uniform(0, 3),
+                 "uacr": 40.0, "risk_2yr": 1.0, "risk_5yr": 3.0 + k * 0.1}
+                for k in range(results_per_patient) for p in range(patients))
+        written, _ = store.add_many(rows)
+        load_s = time.perf_counter() - t0
+        print(f"  history_bulk_load                {load_s:9.1f} s    ({written} 条)")
+
+        next_day = iter(range(10_000_000))
+        cases = {
+            "history_trend": lambda: [store.trend(rng.randrange(patients)) for _ in range(lookups)],
+            "history_add_result": lambda: [store.add_result(rng.randrange(patients), 1.5e9 + (3000 + next(next_day)) * DAY,
+                                                            45.0, 60.0, {"2yr": 2.0, "5yr": 6.0})
+                                           for _ in range(lookups)],
+            "history_series_50": lambda: [store.series(rng.randrange(patients), limit=50) for _ in range(lookups)],
+        }
+        results = []
+        for name, fn in cases.items():
+            stats = measure(fn, repeat=repeat)
+            # measure 统计的是 lookups 次调用的总耗时，这里折算成单次
+            for key in ("min_s", "median_s", "p95_s", "max_s"):
+                stats[key] /= lookups
+            stats.update(scenario=name, patients=patients, rows=written)
+            print(f"  {name:32s} median {stats['median_s'] * 1e6:9.1f} us   (n={lookups}×{repeat})")
+            results.append(stats)
+        return results
+    finally:
+        store.close()
+        shutil.rmtree(tmp, ignore_errors=True)
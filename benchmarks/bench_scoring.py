@@ -0,0 +1,74 @@
+import numpy as np
+import pandas as pd
+
+from benchmarks.common import measure
+from ckd.scoring import (
+    calculate_egfr_ckdepi,
+    calculate_egfr_ckdepi_batch,
+    calculate_kfre_batch,
+    calculate_kfre_precise,
+)
+from ckd.units import recompute_uacr, recompute_uacr_batch, standardize_uacr, standardize_uacr_batch
+
+SIZES = [1, 10, 100, 1_000, 10_000, 100_000, 1_000_000]
+
+
+def make_cohort(n, seed=0):
+    """生成与 cleaned_kidney_data.csv 分布相近的随机队列 (含混合单位列)"""
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "age": rng.integers(18, 90, n).astype(float),
+        "sex": rng.choice(["Male", "Female", "男", "女"], n),
+        "scr_umol": rng.uniform(40, 900, n).round(0),
+        "egfr": rng.uniform(5, 120, n).round(1),
+        "uacr": rng.uniform(1, 3000, n).round(1),
+        "uacr_unit": rng.choice(["mg/g", "mg/mmol", "g/g"], n, p=[0.6, 0.35, 0.05]),
+        "u_alb": rng.uniform(1, 300, n).round(1),
+        "u_cre": rng.uniform(1000, 20000, n).round(0),
+        "u_cre_unit": rng.choice(["umol/L", "mmol/L"], n),
+    })
+
+
+def _scalar_cases(df):
+    cols = {c: df[c].tolist() for c in df.columns}
+    n = len(df)
+    return {
+        "kfre": lambda: [calculate_kfre_precise(cols["age"][i], cols["sex"][i], cols["egfr"][i], cols["uacr"][i])
+                         for i in range(n)],
+        "egfr_ckdepi": lambda: [calculate_egfr_ckdepi(cols["scr_umol"][i], cols["age"][i], cols["sex"][i])
+                                for i in range(n)],
+        "standardize_uacr": lambda: [standardize_uacr(cols["uacr"][i], cols["uacr_unit"][i]) for i in range(n)],
+        "recompute_uacr": lambda: [recompute_uacr({"value": cols["u_alb"][i]},
+                                                  {"value": cols["u_cre"][i], "unit": cols["u_cre_unit"][i]})
+                                   for i in range(n)],
+    }
+
+
+def _batch_cases(df):
+    return {
+        "kfre": lambda: calculate_kfre_batch(df["age"], df["sex"], df["egfr"], df["uacr"]),
+        "egfr_ckdepi": lambda: calculate_egfr_ckdepi_batch(df["scr_umol"], df["age"], df["sex"]),
+        "standardize_uacr": lambda: standardize_uacr_batch(df["uacr"], df["uacr_unit"]),
+        "recompute_uacr": lambda: recompute_uacr_batch(df["u_alb"], df["u_cre"], df["u_cre_unit"]),
+    }
+
+
+def run(sizes=SIZES, scalar_max=100_000, repeat=5):
+    """逐函数、逐规模计时；标量路径超过 scalar_max 行时跳过 (纯 Python 循环太慢)"""
+    results = []
+    for n in sizes:
+        df = make_cohort(n)
+        # 小规模单次调用太快，合并多次调用以降低计时噪声
+        number = max(1, 10_000 // max(n, 1))
+        rep = repeat if n < 1_000_000 else max(2, repeat // 2)
+        for mode, cases in (("scalar", _scalar_cases(df)), ("batch", _batch_cases(df))):
+            if mode == "scalar" and n > scalar_max:
+                continue
+            for name, fn in cases.items():
+                stats = measure(fn, repeat=rep, number=number)
+                stats.update({"function": name, "mode": mode, "rows": n,
+                              "rows_per_s": n / stats["median_s"] if stats["median_s"] else None})
+                results.append(stats)
+                print(f"  {name:18s} {mode:6s} n={n:>9,d}  median {stats['median_s'] * 1e3:10.3f} ms"
+                      f"  ({stats['rows_per_s']:,.0f} rows/s)")
+    return results
@@ -0,0 +1,96 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+from benchmarks.bench_app import APP_PATH, start_standin
+from benchmarks.common import REPO_DIR
+
+# 页面冷启动时不应被加载的重依赖：只在对应路径 (Gemini 后端 / 上传图片 / 批量评分) 上才导入
+HEAVY_MODULES = ["google.generativeai", "PIL.Image", "pyarrow", "requests", "numpy", "pandas"]
+
+# 在全新子进程里执行：导入耗时不受当前进程已加载模块的影响
+_IMPORT_SNIPPET = """
+import json, sys, time
+t0 = time.perf_counter()
+import {modules}
+print(json.dumps({{"seconds": time.perf_counter() - t0,
+                  "loaded": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+_APP_SNIPPET = """
+import json, sys, time
+t0 = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+t_import = time.perf_counter() - t0
+at = AppTest.from_file({app!r}, default_timeout=120)
+at.secrets["GEMINI_API_KEY"] = "benchmark"
+t0 = time.perf_counter(); at.run(); first = time.perf_counter() - t0
+if at.exception: raise SystemExit(str(at.exception[0].value))
+reruns = []
+for _ in range({reruns}):
+    t0 = time.perf_counter(); at.run(); reruns.append(time.perf_counter() - t0)
+print(json.dumps({{"streamlit_import_s": t_import, "first_run_s": first, "reruns_s": reruns,
+                  "loaded": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def _run_snippet(code, env=None):
+    proc = subprocess.run([sys.executable, "-c", code], cwd=REPO_DIR, capture_output=True, text=True,
+                          env=env, timeout=600)
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else "子进程失败")
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def _summary(name, samples, **extra):
+    samples = sorted(samples)
+    out = {
+        "scenario": name,
+        "runs": len(samples),
+        "min_s": samples[0],
+        "median_s": statistics.median(samples),
+        "max_s": samples[-1],
+    }
+    out.update(extra)
+    print(f"  {name:32s} median {out['median_s'] * 1e3:9.1f} ms   (n={len(samples)})")
+    return out
+
+
+def run(repeat=5, reruns=5):
+    """新进程冷启动：ckd 包导入耗时 + app9.py 首次执行 / 无交互重跑耗时"""
+    results = []
+
+    # 只测本仓库代码带来的导入开销 (不含 streamlit)：
+    #   light = 页面编排用到、不应牵出 numpy / pandas / PIL 的模块；full = 再加上评分与单位换算
+    cases = {
+        "startup_import_ckd_light": "ckd, ckd.gate, ckd.llm, ckd.extraction, ckd.images, ckd.report, ckd.streaming, ckd.history, ckd.ingest, ckd.cohort, ckd.whatif, ckd.export",
+        "startup_import_ckd_full": "ckd.scoring, ckd.units, ckd.patient_store",
+    }
+    for name, modules in cases.items():
+        samples, loaded = [], []
+        for _ in range(repeat):
+            out = _run_snippet(_IMPORT_SNIPPET.format(modules=modules, heavy=HEAVY_MODULES))
+            samples.append(out["seconds"])
+            loaded = out["loaded"]
+        results.append(_summary(name, samples, heavy_modules_loaded=loaded))
+
+    server = start_standin()
+    host, port = server.server_address
+    env = dict(os.environ, CKD_LLM_BACKEND="http", CKD_LLM_BASE_URL=f"http://{host}:{port}",
+               CKD_CACHE_DIR=tempfile.mkdtemp(prefix="ckd-bench-startup-"))
+    try:
+        first, rerun = [], []
+        for _ in range(repeat):
+            out = _run_snippet(_APP_SNIPPET.format(app=APP_PATH, reruns=reruns, heavy=HEAVY_MODULES), env=env)
+            first.append(out["first_run_s"])
+            rerun.append(statistics.median(out["reruns_s"]))
+            loaded = out["loaded"]
+        results.append(_summary("startup_app_first_run", first, heavy_modules_loaded=loaded))
+        results.append(_summary("startup_app_rerun", rerun))
+    finally:
+        server.shutdown()
+        server.server_close()
+    return results
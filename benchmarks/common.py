@@ -0,0 +1,52 @@
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def measure(fn, repeat=5, number=1, warmup=1):
+    """重复调用 fn，返回每次调用耗时的统计 (秒)"""
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for _ in range(number):
+            fn()
+        samples.append((time.perf_counter() - t0) / number)
+    samples.sort()
+    return {
+        "min_s": samples[0],
+        "median_s": statistics.median(samples),
+        "p95_s": samples[min(len(samples) - 1, int(round(0.95 * (len(samples) - 1))))],
+        "max_s": samples[-1],
+        "repeat": repeat,
+        "number": number,
+    }
+
+
+def environment():
+    """记录运行环境，便于对比不同版本的结果"""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR,
+                                capture_output=True, text=True, timeout=10).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    versions = {}
+    for mod in ("numpy", "pandas", "streamlit"):
+        try:
+            versions[mod] = __import__(mod).__version__
+        except ImportError:
+            versions[mod] = None
+    return {
+        "commit": commit,
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "packages": versions,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    }
@@ -0,0 +1,102 @@
+"""性能基准：评分函数吞吐 + 整页重跑延迟 + 冷启动耗时 + 随访历史库读写，结果写入 JSON 便于版本间对比。
+
+    python -m benchmarks.run                          # 全量，输出 bench_results.json
+    python -m benchmarks.run --skip-app --sizes 1,1000,1000000
+    python -m benchmarks.run --only-startup           # 只测新进程冷启动 (导入 + 首次执行 + 重跑)
+    python -m benchmarks.run --skip-app --skip-startup --history-patients 100000
+    python -m benchmarks.run --baseline old.json      # 与旧结果对比，退化超过阈值时退出码为 1
+"""
+import argparse
+import json
+import sys
+
+from benchmarks import bench_app, bench_scoring, bench_startup
+from benchmarks.common import environment
+
+
+SECTIONS = ("scoring", "app", "startup", "history")
+
+
+def _key(entry):
+    if "scenario" in entry:
+        return ("app", entry["scenario"])
+    return ("scoring", entry["function"], entry["mode"], entry["rows"])
+
+
+def compare(current, baseline, threshold):
+    """按 median 对比；当前/基线 > threshold 记为退化"""
+    base = {_key(e): e for section in SECTIONS for e in baseline.get(section, [])}
+    regressions = []
+    for section in SECTIONS:
+        for entry in current.get(section, []):
+            old = base.get(_key(entry))
+            if not old or not old.get("median_s"):
+                continue
+            ratio = entry["median_s"] / old["median_s"]
+            entry["baseline_median_s"] = old["median_s"]
+            entry["ratio_vs_baseline"] = ratio
+            if ratio > threshold:
+                regressions.append((_key(entry), ratio))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="CKD Agent 性能基准")
+    parser.add_argument("--out", default="bench_results.json")
+    parser.add_argument("--sizes", default=",".join(str(n) for n in bench_scoring.SIZES),
+                        help="评分基准的行数列表 (逗号分隔)")
+    parser.add_argument("--scalar-max", type=int, default=100_000, help="标量循环的最大行数")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--reruns", type=int, default=10, help="每个页面场景的重跑次数")
+    parser.add_argument("--report-latency", type=float, default=0.0, help="替身服务的报告延迟 (秒)")
+    parser.add_argument("--extract-latency", type=float, default=0.0, help="替身服务的提取延迟 (秒)")
+    parser.add_argument("--skip-scoring", action="store_true")
+    parser.add_argument("--skip-app", action="store_true")
+    parser.add_argument("--skip-startup", action="store_true")
+    parser.add_argument("--skip-history", action="store_true")
+    parser.add_argument("--history-patients", type=int, default=100_000, help="随访历史库基准的病例数")
+    parser.add_argument("--only-startup", action="store_true", help="跳过评分与整页重跑，只测冷启动")
+    parser.add_argument("--baseline", help="旧版本的结果 JSON")
+    parser.add_argument("--threshold", type=float, default=1.25, help="退化判定倍数")
+    args = parser.parse_args(argv)
+
+    if args.only_startup:
+        args.skip_scoring = args.skip_app = args.skip_history = True
+        args.skip_startup = False
+
+    results = {"environment": environment(), "scoring": [], "app": [], "startup": [], "history": []}
+    if not args.skip_scoring:
+        print("== 评分函数 ==")
+        sizes = [int(x) for x in args.sizes.split(",") if x]
+        results["scoring"] = bench_scoring.run(sizes, scalar_max=args.scalar_max, repeat=args.repeat)
+    if not args.skip_app:
+        print("== 整页重跑 (AppTest + 替身模型) ==")
+        results["app"] = bench_app.run(reruns=args.reruns, report_latency=args.report_latency,
+                                       extract_latency=args.extract_latency)
+    if not args.skip_startup:
+        print("== 冷启动 (新进程：导入 + 首次执行 + 重跑) ==")
+        results["startup"] = bench_startup.run(repeat=args.repeat, reruns=args.reruns)
+    if not args.skip_history:
+        print("== 随访历史库 (SQLite 增量趋势) ==")
+        from benchmarks import bench_history  # 导入即加载 ckd.report_cache；放在整页基准之后，见 bench_app.run
+        results["history"] = bench_history.run(patients=args.history_patients, repeat=args.repeat)
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.threshold)
+
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"结果已写入 {args.out}")
+
+    if regressions:
+        print(f"⚠️ 发现 {len(regressions)} 项退化 (> {args.threshold}x)：")
+        for key, ratio in regressions:
+            print(f"  {key}: {ratio:.2f}x")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
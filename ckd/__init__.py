@@ -0,0 +1,19 @@
+"""CKD Agent 核心计算包：可脱离 Streamlit 页面单独导入。
+
+评分函数按需从 ckd.scoring 取出：只导入 ckd.llm / ckd.report 等子模块时不会顺带加载 numpy / pandas。
+"""
+
+__all__ = [
+    "calculate_kfre_precise",
+    "calculate_egfr_ckdepi",
+    "calculate_kfre_batch",
+    "calculate_egfr_ckdepi_batch",
+    "score_cohort",
+]
+
+
+def __getattr__(name):
+    if name in __all__:
+        from ckd import scoring
+        return getattr(scoring, name)
+    raise AttributeError(f"module 'ckd' has no attribute {name!r}")
@@ -0,0 +1,279 @@
+"""队列分析：KDIGO 分期矩阵、KFRE 风险分布、按 htn / dm / 性别 / 年龄段的分组统计。
+
+聚合结果全部是可相加的计数与求和，按数据文件版本落盘 (.ckd_cache/<name>.cohort.json)：
+- 文件未变化：直接用内存 / 磁盘里的聚合结果，打开页面只需一次 stat；
+- 文件只在末尾追加了行 (原有内容的首尾校验不变)：只读取并聚合新增部分，再与旧结果相加；
+- 其他修改：分块全量重建 (内存占用与文件大小无关)。
+
+    python -m ckd.cohort cleaned_kidney_data.csv       # 预先生成 / 更新聚合结果
+"""
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+
+from ckd.report_cache import CACHE_DIR
+from ckd.staging import KFRE_PRIMARY_CARE_5YR, heatmap_color
+
+AGG_VERSION = 1
+READ_CHUNK_ROWS = 200_000
+_HASH_BYTES = 64 * 1024
+
+G_CATS = ["G1", "G2", "G3a", "G3b", "G4", "G5"]
+A_CATS = ["A1", "A2", "A3"]
+UNSTAGED = "未分期"
+RISK_BINS = [0, 1, 3, 5, 10, 20, 40]
+RISK_LABELS = ["<1%", "1-3%", "3-5%", "5-10%", "10-20%", "20-40%", "≥40%"]
+NO_RISK = "无法计算"
+AGE_BINS = [40, 50, 60, 70, 80]
+AGE_LABELS = ["<40", "40-49", "50-59", "60-69", "70-79", "≥80"]
+BREAKDOWNS = {"htn": "高血压", "dm": "糖尿病", "sex": "性别", "age_band": "年龄段"}
+GROUP_FIELDS = ["n", "egfr_n", "egfr_sum", "risk_n", "risk_sum", "refer_n"]
+UPDATE_MODES = {"cached": "复用磁盘缓存", "append": "增量追加", "rebuild": "全量重建"}
+
+
+# ================= 聚合 (单块向量化) 与合并 =================
+def _bincount(codes, size, weights=None):
+    import numpy as np
+    return np.bincount(codes, weights=weights, minlength=size)[:size]
+
+
+def aggregate_frame(df):
+    """病例 DataFrame (age / sex / egfr / uacr / htn / dm) → 可相加的聚合 dict。
+
+    分期、风险区间与分组都先转成整数编码，再用 bincount 计数 / 求和，避免逐行构造字符串。
+    """
+    import numpy as np
+    import pandas as pd
+
+    from ckd.scoring import _as_float, _male_mask, calculate_kfre_batch
+    from ckd.staging import GFR_THRESHOLDS
+
+    n = len(df)
+    col = lambda name: df[name] if name in df else pd.Series([None] * n, index=df.index, dtype="object")
+    egfr, uacr, age = _as_float(col("egfr")), _as_float(col("uacr")), _as_float(col("age"))
+    male = _male_mask(col("sex"))
+    risk = calculate_kfre_batch(age, col("sex"), egfr, uacr)["5yr"]
+
+    # 与 gfr_category / albuminuria_category 相同的阈值；编码 = G 序号 × 3 + A 序号，缺失记为最后一格
+    gfr_bins = sorted(t for t, _ in GFR_THRESHOLDS)
+    g_idx = len(gfr_bins) - np.digitize(egfr, gfr_bins)
+    a_idx = (uacr >= 30).astype(int) + (uacr > 300)
+    staged = ~np.isnan(egfr) & ~np.isnan(uacr)
+    n_cells = len(G_CATS) * len(A_CATS)
+    stage_counts = _bincount(np.where(staged, g_idx * len(A_CATS) + a_idx, n_cells), n_cells + 1)
+    stage_labels = [f"{g} {a}" for g in G_CATS for a in A_CATS] + [UNSTAGED]
+
+    has_risk = ~np.isnan(risk)
+    risk_code = np.where(has_risk, np.digitize(np.nan_to_num(risk), RISK_BINS[1:]), len(RISK_LABELS))
+    risk_counts = _bincount(risk_code, len(RISK_LABELS) + 1)
+
+    weights = {
+        "n": None, "egfr_n": (~np.isnan(egfr)).astype(float), "egfr_sum": np.nan_to_num(egfr),
+        "risk_n": has_risk.astype(float), "risk_sum": np.nan_to_num(risk),
+        "refer_n": (has_risk & (np.nan_to_num(risk) >= KFRE_PRIMARY_CARE_5YR)).astype(float),
+    }
+    dims = {
+        "sex": (male.astype(int), ["Female", "Male"]),
+        "age_band": (np.where(np.isnan(age), len(AGE_LABELS), np.digitize(np.nan_to_num(age), AGE_BINS)),
+                     AGE_LABELS + ["未知"]),
+    }
+    for dim in ("htn", "dm"):
+        codes, uniques = pd.factorize(col(dim).astype("object").map(lambda v: str(v).strip() or "Unknown", na_action="ignore"))
+        labels = [str(u) for u in uniques] + ["Unknown"]
+        dims[dim] = (np.where(codes < 0, len(uniques), codes), labels)
+
+    groups = {}
+    for dim in BREAKDOWNS:
+        codes, labels = dims[dim]
+        sums = {f: _bincount(codes, len(labels), w) for f, w in weights.items()}
+        groups[dim] = {}
+        for i, label in enumerate(labels):
+            if sums["n"][i]:
+                entry = groups[dim].setdefault(label, dict.fromkeys(GROUP_FIELDS, 0.0))
+                for f in GROUP_FIELDS:
+                    entry[f] += float(sums[f][i])
+
+    return {
+        "n": n,
+        "stage": {label: int(c) for label, c in zip(stage_labels, stage_counts) if c},
+        "risk_hist": {label: int(c) for label, c in zip(RISK_LABELS + [NO_RISK], risk_counts) if c},
+        "groups": groups,
+    }
+
+
+def empty_aggregate():
+    return {"n": 0, "stage": {}, "risk_hist": {}, "groups": {dim: {} for dim in BREAKDOWNS}}
+
+
+def merge_aggregates(a, b):
+    """两份聚合结果逐项相加 (嵌套 dict)"""
+    if a is None: return b
+    if b is None: return a
+    if isinstance(a, dict):
+        out = dict(a)
+        for k, v in b.items():
+            out[k] = merge_aggregates(a.get(k), v)
+        return out
+    return a + b
+
+
+# ================= 按文件版本缓存 + 追加增量更新 =================
+def _digest(path, start, end):
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        f.seek(max(start, 0))
+        h.update(f.read(max(end - max(start, 0), 0)))
+    return h.hexdigest()
+
+
+def _fingerprint(path, offset):
+    """已聚合部分 [0, offset) 的首尾校验：追加写入不会改变它们"""
+    return [_digest(path, 0, min(offset, _HASH_BYTES)), _digest(path, offset - _HASH_BYTES, offset)]
+
+
+def _ends_with_newline(path, offset):
+    """offset 之前的最后一个字节是否为换行：不是的话上次聚合时末行尚未写完，追加内容会接在它后面"""
+    if offset <= 0:
+        return False
+    with open(path, "rb") as f:
+        f.seek(offset - 1)
+        return f.read(1) == b"\n"
+
+
+class CohortStats:
+    def __init__(self, csv_path, cache_dir=CACHE_DIR):
+        self.csv_path = csv_path
+        name = os.path.splitext(os.path.basename(csv_path))[0]
+        self.state_path = os.path.join(cache_dir, f"{name}.cohort.json")
+        self._lock = threading.Lock()
+        self._state = None
+        self.last_update = None  # {"mode": "cached" / "append" / "rebuild", "rows", "seconds"}
+
+    def _load_state(self):
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+            return state if state.get("version") == AGG_VERSION else None
+        except (OSError, ValueError):
+            return None
+
+    def _save_state(self, state):
+        try:
+            os.makedirs(os.path.dirname(self.state_path) or ".", exist_ok=True)
+            tmp = f"{self.state_path}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(state, f, ensure_ascii=False)
+            os.replace(tmp, self.state_path)
+        except OSError:
+            pass  # 目录只读时只保留内存结果
+
+    def _aggregate_from(self, offset, columns=None):
+        """从字节偏移 offset 起分块读取并聚合；offset 为 0 时读表头。返回 (聚合, 列名, 行数)"""
+        import pandas as pd
+        with open(self.csv_path, "rb") as f:
+            f.seek(offset)
+            if offset == 0:
+                reader = pd.read_csv(f, chunksize=READ_CHUNK_ROWS)
+            else:
+                reader = pd.read_csv(f, chunksize=READ_CHUNK_ROWS, header=None, names=columns)
+            agg, rows = None, 0
+            for chunk in reader:
+                columns = list(chunk.columns)
+                agg = merge_aggregates(agg, aggregate_frame(chunk))
+                rows += len(chunk)
+        return agg, columns, rows
+
+    def refresh(self):
+        """返回当前数据文件对应的聚合结果；文件未变化时只有一次 stat"""
+        st_ = os.stat(self.csv_path)
+        signature = [st_.st_mtime_ns, st_.st_size]
+        if self._state is not None and self._state["source"] == signature:
+            return self._state["agg"]
+        with self._lock:
+            state = self._state or self._load_state()
+            t0 = time.perf_counter()
+            if state is not None and state["source"] == signature:
+                mode, rows = "cached", 0
+            elif (state is not None and st_.st_size > state["offset"]
+                  and _ends_with_newline(self.csv_path, state["offset"])
+                  and _fingerprint(self.csv_path, state["offset"]) == state["fingerprint"]):
+                mode = "append"
+                agg, _, rows = self._aggregate_from(state["offset"], state["columns"])
+                state = dict(state, agg=merge_aggregates(state["agg"], agg) if agg else state["agg"])
+            else:
+                mode = "rebuild"
+                agg, columns, rows = self._aggregate_from(0)
+                state = {"version": AGG_VERSION, "columns": columns, "agg": agg or empty_aggregate()}
+            if mode != "cached":
+                state.update(source=signature, offset=st_.st_size,
+                             fingerprint=_fingerprint(self.csv_path, st_.st_size))
+                self._save_state(state)
+            self._state = state
+            self.last_update = {"mode": mode, "rows": rows, "seconds": time.perf_counter() - t0}
+            return state["agg"]
+
+
+# ================= 展示用：分期矩阵 / 风险分布 / 分组表 =================
+_HEAT_RANGE = {"green": "#A5D6A7", "yellow": "#FFF59D", "orange": "#FFCC80", "red": "#EF9A9A"}
+
+
+def stage_matrix_spec(agg):
+    """GFR × 白蛋白尿 分期矩阵 (KDIGO 热图配色 + 人数标注) 的 Vega-Lite 规格"""
+    values = []
+    for g in G_CATS:
+        for a in A_CATS:
+            count = agg["stage"].get(f"{g} {a}", 0)
+            values.append({"G": g, "A": a, "n": count, "share": count / agg["n"] if agg["n"] else 0,
+                           "heat": heatmap_color(g, a)})
+    enc = {"x": {"field": "A", "type": "ordinal", "sort": A_CATS, "title": "白蛋白尿", "axis": {"labelAngle": 0}},
+           "y": {"field": "G", "type": "ordinal", "sort": G_CATS, "title": "GFR"}}
+    return {
+        "data": {"values": values},
+        "encoding": enc,
+        "layer": [
+            {"mark": "rect", "encoding": {"color": {"field": "heat", "type": "nominal", "legend": None,
+                                                    "scale": {"domain": list(_HEAT_RANGE),
+                                                              "range": list(_HEAT_RANGE.values())}}}},
+            {"mark": {"type": "text", "fontSize": 13},
+             "encoding": {"text": {"field": "n", "type": "quantitative", "format": ","}}},
+        ],
+    }
+
+
+def risk_histogram_spec(agg, color="#0E4D92"):
+    """KFRE 5 年风险分布 (按风险区间计数) 的 Vega-Lite 规格"""
+    values = [{"band": label, "n": agg["risk_hist"].get(label, 0)} for label in RISK_LABELS]
+    return {
+        "data": {"values": values},
+        "mark": {"type": "bar", "color": color},
+        "encoding": {
+            "x": {"field": "band", "type": "ordinal", "sort": RISK_LABELS, "title": "KFRE 5 年风险",
+                  "axis": {"labelAngle": 0}},
+            "y": {"field": "n", "type": "quantitative", "title": "人数"},
+        },
+    }
+
+
+def breakdown_rows(agg, dim):
+    """分组统计表：人数、占比、平均 eGFR、平均 5 年风险、达到转诊阈值的比例"""
+    rows = []
+    for key, g in sorted(agg["groups"].get(dim, {}).items(), key=lambda kv: -kv[1]["n"]):
+        rows.append({
+            BREAKDOWNS[dim]: key,
+            "人数": int(g["n"]),
+            "占比 %": round(g["n"] / agg["n"] * 100, 1) if agg["n"] else 0.0,
+            "平均 eGFR": round(g["egfr_sum"] / g["egfr_n"], 1) if g["egfr_n"] else None,
+            "平均 5 年风险 %": round(g["risk_sum"] / g["risk_n"], 2) if g["risk_n"] else None,
+            f"风险 ≥ {KFRE_PRIMARY_CARE_5YR:g}% 占比": round(g["refer_n"] / g["risk_n"] * 100, 1) if g["risk_n"] else None,
+        })
+    return rows
+
+
+if __name__ == "__main__":
+    stats = CohortStats(sys.argv[1] if len(sys.argv) > 1 else "cleaned_kidney_data.csv")
+    agg = stats.refresh()
+    print(f"{stats.last_update['mode']}: 新读入 {stats.last_update['rows']} 行，队列共 {agg['n']} 例，"
+          f"用时 {stats.last_update['seconds']:.2f}s → {stats.state_path}")
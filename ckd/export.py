@@ -0,0 +1,618 @@
+"""报告导出：结构化报告 + 核心指标 + 风险走势图 → 可交给患者 / 归档的 HTML 或 PDF。
+
+- HTML 自包含 (内联 CSS + SVG 图表)，报告卡片与页面同一套版式 (ckd.report.*_html)，浏览器可直接打印；
+- PDF 需要可选依赖 reportlab，未安装时只提供 HTML；中文字体优先嵌入 CKD_PDF_FONT 或系统里常见的 TrueType 中文字体，
+  都没有时退回 reportlab 内置的 STSong-Light (不嵌入，需阅读器自带中文字体包)；
+- ExportWorker 在后台线程池里渲染并写文件，页面只负责提交任务和轮询进度；
+- 批量模式按病例 ID 并行导出：先查报告缓存，常规病例用规则模板，其余以 batch 优先级调用模型
+  (与页面请求共用 ckd.gate 的全局限流，页面请求优先)。
+
+    python -m ckd.export 1 2 3 --format html,pdf     # 只复用缓存 / 规则模板，不调用模型
+"""
+import argparse
+import html
+import importlib.util
+import itertools
+import json
+import os
+import re
+import shutil
+import sys
+import threading
+import time
+import zipfile
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from ckd.gate import BATCH
+from ckd.metrics import get_registry, stage
+from ckd.report import (assessment_html, build_expert_prompt, build_rule_report, diagnosis_html, format_bp,
+                        lifestyle_html, medication_html, referral_html, risk_color_for, risk_trajectory_values)
+from ckd.report_cache import CACHE_DIR, report_cache_key
+
+EXPORT_DIR = os.path.join(CACHE_DIR, "exports")
+FORMATS = ("html", "pdf")
+MAX_JOBS_KEPT = 20          # 内存里保留的导出任务数；更早的任务连同文件一起清理
+REPORT_SOURCES = {"rule": "本地 KDIGO 规则模板", "cache": "AI 专家报告 (缓存)", "llm": "AI 专家报告"}
+# 可嵌入的 TrueType 中文字体 (.ttc 取第一个子字体)；OpenType/CFF 字体 (如 Noto CJK、苹方) reportlab 无法使用
+PDF_FONT_CANDIDATES = [
+    os.environ.get("CKD_PDF_FONT", ""),
+    "C:/Windows/Fonts/msyh.ttc", "C:/Windows/Fonts/simhei.ttf", "C:/Windows/Fonts/simsun.ttc",
+    "/usr/share/fonts/truetype/wqy/wqy-microhei.ttc", "/usr/share/fonts/truetype/wqy/wqy-zenhei.ttc",
+    "/usr/share/fonts/wqy-microhei/wqy-microhei.ttc", "/usr/share/fonts/truetype/droid/DroidSansFallbackFull.ttf",
+    "/Library/Fonts/Arial Unicode.ttf", "/System/Library/Fonts/Supplemental/Arial Unicode.ttf",
+]
+DISCLAIMER = "本报告由系统根据化验指标与临床指南自动生成，仅供临床参考，不能替代医生的诊断与处方。"
+
+
+class ExportError(RuntimeError):
+    pass
+
+
+def pdf_available():
+    return importlib.util.find_spec("reportlab") is not None
+
+
+def available_formats():
+    return [f for f in FORMATS if f != "pdf" or pdf_available()]
+
+
+# ================= 1. 报告获取 (缓存 → 规则模板 → 模型) =================
+def resolve_report(patient, risks, assessment, llm=None, report_cache=None, model_name=None,
+                   kb_top_k=6, kb_budget=1500, gating=True, cached_only=False):
+    """与页面相同的报告来源顺序；返回 (report, 来源)。cached_only 且无缓存时返回 (None, "missing")"""
+    if gating and assessment["routine"]:
+        get_registry().increment("llm_calls_avoided", reason="rule_engine")
+        return build_rule_report(patient, assessment, risks), "rule"
+
+    from ckd.knowledge import retrieve_with_version
+    with stage("kb_retrieval", batch=True):
+        kb_text, kb_version = retrieve_with_version(patient, k=kb_top_k, token_budget=kb_budget)
+    key = report_cache_key(patient, kb_version, model_name)
+    report = report_cache.get(key) if report_cache is not None else None
+    if report is not None:
+        get_registry().increment("llm_calls_avoided", reason="report_cache")
+        return report, "cache"
+    if cached_only or llm is None:
+        return None, "missing"
+
+    prompt = build_expert_prompt(patient, kb_text or "知识库文件缺失，请检查路径。", format_bp(patient))
+    with stage("llm_report", streaming=False, batch=True, request_chars=len(prompt)) as m:
+        get_registry().increment("llm_calls", kind="report_batch")
+        res = llm.generate(prompt, json_output=True, temperature=0.2, priority=BATCH)
+        m.update(response_chars=len(res.text), **res.usage)
+    report = json.loads(res.text)
+    if report_cache is not None:
+        report_cache.put(key, report)
+    return report, "llm"
+
+
+def build_document(patient, risks, assessment, report, source, trend=None, company=""):
+    """导出文档的全部内容 (纯数据，可直接 json.dumps)"""
+    return {
+        "title": "慢性肾病临床决策支持报告",
+        "company": company,
+        "generated_at": time.strftime("%Y-%m-%d %H:%M"),
+        "patient": {
+            "id": patient.get("patient_id"), "source": patient.get("source"),
+            "age": patient.get("age"), "sex": patient.get("sex"),
+            "egfr": patient.get("egfr"), "uacr": patient.get("uacr"), "bp": format_bp(patient),
+            "htn": patient.get("htn"), "dm": patient.get("dm"),
+        },
+        "risks": {"2yr": risks["2yr"], "5yr": risks["5yr"]},
+        "assessment": {k: assessment.get(k) for k in
+                       ("gfr_category", "albuminuria_category", "risk_level", "monitoring", "referral")},
+        "trend": trend if trend and trend.get("n", 0) >= 2 else None,
+        "trajectory": risk_trajectory_values(risks),
+        "color": risk_color_for(risks["5yr"]),
+        "report": report,
+        "report_source": source,
+    }
+
+
+def prepare_document(patient, llm=None, report_cache=None, model_name=None, history=None, company="", **kwargs):
+    """评分 → 规则判断 → 取报告 → 文档；报告取不到 (cached_only 且无缓存) 时返回 None"""
+    from ckd.scoring import calculate_kfre_precise
+    from ckd.staging import assess
+
+    risks = calculate_kfre_precise(patient['age'], patient['sex'], patient['egfr'], patient['uacr'])
+    if "error" in risks:
+        raise ExportError(f"KFRE 计算失败: {risks['error']}")
+    trend = history.trend(patient["patient_id"]) if history is not None and patient.get("patient_id") else None
+    assessment = assess(patient['egfr'], patient['uacr'], risks, egfr_slope=trend["egfr_slope"] if trend else None)
+    report, source = resolve_report(patient, risks, assessment, llm=llm, report_cache=report_cache,
+                                    model_name=model_name, **kwargs)
+    if report is None:
+        return None
+    return build_document(patient, risks, assessment, report, source, trend=trend, company=company)
+
+
+def parse_ids(text):
+    """逗号 / 空格 / 换行 (含中文标点) 分隔的病例 ID 列表"""
+    return [pid for pid in re.split(r"[\s,，;；、]+", text or "") if pid]
+
+
+def prepare_from_store(store, patient_id, **kwargs):
+    """批量导出的单个任务：按病例库 ID 取数后生成文档"""
+    from ckd.patient_store import patient_from_record
+
+    raw = store.lookup(patient_id)
+    if raw is None:
+        raise ExportError(f"病例 {patient_id} 不存在")
+    return prepare_document(patient_from_record(raw, patient_id), **kwargs)
+
+
+# ================= 2. 渲染 (HTML / PDF) =================
+_CSS = """
+body { font-family: 'Inter', 'SF Pro SC', 'Microsoft YaHei', 'PingFang SC', sans-serif; color: #222;
+       max-width: 960px; margin: 24px auto; padding: 0 24px; }
+h1, h2, h3 { color: #0E4D92; font-weight: 600; }
+h1 { margin-bottom: 4px; } .meta { color: #78909C; font-size: 0.9em; margin-bottom: 20px; }
+.metrics { display: grid; grid-template-columns: repeat(4, 1fr); gap: 10px; margin-bottom: 16px; }
+.metric { background: #F4F8FB; border-radius: 8px; padding: 10px 12px; }
+.metric .label { color: #546E7A; font-size: 0.85em; } .metric .value { color: #0E4D92; font-size: 1.3em; font-weight: 600; }
+.warning { background: #FFF3E0; border-left: 4px solid #FB8C00; padding: 8px 12px; margin: 6px 0; border-radius: 4px; }
+.cols { display: grid; grid-template-columns: 1fr 1fr; gap: 12px; }
+.expert-card { background-color:#FFF9C4; padding:20px; border-radius:12px; border-left: 8px solid #FBC02D; margin-bottom:25px; }
+footer { margin-top: 32px; color: #90A4AE; font-size: 0.8em; border-top: 1px solid #ECEFF1; padding-top: 8px; }
+@media print { body { margin: 0; } section { break-inside: avoid; } }
+"""
+
+
+def _escape_tree(value):
+    if isinstance(value, str):
+        return html.escape(value)
+    if isinstance(value, dict):
+        return {k: _escape_tree(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_escape_tree(v) for v in value]
+    return value
+
+
+def _chart_geometry(values, width, height, pad=32):
+    """走势图坐标：返回 [(x, y_from_bottom)]、纵轴上限与绘图区；SVG 与 PDF 共用"""
+    top = max(max(values) * 1.15, 5.0)
+    plot_w, plot_h = width - pad * 1.5, height - pad * 1.5
+    step = plot_w / (len(values) - 1)
+    points = [(pad + i * step, pad + v / top * plot_h) for i, v in enumerate(values)]
+    return points, top, (pad, pad, pad + plot_w, pad + plot_h)
+
+
+def _thresholds(top):
+    from ckd.staging import KFRE_PRIMARY_CARE_5YR, KFRE_VERY_HIGH_5YR
+    return [t for t in (KFRE_PRIMARY_CARE_5YR, KFRE_VERY_HIGH_5YR) if t < top]
+
+
+def _trajectory_svg(values, color, width=560, height=220):
+    points, top, (x0, y0, x1, y1) = _chart_geometry(values, width, height)
+    flip = lambda y: height - y  # noqa: E731  SVG 纵轴向下
+    line = " ".join(f"{x:.1f},{flip(y):.1f}" for x, y in points)
+    area = f"{x0:.1f},{flip(y0):.1f} {line} {x1:.1f},{flip(y0):.1f}"
+    parts = [f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" viewBox="0 0 {width} {height}">',
+             f'<polygon points="{area}" fill="{color}" fill-opacity="0.35"/>',
+             f'<polyline points="{line}" fill="none" stroke="{color}" stroke-width="2"/>',
+             f'<line x1="{x0}" y1="{flip(y0)}" x2="{x1}" y2="{flip(y0)}" stroke="#90A4AE"/>',
+             f'<line x1="{x0}" y1="{flip(y0)}" x2="{x0}" y2="{flip(y1)}" stroke="#90A4AE"/>']
+    for t in _thresholds(top):
+        y = flip(y0 + t / top * (y1 - y0))
+        parts.append(f'<line x1="{x0}" y1="{y:.1f}" x2="{x1}" y2="{y:.1f}" stroke="#B0BEC5" stroke-dasharray="4 3"/>'
+                     f'<text x="{x1 - 2}" y="{y - 3:.1f}" font-size="10" text-anchor="end" fill="#78909C">{t:g}%</text>')
+    for i, (x, y) in enumerate(points):
+        parts.append(f'<text x="{x:.1f}" y="{flip(y0) + 14:.1f}" font-size="11" text-anchor="middle" fill="#546E7A">Y{i}</text>')
+    parts.append(f'<text x="{x0 - 4}" y="{flip(y1) + 4:.1f}" font-size="10" text-anchor="end" fill="#546E7A">{top:.0f}%</text>'
+                 f'<text x="{x0 - 4}" y="{flip(y0) + 4:.1f}" font-size="10" text-anchor="end" fill="#546E7A">0</text></svg>')
+    return "".join(parts)
+
+
+def _metric_items(doc):
+    p, r, a = doc["patient"], doc["risks"], doc["assessment"]
+    stage_text = f"{a['gfr_category']}{a['albuminuria_category']} · {a['risk_level']}" if a.get("gfr_category") else "—"
+    return [("年龄 / 性别", f"{p['age']} / {p['sex']}"), ("eGFR", f"{p['egfr']} ml/min"),
+            ("uACR", f"{p['uacr']} mg/g"), ("血压", p["bp"]),
+            ("5 年肾衰风险", f"{r['5yr']}%"), ("2 年肾衰风险", f"{r['2yr']}%"),
+            ("KDIGO 分期", stage_text), ("监测频率", a.get("monitoring") or "—")]
+
+
+def _trend_text(trend):
+    if not trend:
+        return ""
+    slope = f"{trend['egfr_slope']:+.1f}/年" if trend.get("egfr_slope") is not None else "随访不足 90 天"
+    return (f"随访 {trend['n']} 次 ({trend['first_date']} → {trend['last_date']}) · eGFR 年变化 {slope} · "
+            f"较首次下降 {trend['egfr_decline_pct']:.1f}%")
+
+
+def render_html(doc):
+    """自包含 HTML (无外部资源)"""
+    esc = html.escape
+    report = _escape_tree(doc["report"] or {})
+    p = doc["patient"]
+    meds = report.get("medications") or []
+    meds = meds if isinstance(meds, list) else [meds]
+    metrics = "".join(f'<div class="metric"><div class="label">{esc(label)}</div><div class="value">{esc(str(value))}</div></div>'
+                      for label, value in _metric_items(doc))
+    warnings = "".join(f'<div class="warning">🏥 {esc(reason)}</div>' for reason in doc["assessment"].get("referral") or [])
+    trend = f'<p class="meta">{esc(_trend_text(doc["trend"]))}</p>' if doc["trend"] else ""
+    meta = " · ".join(esc(str(x)) for x in (doc["company"], f"病例 {p['id']}" if p.get("id") else p.get("source"),
+                                             f"生成时间 {doc['generated_at']}",
+                                             REPORT_SOURCES.get(doc["report_source"], doc["report_source"])) if x)
+    return f"""<!DOCTYPE html>
+<html lang="zh-CN"><head><meta charset="utf-8"><title>{esc(doc['title'])}</title><style>{_CSS}</style></head>
+<body>
+<h1>🧬 {esc(doc['title'])}</h1>
+<div class="meta">{meta}</div>
+<section><h2>👤 核心指标</h2><div class="metrics">{metrics}</div>{warnings}</section>
+<section><h2>📉 5 年肾衰风险走势</h2>{_trajectory_svg(doc['trajectory'], doc['color'])}{trend}</section>
+<section><h2>📋 临床决策支持报告</h2>
+{assessment_html(report.get('expert_assessment', {}))}
+<div class="cols"><div>{diagnosis_html(report.get('diagnosis', {}))}</div><div>{referral_html(report.get('referral', {}))}</div></div>
+<h3>💊 循证用药筛查</h3>
+{''.join(medication_html(drug) for drug in meds)}
+<h3>🥗 生活方式管理</h3>
+{lifestyle_html(report.get('lifestyle', {}))}
+</section>
+<footer>{esc(DISCLAIMER)}</footer>
+</body></html>
+"""
+
+
+_EMOJI_RE = re.compile("[\U0001F000-\U0001FAFF☀-➿️]")
+
+
+def _pdf_text(value):
+    """PDF 段落文本：去掉中文字体里没有的 emoji，再做 XML 转义"""
+    return html.escape(_EMOJI_RE.sub("", str(value if value is not None else ""))).replace("\n", "<br/>")
+
+
+def _as_dict(value, key):
+    return {key: value} if isinstance(value, str) else (value or {})
+
+
+_PDF_FONT = {}
+
+
+def _pdf_font():
+    """注册并返回 PDF 正文字体名 (进程内只探测一次)"""
+    if "name" in _PDF_FONT:
+        return _PDF_FONT["name"]
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.cidfonts import UnicodeCIDFont
+    from reportlab.pdfbase.ttfonts import TTFont
+
+    name = None
+    for path in PDF_FONT_CANDIDATES:
+        if path and os.path.isfile(path):
+            try:
+                pdfmetrics.registerFont(TTFont("CKDSans", path, subfontIndex=0))
+                name = "CKDSans"
+                break
+            except Exception:
+                continue
+    if name is None:
+        pdfmetrics.registerFont(UnicodeCIDFont("STSong-Light"))
+        name = "STSong-Light"
+    # 只有一个字重：<b> 也映射到同一字体 (避免 reportlab 找不到粗体而报错)
+    pdfmetrics.registerFontFamily(name, normal=name, bold=name, italic=name, boldItalic=name)
+    _PDF_FONT["name"] = name
+    return name
+
+
+def render_pdf(doc):
+    """A4 PDF (reportlab 纯 Python 实现，不依赖系统库)"""
+    if not pdf_available():
+        raise ExportError("PDF 导出需要安装 reportlab (pip install reportlab)；HTML 导出不受影响")
+    from io import BytesIO
+
+    from reportlab.graphics.shapes import Drawing, Line, PolyLine, Polygon, String
+    from reportlab.lib import colors
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.styles import ParagraphStyle
+    from reportlab.lib.units import mm
+    from reportlab.platypus import Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+
+    font, blue = _pdf_font(), colors.HexColor("#0E4D92")
+    body = ParagraphStyle("body", fontName=font, fontSize=10, leading=15, wordWrap="CJK")
+    small = ParagraphStyle("small", parent=body, fontSize=8, leading=11, textColor=colors.HexColor("#78909C"))
+    h1 = ParagraphStyle("h1", parent=body, fontSize=18, leading=24, textColor=blue)
+    h2 = ParagraphStyle("h2", parent=body, fontSize=13, leading=20, textColor=blue, spaceBefore=10, spaceAfter=4)
+    report = doc["report"] or {}
+    p = doc["patient"]
+
+    story = [Paragraph(_pdf_text(doc["title"]), h1),
+             Paragraph(_pdf_text(" · ".join(str(x) for x in (
+                 doc["company"], f"病例 {p['id']}" if p.get("id") else p.get("source"), f"生成时间 {doc['generated_at']}",
+                 REPORT_SOURCES.get(doc["report_source"], doc["report_source"])) if x)), small),
+             Spacer(1, 6), Paragraph("核心指标", h2)]
+    items = _metric_items(doc)
+    cells = [[Paragraph(f"<font color='#546E7A' size='8'>{_pdf_text(label)}</font><br/>{_pdf_text(value)}", body)
+              for label, value in items[i:i + 4]] for i in range(0, len(items), 4)]
+    table = Table(cells, colWidths=[42 * mm] * 4)
+    table.setStyle(TableStyle([("BACKGROUND", (0, 0), (-1, -1), colors.HexColor("#F4F8FB")),
+                               ("GRID", (0, 0), (-1, -1), 2, colors.white), ("VALIGN", (0, 0), (-1, -1), "TOP")]))
+    story.append(table)
+    for reason in doc["assessment"].get("referral") or []:
+        story.append(Paragraph(f"<font color='#E65100'>■</font> {_pdf_text(reason)}", body))
+
+    story.append(Paragraph("5 年肾衰风险走势", h2))
+    width, height = 160 * mm, 55 * mm
+    points, top, (x0, y0, x1, y1) = _chart_geometry(doc["trajectory"], width, height, pad=24)
+    color = colors.HexColor(doc["color"])
+    drawing = Drawing(width, height)
+    area = [x0, y0] + [c for pt in points for c in pt] + [x1, y0]
+    drawing.add(Polygon(area, fillColor=color, fillOpacity=0.35, strokeColor=None))
+    drawing.add(PolyLine([c for pt in points for c in pt], strokeColor=color, strokeWidth=1.5))
+    drawing.add(Line(x0, y0, x1, y0, strokeColor=colors.HexColor("#90A4AE")))
+    drawing.add(Line(x0, y0, x0, y1, strokeColor=colors.HexColor("#90A4AE")))
+    for t in _thresholds(top):
+        y = y0 + t / top * (y1 - y0)
+        drawing.add(Line(x0, y, x1, y, strokeColor=colors.HexColor("#B0BEC5"), strokeDashArray=[3, 2]))
+        drawing.add(String(x1, y + 2, f"{t:g}%", fontName=font, fontSize=7, textAnchor="end",
+                           fillColor=colors.HexColor("#78909C")))
+    for i, (x, _) in enumerate(points):
+        drawing.add(String(x, y0 - 10, f"Y{i}", fontName=font, fontSize=8, textAnchor="middle"))
+    drawing.add(String(x0 - 3, y1 - 3, f"{top:.0f}%", fontName=font, fontSize=7, textAnchor="end"))
+    story.append(drawing)
+    if doc["trend"]:
+        story.append(Paragraph(_pdf_text(_trend_text(doc["trend"])), small))
+
+    story.append(Paragraph("临床决策支持报告", h2))
+    assess_ = _as_dict(report.get("expert_assessment"), "content")
+    story.append(Paragraph(f"<b>专家综述</b><br/>{_pdf_text(assess_.get('content', '未生成点评内容'))}", body))
+    for title, key, text_key in (("诊断", "diagnosis", "summary"), ("转诊建议", "referral", "advice")):
+        section = _as_dict(report.get(key), text_key)
+        lines = [f"<b>{title}</b>：{_pdf_text(section.get(text_key, '暂无'))}"]
+        if section.get("detail"):
+            lines.append(_pdf_text(section["detail"]))
+        story += [Spacer(1, 4), Paragraph("<br/>".join(lines), body),
+                  Paragraph(f"依据: {_pdf_text(section.get('citation', 'N/A'))}", small)]
+
+    story.append(Paragraph("循证用药筛查", h2))
+    meds = report.get("medications") or []
+    rows = [[Paragraph(f"<b>{h}</b>", body) for h in ("药物", "建议", "理由", "依据")]]
+    for drug in (meds if isinstance(meds, list) else [meds]):
+        drug = _as_dict(drug, "drug")
+        rows.append([Paragraph(_pdf_text(drug.get(k, "")), body if k != "citation" else small)
+                     for k in ("drug", "status", "reason", "citation")])
+    med_table = Table(rows, colWidths=[38 * mm, 20 * mm, 70 * mm, 40 * mm], repeatRows=1)
+    med_table.setStyle(TableStyle([("LINEBELOW", (0, 0), (-1, -1), 0.3, colors.HexColor("#ECEFF1")),
+                                   ("VALIGN", (0, 0), (-1, -1), "TOP")]))
+    story.append(med_table)
+    life = _as_dict(report.get("lifestyle"), "advice")
+    story += [Paragraph("生活方式管理", h2), Paragraph(_pdf_text(life.get("advice", "暂无建议")), body),
+              Paragraph(f"依据: {_pdf_text(life.get('citation', 'N/A'))}", small),
+              Spacer(1, 14), Paragraph(_pdf_text(DISCLAIMER), small)]
+
+    buf = BytesIO()
+    SimpleDocTemplate(buf, pagesize=A4, title=doc["title"], leftMargin=18 * mm, rightMargin=18 * mm,
+                      topMargin=16 * mm, bottomMargin=16 * mm).build(story)
+    return buf.getvalue()
+
+
+def render(doc, fmt):
+    if fmt == "html":
+        return render_html(doc).encode("utf-8")
+    if fmt == "pdf":
+        return render_pdf(doc)
+    raise ExportError(f"未知的导出格式: {fmt}")
+
+
+def _safe_name(value):
+    return re.sub(r"[^\w.-]+", "_", str(value)).strip("_") or "patient"
+
+
+def write_document(doc, out_dir, formats, name=None):
+    """按格式写出文件，返回路径列表"""
+    os.makedirs(out_dir, exist_ok=True)
+    base = f"ckd_report_{_safe_name(name or doc['patient'].get('id') or 'manual')}"
+    paths = []
+    for fmt in formats:
+        with stage("report_export", format=fmt) as m:
+            data = render(doc, fmt)
+            m["response_chars"] = len(data)
+        path = os.path.join(out_dir, f"{base}.{fmt}")
+        with open(path, "wb") as f:
+            f.write(data)
+        paths.append(path)
+    return paths
+
+
+# ================= 3. 后台导出任务 =================
+class ExportJob:
+    """一次导出 (单份或批量) 的进度；字段只由工作线程在锁内更新"""
+
+    def __init__(self, job_id, out_dir, total, batch):
+        self.id = job_id
+        self.out_dir = out_dir
+        self.total = total
+        self.batch = batch
+        self.done = 0
+        self.files = []
+        self.failed = []          # [(病例 ID, 错误信息)]
+        self.skipped = []         # cached_only 时没有缓存报告的病例
+        self.cancelled_ids = []   # 取消后不再导出的病例
+        self.sources = Counter()
+        self.archive = None
+        self.cancelled = False
+        self.created = time.time()
+        self.finished_at = None
+        self.lock = threading.Lock()
+
+    @property
+    def finished(self):
+        return self.finished_at is not None
+
+    @property
+    def progress(self):
+        return self.done / self.total if self.total else 1.0
+
+    @property
+    def downloads(self):
+        """供下载的文件：批量任务给压缩包，单份给各格式文件"""
+        return [self.archive] if self.archive else list(self.files)
+
+    def summary(self):
+        parts = [f"已完成 {self.done}/{self.total}"]
+        parts += [f"{REPORT_SOURCES.get(k, k)} {v}" for k, v in self.sources.items()]
+        if self.skipped:
+            parts.append(f"无缓存跳过 {len(self.skipped)}")
+        if self.cancelled_ids:
+            parts.append(f"已取消 {len(self.cancelled_ids)}")
+        if self.failed:
+            parts.append(f"失败 {len(self.failed)}")
+        if self.finished:
+            parts.append(f"用时 {self.finished_at - self.created:.1f}s")
+        return " · ".join(parts)
+
+
+class ExportWorker:
+    """后台线程池：单份导出与批量导出各用一个池，批量任务不会挡住页面上的单份导出。
+
+    用线程而不是进程：报告缓存、模型后端与全局限流都是进程内共享对象，渲染本身很轻。
+    """
+
+    def __init__(self, out_dir=EXPORT_DIR, max_workers=4):
+        self.out_dir = out_dir
+        self._single = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ckd-export")
+        self._batch = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ckd-export-batch")
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._seq = itertools.count(1)
+
+    def _new_job(self, total, batch):
+        job_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{next(self._seq)}"
+        job = ExportJob(job_id, os.path.join(self.out_dir, job_id), total, batch)
+        with self._lock:
+            self._jobs[job_id] = job
+            # 超出保留数时从最早的开始清理，但只清理已结束 (完成 / 失败 / 取消) 的任务，进行中的任务保留其目录
+            excess = len(self._jobs) - MAX_JOBS_KEPT
+            for old_id in [k for k, j in self._jobs.items() if j.finished][:max(excess, 0)]:
+                shutil.rmtree(self._jobs.pop(old_id).out_dir, ignore_errors=True)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """取消批量任务：尚未开始的病例不再导出 (正在生成的会做完)，已完成的文件照常打包。
+        返回是否确实取消了一个未完成的任务"""
+        job = self.get(job_id)
+        if job is None or not job.batch or job.finished:
+            return False
+        with job.lock:
+            job.cancelled = True
+        return True
+
+    def submit_document(self, doc, formats, name=None):
+        """导出一份已生成的报告 (页面当前病例)"""
+        job = self._new_job(1, batch=False)
+
+        def run():
+            try:
+                files = write_document(doc, job.out_dir, formats, name)
+                with job.lock:
+                    job.files += files
+                    job.sources[doc["report_source"]] += 1
+            except Exception as e:
+                with job.lock:
+                    job.failed.append((name or doc["patient"].get("id"), str(e)))
+            finally:
+                with job.lock:
+                    job.done = 1
+                    job.finished_at = time.time()
+
+        self._single.submit(run)
+        return job
+
+    def submit_batch(self, patient_ids, prepare, formats):
+        """批量导出：prepare(patient_id) → 文档 (或 None 表示跳过)，各病例并行，全部完成后打包 zip"""
+        ids = list(dict.fromkeys(str(pid).strip() for pid in patient_ids if str(pid).strip()))
+        job = self._new_job(len(ids), batch=True)
+
+        def run(pid):
+            try:
+                if job.cancelled:
+                    with job.lock:
+                        job.cancelled_ids.append(pid)
+                else:
+                    doc = prepare(pid)
+                    files = write_document(doc, job.out_dir, formats, pid) if doc is not None else []
+                    with job.lock:
+                        if doc is None:
+                            job.skipped.append(pid)
+                        else:
+                            job.files += files
+                            job.sources[doc["report_source"]] += 1
+            except Exception as e:
+                with job.lock:
+                    job.failed.append((pid, str(e)))
+            with job.lock:
+                job.done += 1
+                last = job.done == job.total
+            if last:
+                self._finish_batch(job)
+
+        if not ids:
+            job.finished_at = time.time()
+        for pid in ids:
+            self._batch.submit(run, pid)
+        return job
+
+    @staticmethod
+    def _finish_batch(job):
+        try:
+            if job.files or job.failed or job.skipped or job.cancelled_ids:
+                path = os.path.join(job.out_dir, f"ckd_reports_{job.id}.zip")
+                with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zf:
+                    for f in sorted(job.files):
+                        zf.write(f, os.path.basename(f))
+                    if job.failed or job.skipped or job.cancelled_ids:
+                        lines = [f"{pid}\t失败\t{err}" for pid, err in job.failed]
+                        lines += [f"{pid}\t跳过\t无缓存报告" for pid in job.skipped]
+                        lines += [f"{pid}\t取消\t未导出" for pid in job.cancelled_ids]
+                        zf.writestr("errors.tsv", "\n".join(lines))
+                job.archive = path
+        finally:
+            job.finished_at = time.time()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="按病例库 ID 批量导出报告 (只复用报告缓存与规则模板，不调用模型)")
+    parser.add_argument("ids", nargs="+", help="病例 ID；也可以是每行一个 ID 的文本文件")
+    parser.add_argument("--db", default="cleaned_kidney_data.csv")
+    parser.add_argument("--format", default="html", help="逗号分隔：html,pdf")
+    parser.add_argument("--model", default=os.environ.get("CKD_LLM_MODEL", "gemini-3-pro-preview"),
+                        help="报告缓存键里的模型名 (与页面一致才能命中缓存)")
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args(argv)
+
+    from functools import partial
+
+    from ckd.history import HistoryStore
+    from ckd.patient_store import PatientStore
+    from ckd.report_cache import ReportCache
+
+    ids = []
+    for item in args.ids:
+        if os.path.isfile(item):
+            with open(item, encoding="utf-8") as f:
+                ids += parse_ids(f.read())
+        else:
+            ids += parse_ids(item)
+    formats = [f.strip() for f in args.format.split(",") if f.strip()]
+    prepare = partial(prepare_from_store, PatientStore(args.db), report_cache=ReportCache(), model_name=args.model,
+                      history=HistoryStore(), kb_top_k=int(os.environ.get("CKD_KB_TOP_K", 6)),
+                      kb_budget=int(os.environ.get("CKD_KB_TOKEN_BUDGET", 1500)),
+                      gating=os.environ.get("CKD_LLM_GATING", "1") != "0", cached_only=True)
+    worker = ExportWorker(max_workers=args.workers)
+    job = worker.submit_batch(ids, prepare, formats)
+    while not job.finished:
+        time.sleep(0.2)
+    print(job.summary())
+    for pid, err in job.failed:
+        print(f"  {pid}: {err}", file=sys.stderr)
+    print(job.archive or "没有生成任何文件")
+    return 0 if not job.failed else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
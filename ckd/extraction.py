@@ -0,0 +1,206 @@
+import hashlib
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+from ckd.metrics import get_registry, stage
+from ckd.notes import fill_missing, parse_clinical_note
+
+# ================= 多图并行提取 + 本地合并 =================
+# 每张 (或每小组) 化验单单独调用一次模型，线程池并发执行；
+# 各部分 JSON 在本地按字段确定性合并，并报告不同图片之间的取值冲突。
+EXTRACTION_FIELDS = [
+    "age", "sex", "egfr_stated", "blood_pressure", "hba1c", "glucose",
+    "creatinine_raw", "uacr_raw", "u_albumin_raw", "u_creatinine_raw",
+]
+EXTRACTION_PROMPT = """
+    你是一个专业的医疗数据录入员。请综合阅读【所有上传的图片】和文本，将分散在不同图片上的信息拼凑成一个完整的患者档案。
+    【数值与单位必须分离】
+    在提取 JSON 时，"value" 字段只能包含纯数字（支持小数点），严禁包含文字符号。"unit" 字段单独存放单位。
+    
+    【🔍 视觉扫描策略】
+    1. **基本信息**：寻找 年龄 (Age) 和 性别 (Sex)。
+    2. **生化指标**：寻找 血肌酐 (Creatinine) 和 eGFR。
+    3. **血压和血糖**：
+       - 血压 (BP): 寻找如 "135/85", "BP: 120/70" 等。分离为 sbp 和 dbp。
+       - 血糖: 寻找 糖化血红蛋白 (HbA1c) 或 空腹血糖 (Glucose/Glu)。
+    4. **uACR**: 寻找 "uACR"、"尿微量白蛋白/肌酐比值"。
+    5. **尿液组分**: 尿微量白蛋白 (u_albumin_raw), 尿肌酐 (u_creatinine_raw)。
+
+    【返回 JSON 结构】
+    {
+        "age": 数字, "sex": "Str", "egfr_stated": 数字,
+        "blood_pressure": { "sbp": 数字, "dbp": 数字 }, 
+        "hba1c": { "value": 数字, "unit": "%" },
+        "glucose": { "value": 数字, "unit": "Str" },
+        "creatinine_raw": { "value": 数字, "unit": "Str" },
+        "uacr_raw": { "value": 数字, "unit": "Str" },
+        "u_albumin_raw": { "value": 数字, "unit": "Str" },
+        "u_creatinine_raw": { "value": 数字, "unit": "Str" },
+        "report_summary": "简述提取情况，若血压/血糖缺失请注明。"
+    } 
+    请直接返回 JSON 字符串，不要包含 Markdown 格式。
+    """
+
+_FEMALE_TOKENS = ['female', '女', 'f', '0']
+
+
+def build_extraction_inputs(prompt, user_input, image_list=None, start_index=0):
+    """拼装一次 generate_content 的输入：提示词 + 用户描述 + 带编号的图片"""
+    inputs = [prompt]
+    if user_input: inputs.append(f"用户补充描述: {user_input}")
+    for i, img in enumerate(image_list or []):
+        inputs.append(f"【图片 {start_index + i + 1}】")
+        inputs.append(img)
+    return inputs
+
+
+def parse_json_text(text):
+    """去掉 ```json 围栏后解析"""
+    clean_json = text.replace("```json", "").replace("```", "").strip()
+    return json.loads(clean_json)
+
+
+def extraction_cache_key(user_input, image_hashes, model_name, prompt, **options):
+    """提取结果缓存键：描述文本 + 各图片内容哈希 (按上传顺序) + 模型 + 提示词 + 预处理参数"""
+    payload = {
+        "text": (user_input or "").strip(),
+        "images": list(image_hashes),
+        "model": model_name,
+        "prompt": hashlib.sha256(prompt.encode("utf-8")).hexdigest(),
+        "options": options,
+    }
+    raw = json.dumps(payload, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _norm(value):
+    """比较用的归一化：数字取两位小数，字符串小写，字典逐项归一；空值返回 None"""
+    if value is None:
+        return None
+    if isinstance(value, dict):
+        items = tuple(sorted((k, _norm(v)) for k, v in value.items() if k != "unit"))
+        if all(v is None for _, v in items):
+            return None
+        unit = str(value.get("unit") or "").strip().lower().replace(" ", "")
+        return items + ((("unit", unit),) if unit else ())
+    if isinstance(value, bool):
+        return value
+    try:
+        return round(float(value), 2)
+    except (TypeError, ValueError):
+        from ckd.scoring import MALE_TOKENS  # 与评分共用；延迟导入，保持本模块不依赖 numpy
+
+        s = str(value).strip().lower()
+        if s in MALE_TOKENS: return "male"
+        if s in _FEMALE_TOKENS: return "female"
+        return s or None
+
+
+def merge_extractions(partials, labels=None):
+    """确定性合并：每个字段取票数最多的取值，票数相同取最先出现的；出现分歧时记入 _conflicts"""
+    labels = labels or [f"图片 {i + 1}" for i in range(len(partials))]
+    merged, conflicts, summaries = {}, [], []
+    for field in EXTRACTION_FIELDS:
+        groups = {}  # 归一化值 -> [首个原始值, 票数, 首次出现顺序, 来源列表]
+        for order, (label, part) in enumerate(zip(labels, partials)):
+            if not isinstance(part, dict):
+                continue
+            key = _norm(part.get(field))
+            if key is None:
+                continue
+            if key not in groups:
+                groups[key] = [part[field], 0, order, []]
+            groups[key][1] += 1
+            groups[key][3].append(label)
+        if not groups:
+            continue
+        best = min(groups.values(), key=lambda g: (-g[1], g[2]))
+        merged[field] = best[0]
+        if len(groups) > 1:
+            conflicts.append({
+                "field": field,
+                "chosen": best[0],
+                "candidates": [{"value": g[0], "sources": g[3]}
+                               for g in sorted(groups.values(), key=lambda g: g[2])],
+            })
+    for label, part in zip(labels, partials):
+        if isinstance(part, dict) and part.get("report_summary"):
+            summaries.append(f"[{label}] {part['report_summary']}")
+    merged["report_summary"] = " ".join(summaries)
+    merged["_conflicts"] = conflicts
+    return merged
+
+
+def extract_parallel(call, prompt, user_input, image_list, group_size=1, max_workers=4):
+    """按 group_size 分组并发调用 call(inputs) -> dict，再合并。
+
+    单组失败不会拖垮整批：失败组记入 _errors，其余结果照常合并；全部失败时抛出首个异常。
+    """
+    groups = [image_list[i:i + group_size] for i in range(0, len(image_list), group_size)]
+    labels = []
+    for gi, group in enumerate(groups):
+        first = gi * group_size + 1
+        last = first + len(group) - 1
+        labels.append(f"图片 {first}" if first == last else f"图片 {first}-{last}")
+
+    def run(gi):
+        return call(build_extraction_inputs(prompt, user_input, groups[gi], start_index=gi * group_size))
+
+    partials, errors = [], []
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(groups)))) as pool:
+        futures = [pool.submit(run, gi) for gi in range(len(groups))]
+        for label, fut in zip(labels, futures):
+            try:
+                partials.append(fut.result())
+            except Exception as e:
+                partials.append(None)
+                errors.append({"source": label, "error": str(e)})
+
+    if errors and len(errors) == len(groups):
+        raise RuntimeError(errors[0]["error"])
+    merged = merge_extractions(partials, labels)
+    merged["_errors"] = errors
+    return merged
+
+
+def extract_once(llm, inputs):
+    """一次模型调用 → 解析后的 dict (耗时 / token 记入 llm_extract、json_parse 阶段)"""
+    blobs = [p for p in inputs if isinstance(p, dict)]
+    with stage("llm_extract", images=len(blobs), image_bytes=sum(len(b["data"]) for b in blobs),
+               request_chars=sum(len(p) for p in inputs if isinstance(p, str))) as m:
+        get_registry().increment("llm_calls", kind="extract")
+        res = llm.generate(inputs)
+        m.update(response_chars=len(res.text), **res.usage)
+    with stage("json_parse", source="extract"):
+        return parse_json_text(res.text)
+
+
+def extract_with_backend(llm, user_input, image_list=None, parallel=True, group_size=1, max_workers=4,
+                         prompt=EXTRACTION_PROMPT, local_parser=True):
+    """化验单提取入口：多张图片且 parallel 时分组并发后合并，否则一次性提交。
+
+    local_parser 时纯文本输入先走本地正则解析，核心字段齐全就不调用模型；
+    不全时模型结果只用来补全本地没解析出的字段。
+    """
+    with stage("extract", images=len(image_list or [])):
+        if local_parser and user_input and not image_list:
+            return _extract_text(llm, user_input, prompt)
+        if parallel and image_list and len(image_list) > 1:
+            return extract_parallel(lambda inputs: extract_once(llm, inputs), prompt, user_input, image_list,
+                                    group_size=group_size, max_workers=max_workers)
+        return extract_once(llm, build_extraction_inputs(prompt, user_input, image_list))
+
+
+def _extract_text(llm, user_input, prompt):
+    with stage("note_parse", chars=len(user_input)) as m:
+        parsed, pending = parse_clinical_note(user_input)
+        m["pending"] = len(pending)
+    if not pending:
+        get_registry().increment("llm_calls_avoided", reason="note_parser")
+        return parsed
+    try:
+        return fill_missing(extract_once(llm, build_extraction_inputs(prompt, user_input)), parsed)
+    except Exception as e:
+        # 模型不可用时至少保留本地解析出的字段
+        parsed["_errors"] = [{"source": "模型补全", "error": str(e)}]
+        return parsed
@@ -0,0 +1,246 @@
+import hashlib
+import heapq
+import itertools
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+from ckd.metrics import get_registry
+
+# ================= 跨会话 LLM 调用合并 + 全局限流 =================
+# Streamlit 的所有会话共用一个进程：
+#   - SingleFlight：同一请求 (模型 + 参数 + 内容) 正在进行时，后来者不再发起调用，直接等待并共享结果；
+#     流式请求由后台线程拉取，所有等待者按同一份片段缓冲区各自回放。
+#   - PriorityLimiter：全进程并发上限 + 令牌桶 (每分钟请求数)，排队时交互请求优先于批量任务。
+# 排队等待记入 llm_queue_wait 阶段 (p50 / p95)，合并次数记入 llm_calls_coalesced 计数器。
+INTERACTIVE = "interactive"
+BATCH = "batch"
+PRIORITIES = {INTERACTIVE: 0, BATCH: 1}
+
+
+class QueueTimeout(RuntimeError):
+    """排队超过 queue_timeout 仍未拿到调用名额"""
+
+
+def request_key(model_name, contents, json_output, temperature, stream):
+    """请求指纹：文本原样、图片取内容哈希"""
+    h = hashlib.sha256()
+    h.update(json.dumps([model_name, bool(json_output), temperature, bool(stream)]).encode("utf-8"))
+    for part in contents if isinstance(contents, list) else [contents]:
+        if isinstance(part, dict) and "data" in part:
+            h.update(b"\x00blob:" + str(part.get("mime_type")).encode("utf-8") + hashlib.sha256(part["data"]).digest())
+        else:
+            h.update(b"\x00text:" + str(part).encode("utf-8"))
+    return h.hexdigest()
+
+
+class PriorityLimiter:
+    def __init__(self, max_concurrency=4, rate_per_minute=0, burst=None, queue_timeout=300.0):
+        self._cond = threading.Condition()
+        self._heap = []
+        self._seq = itertools.count()
+        self._active = 0
+        self.configure(max_concurrency, rate_per_minute, burst, queue_timeout)
+
+    def configure(self, max_concurrency=4, rate_per_minute=0, burst=None, queue_timeout=300.0):
+        """可在运行中调整；rate_per_minute 为 0 表示不限速"""
+        with self._cond:
+            self.max_concurrency = max(1, int(max_concurrency))
+            self.rate = max(0.0, float(rate_per_minute)) / 60.0
+            self.burst = float(burst) if burst else max(1.0, self.rate * 60 / 6)  # 默认允许 10 秒的突发量
+            self.queue_timeout = queue_timeout
+            self._tokens = self.burst
+            self._last_refill = time.monotonic()
+            self._cond.notify_all()
+
+    @property
+    def stats(self):
+        with self._cond:
+            return {"active": self._active, "queued": len(self._heap)}
+
+    def _refill(self, now):
+        if self.rate:
+            self._tokens = min(self.burst, self._tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+    def _wait_time(self, ticket, now):
+        """轮到自己且有并发名额、只差令牌时，精确等到下一个令牌；否则等别人唤醒"""
+        if self._heap[0] is ticket and self._active < self.max_concurrency and self.rate:
+            return max((1 - self._tokens) / self.rate, 0.001)
+        return None
+
+    @contextmanager
+    def slot(self, priority=INTERACTIVE):
+        """拿到一个调用名额后执行块内代码；同优先级先到先得"""
+        t0 = time.monotonic()
+        ticket = (PRIORITIES.get(priority, 0), next(self._seq))
+        with self._cond:
+            heapq.heappush(self._heap, ticket)
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    if (self._heap[0] is ticket and self._active < self.max_concurrency
+                            and (not self.rate or self._tokens >= 1)):
+                        break
+                    timeout = self._wait_time(ticket, now)
+                    if self.queue_timeout:
+                        remaining = t0 + self.queue_timeout - now
+                        if remaining <= 0:
+                            raise QueueTimeout(f"LLM 调用排队超过 {self.queue_timeout:g}s")
+                        timeout = min(timeout or remaining, remaining)
+                    self._cond.wait(timeout)
+            except BaseException:
+                self._heap.remove(ticket)
+                heapq.heapify(self._heap)
+                self._cond.notify_all()
+                raise
+            heapq.heappop(self._heap)
+            self._active += 1
+            if self.rate:
+                self._tokens -= 1
+            self._cond.notify_all()  # 队列里的下一位可能也能立即出发
+        get_registry().record("llm_queue_wait", time.monotonic() - t0, priority=priority)
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._active -= 1
+                self._cond.notify_all()
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.abandoned = False
+
+
+class _SharedStream:
+    """后台线程拉取流式结果写入缓冲区；每个读者从头回放，行为与 LLMStream 一致"""
+
+    def __init__(self, open_chunks):
+        self.chunks = []
+        self.usage = {}
+        self.error = None
+        self.finished = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, args=(open_chunks,), daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def _run(self, open_chunks):
+        try:
+            for piece in open_chunks(self.usage):
+                with self._cond:
+                    self.chunks.append(piece)
+                    self._cond.notify_all()
+        except Exception as e:
+            self.error = e
+        finally:
+            with self._cond:
+                self.finished = True
+                self._cond.notify_all()
+
+    def reader(self):
+        return _StreamReader(self)
+
+
+class _StreamReader:
+    def __init__(self, shared):
+        self._shared = shared
+        self.usage = shared.usage
+        self.text = ""
+
+    def __iter__(self):
+        shared, i = self._shared, 0
+        while True:
+            with shared._cond:
+                while i >= len(shared.chunks) and not shared.finished:
+                    shared._cond.wait()
+                pending = shared.chunks[i:]
+                finished = shared.finished
+            for piece in pending:
+                self.text += piece
+                yield piece
+            i += len(pending)
+            if finished and i >= len(shared.chunks):
+                if shared.error is not None:
+                    raise shared.error
+                return
+
+
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._streams = {}
+
+    def call(self, key, fn):
+        """同一 key 同时只执行一次 fn()，其余调用方等待并得到相同结果 (或相同异常)"""
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                leader = call is None
+                if leader:
+                    call = self._calls[key] = _Call()
+            if leader:
+                break
+            get_registry().increment("llm_calls_coalesced", mode="call")
+            call.done.wait()
+            if not call.abandoned:
+                if call.error is not None:
+                    raise call.error
+                return call.result
+            # 发起方被中断 (如页面重跑)：由等待者之一重新发起
+
+        try:
+            call.result = fn()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        except BaseException:
+            call.abandoned = True
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+    def stream(self, key, open_chunks):
+        """流式版本：open_chunks(usage) 返回文本片段迭代器，在后台线程里只执行一次"""
+        with self._lock:
+            shared = self._streams.get(key)
+            if shared is None:
+                shared = self._streams[key] = _SharedStream(self._release(key, open_chunks))
+                shared.start()
+            else:
+                get_registry().increment("llm_calls_coalesced", mode="stream")
+        return shared.reader()
+
+    def _release(self, key, open_chunks):
+        def run(usage):
+            try:
+                yield from open_chunks(usage)
+            finally:
+                with self._lock:
+                    self._streams.pop(key, None)
+        return run
+
+
+class CallGate:
+    """LLMBackend.generate 的统一入口：先合并相同请求，再按优先级排队限流"""
+
+    def __init__(self, limiter=None):
+        self.flight = SingleFlight()
+        self.limiter = limiter or PriorityLimiter()
+
+    def configure(self, **kwargs):
+        self.limiter.configure(**kwargs)
+
+
+GATE = CallGate()
@@ -0,0 +1,313 @@
+"""随访历史库：同一病例 id 的多次化验结果 (SQLite，按 (病例, 时间) 聚簇索引)。
+
+每条新结果写入时增量更新该病例的趋势汇总 (一元回归累加量 + 首末次取值)，
+读取 eGFR 年变化、较基线下降百分比、KFRE 走势只需一次主键查询，不扫描历史。
+
+    python -m ckd.history import labs.csv          # 批量导入 (列: id, date, egfr 或 scr_umol, uacr, uacr_unit, age, sex)
+    python -m ckd.history show 12                  # 查看单个病例的趋势与明细
+"""
+import argparse
+import datetime as dt
+import json
+import math
+import numbers
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+from ckd.report_cache import CACHE_DIR
+
+HISTORY_DB_PATH = os.path.join(CACHE_DIR, "history.sqlite")
+YEAR_SECONDS = 365.25 * 24 * 3600
+# 随访跨度不足 90 天时不给出年变化 (短期波动外推成年变化没有意义)
+MIN_SLOPE_SPAN_DAYS = 90
+IMPORT_CHUNK_ROWS = 50_000
+
+# 趋势汇总：x = 距首次写入的年数；eGFR 与 KFRE 5 年风险各一套累加量 (风险可能缺失，单独计数)
+_TREND_COLUMNS = [
+    "patient_id", "t0", "n", "first_t", "first_egfr", "first_risk", "last_t", "last_egfr", "last_uacr", "last_risk",
+    "e_sx", "e_sxx", "e_sy", "e_sxy", "r_n", "r_sx", "r_sxx", "r_sy", "r_sxy",
+]
+
+
+def to_timestamp(value):
+    """日期 / datetime / ISO 字符串 / unix 秒 → unix 秒 (无时区按本地时间)；缺失或无效 (NaN / NaT) 抛 ValueError"""
+    if value is None or (isinstance(value, str) and not value.strip()):
+        raise ValueError("日期缺失")
+    if isinstance(value, numbers.Real):
+        ts = float(value)
+    elif isinstance(value, dt.datetime):
+        ts = value.timestamp()
+    elif isinstance(value, dt.date):
+        ts = dt.datetime(value.year, value.month, value.day).timestamp()
+    elif hasattr(value, "to_pydatetime"):
+        ts = value.to_pydatetime().timestamp()
+    else:
+        ts = dt.datetime.fromisoformat(str(value).strip().replace("/", "-")).timestamp()
+    if not math.isfinite(ts):
+        raise ValueError(f"日期缺失或无效: {value!r}")
+    return ts
+
+
+def _patient_key(value):
+    """病例 id → 字符串；缺失 (None / NaN / 空串) 与浮点 id (缺值把整列转成了 float) 拒收"""
+    if isinstance(value, str) and value.strip():
+        return value
+    if isinstance(value, numbers.Integral) and not isinstance(value, bool):
+        return str(value)
+    raise ValueError(f"patient_id 缺失或不是字符串: {value!r}")
+
+
+def _date_text(ts):
+    return dt.datetime.fromtimestamp(ts).strftime("%Y-%m-%d")
+
+
+def _num(value):
+    try:
+        v = float(value)
+    except (TypeError, ValueError):
+        return None
+    return None if v != v else v
+
+
+def _slope(n, sx, sxx, sy, sxy):
+    denom = n * sxx - sx * sx
+    if n < 2 or denom <= 1e-12:
+        return None
+    return (n * sxy - sx * sy) / denom
+
+
+def _apply(state, x, egfr, risk, sign):
+    """把一条结果的贡献加到 (sign=1) 或从 (sign=-1) 汇总里减去"""
+    state["n"] += sign
+    state["e_sx"] += sign * x
+    state["e_sxx"] += sign * x * x
+    state["e_sy"] += sign * egfr
+    state["e_sxy"] += sign * x * egfr
+    if risk is not None:
+        state["r_n"] += sign
+        state["r_sx"] += sign * x
+        state["r_sxx"] += sign * x * x
+        state["r_sy"] += sign * risk
+        state["r_sxy"] += sign * x * risk
+
+
+class HistoryStore:
+    def __init__(self, db_path=HISTORY_DB_PATH):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        # WAL + synchronous=NORMAL：提交不逐次 fsync，单条写入保持在亚毫秒级
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS results (
+                patient_id TEXT NOT NULL, t REAL NOT NULL,
+                egfr REAL NOT NULL, uacr REAL, risk_2yr REAL, risk_5yr REAL,
+                PRIMARY KEY (patient_id, t)
+            ) WITHOUT ROWID""")
+        self._db.execute(f"""
+            CREATE TABLE IF NOT EXISTS trends (
+                patient_id TEXT PRIMARY KEY, t0 REAL NOT NULL, n INTEGER NOT NULL,
+                first_t REAL, first_egfr REAL, first_risk REAL,
+                last_t REAL, last_egfr REAL, last_uacr REAL, last_risk REAL,
+                {", ".join(f"{c} REAL NOT NULL DEFAULT 0" for c in _TREND_COLUMNS[10:])}
+            ) WITHOUT ROWID""")
+        self._db.commit()
+
+    # ---------- 写入 ----------
+    def _load_state(self, patient_id, t):
+        row = self._db.execute(f"SELECT {', '.join(_TREND_COLUMNS)} FROM trends WHERE patient_id = ?",
+                               (patient_id,)).fetchone()
+        if row is not None:
+            return dict(zip(_TREND_COLUMNS, row))
+        state = dict.fromkeys(_TREND_COLUMNS, 0)
+        state.update(patient_id=patient_id, t0=t, first_t=None, last_t=None)
+        return state
+
+    def _save_state(self, state):
+        self._db.execute(
+            f"INSERT OR REPLACE INTO trends ({', '.join(_TREND_COLUMNS)}) VALUES ({', '.join('?' * len(_TREND_COLUMNS))})",
+            [state[c] for c in _TREND_COLUMNS])
+
+    def _add(self, state, t, egfr, uacr, risk_2yr, risk_5yr):
+        patient_id = state["patient_id"]
+        cur = self._db.execute(
+            "INSERT INTO results (patient_id, t, egfr, uacr, risk_2yr, risk_5yr) VALUES (?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (patient_id, t) DO NOTHING", (patient_id, t, egfr, uacr, risk_2yr, risk_5yr))
+        if cur.rowcount == 0:
+            # 同一时间点重复录入：以新值为准，先扣除旧值的贡献
+            old_egfr, old_risk = self._db.execute(
+                "SELECT egfr, risk_5yr FROM results WHERE patient_id = ? AND t = ?", (patient_id, t)).fetchone()
+            _apply(state, (t - state["t0"]) / YEAR_SECONDS, old_egfr, old_risk, -1)
+            self._db.execute("UPDATE results SET egfr = ?, uacr = ?, risk_2yr = ?, risk_5yr = ? "
+                             "WHERE patient_id = ? AND t = ?", (egfr, uacr, risk_2yr, risk_5yr, patient_id, t))
+
+        _apply(state, (t - state["t0"]) / YEAR_SECONDS, egfr, risk_5yr, 1)
+        # 补录更早的结果时更新基线；晚于 (或等于) 最近一次时更新最新值
+        if state["first_t"] is None or t <= state["first_t"]:
+            state.update(first_t=t, first_egfr=egfr, first_risk=risk_5yr)
+        if state["last_t"] is None or t >= state["last_t"]:
+            state.update(last_t=t, last_egfr=egfr, last_uacr=uacr, last_risk=risk_5yr)
+
+    @staticmethod
+    def _parse(taken_at, egfr, uacr, risks):
+        egfr = _num(egfr)
+        if egfr is None:
+            raise ValueError("egfr 缺失或无法解析")
+        risks = risks if isinstance(risks, dict) and "error" not in risks else {}
+        return to_timestamp(taken_at), egfr, _num(uacr), _num(risks.get("2yr")), _num(risks.get("5yr"))
+
+    def add_result(self, patient_id, taken_at, egfr, uacr=None, risks=None):
+        """记录一次化验结果；risks 为 calculate_kfre_precise 的返回值 (可缺省)。返回更新后的趋势"""
+        patient_id = str(patient_id)
+        t, egfr, uacr, risk_2yr, risk_5yr = self._parse(taken_at, egfr, uacr, risks)
+        with self._lock:
+            state = self._load_state(patient_id, t)
+            self._add(state, t, egfr, uacr, risk_2yr, risk_5yr)
+            self._save_state(state)
+            self._db.commit()
+        return self._summarize(state)
+
+    def add_many(self, rows):
+        """批量导入 (一个事务)：rows 为 dict，键 patient_id / taken_at / egfr / uacr / risk_2yr / risk_5yr。
+
+        返回 (写入条数, 拒收列表)；同一批内同一病例的汇总只读写一次。
+        """
+        written, rejects, states = 0, [], {}
+        with self._lock:
+            try:
+                for i, row in enumerate(rows):
+                    try:
+                        patient_id = _patient_key(row.get("patient_id"))
+                        t, egfr, uacr, risk_2yr, risk_5yr = self._parse(
+                            row.get("taken_at"), row.get("egfr"), row.get("uacr"),
+                            {"2yr": row.get("risk_2yr"), "5yr": row.get("risk_5yr")})
+                    except (KeyError, TypeError, ValueError) as e:
+                        rejects.append({"row": i, "error": str(e)})
+                        continue
+                    state = states.get(patient_id) or self._load_state(patient_id, t)
+                    try:
+                        self._add(state, t, egfr, uacr, risk_2yr, risk_5yr)
+                    except sqlite3.IntegrityError as e:
+                        # 失败的只是这一条语句，事务内其余行照常写入
+                        rejects.append({"row": i, "error": f"写入失败: {e}"})
+                        continue
+                    states[patient_id] = state
+                    written += 1
+                for state in states.values():
+                    self._save_state(state)
+                self._db.commit()
+            except Exception:
+                self._db.rollback()
+                raise
+        return written, rejects
+
+    # ---------- 读取 ----------
+    def trend(self, patient_id):
+        """趋势汇总 (一次主键查询)；没有记录时返回 None"""
+        with self._lock:
+            row = self._db.execute(f"SELECT {', '.join(_TREND_COLUMNS)} FROM trends WHERE patient_id = ?",
+                                   (str(patient_id),)).fetchone()
+        return self._summarize(dict(zip(_TREND_COLUMNS, row))) if row else None
+
+    def series(self, patient_id, limit=None):
+        """按时间排序的明细 (主键范围扫描)；limit 只取最近若干次"""
+        sql = "SELECT t, egfr, uacr, risk_2yr, risk_5yr FROM results WHERE patient_id = ? ORDER BY t DESC"
+        args = [str(patient_id)]
+        if limit:
+            sql += " LIMIT ?"
+            args.append(int(limit))
+        with self._lock:
+            rows = self._db.execute(sql, args).fetchall()
+        return [{"date": _date_text(t), "egfr": egfr, "uacr": uacr, "risk_2yr": r2, "risk_5yr": r5}
+                for t, egfr, uacr, r2, r5 in reversed(rows)]
+
+    @staticmethod
+    def _summarize(s):
+        span_days = (s["last_t"] - s["first_t"]) / 86400
+        slope_ok = span_days >= MIN_SLOPE_SPAN_DAYS
+        egfr_slope = _slope(s["n"], s["e_sx"], s["e_sxx"], s["e_sy"], s["e_sxy"]) if slope_ok else None
+        risk_slope = _slope(s["r_n"], s["r_sx"], s["r_sxx"], s["r_sy"], s["r_sxy"]) if slope_ok else None
+        decline = (s["first_egfr"] - s["last_egfr"]) / s["first_egfr"] * 100 if s["first_egfr"] else None
+        risk_change = s["last_risk"] - s["first_risk"] if None not in (s["last_risk"], s["first_risk"]) else None
+        return {
+            "patient_id": s["patient_id"],
+            "n": int(s["n"]),
+            "first_date": _date_text(s["first_t"]),
+            "last_date": _date_text(s["last_t"]),
+            "span_days": round(span_days, 1),
+            "first_egfr": s["first_egfr"],
+            "last_egfr": s["last_egfr"],
+            "last_uacr": s["last_uacr"],
+            "egfr_slope": round(egfr_slope, 2) if egfr_slope is not None else None,   # ml/min/1.73m²/年
+            "egfr_decline_pct": round(decline, 1) if decline is not None else None,   # 较首次，正数为下降
+            "first_risk_5yr": s["first_risk"],
+            "last_risk_5yr": s["last_risk"],
+            "risk_5yr_change": round(risk_change, 2) if risk_change is not None else None,
+            "risk_5yr_slope": round(risk_slope, 2) if risk_slope is not None else None,  # 百分点/年
+        }
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+# ================= 批量导入 CLI =================
+def _read_chunks(path, chunk_rows):
+    import pandas as pd
+    # id 按字符串读入：部分行缺 id 时 pandas 不会把整列转成 float (1 → "1.0")
+    if path.endswith(".csv"):
+        return pd.read_csv(path, chunksize=chunk_rows, dtype={"id": str})
+    return pd.read_json(path, lines=True, chunksize=chunk_rows, dtype={"id": str})
+
+
+def import_file(store, path, date_col="date", chunk_rows=IMPORT_CHUNK_ROWS):
+    """按块读入 CSV / NDJSON，逐块向量化补算 eGFR 与 KFRE (复用 ckd.service.score_frame) 后写入"""
+    from ckd.service import score_frame
+
+    total, rejects, offset = 0, [], 0
+    for chunk in _read_chunks(path, chunk_rows):
+        scored = score_frame(chunk)
+        ids = chunk["id"].tolist() if "id" in chunk else [None] * len(chunk)
+        dates = chunk[date_col].tolist() if date_col in chunk else [None] * len(chunk)
+        rows = [{"patient_id": pid, "taken_at": d, "egfr": e, "uacr": u, "risk_2yr": r2, "risk_5yr": r5}
+                for pid, d, e, u, r2, r5 in zip(ids, dates, scored["egfr"].tolist(), scored["uacr_mg_g"].tolist(),
+                                                scored["risk_2yr"].tolist(), scored["risk_5yr"].tolist())]
+        # 缺 id / 缺日期的行也交给 add_many，由它按块内真实行号记入拒收
+        written, bad = store.add_many(rows)
+        rejects += [{"row": offset + r["row"], "error": r["error"]} for r in bad]
+        total += written
+        offset += len(chunk)
+    return total, rejects
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="CKD 随访历史库")
+    parser.add_argument("--db", default=HISTORY_DB_PATH)
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_import = sub.add_parser("import", help="导入 CSV / NDJSON 化验结果")
+    p_import.add_argument("input")
+    p_import.add_argument("--date-col", default="date")
+    p_import.add_argument("--chunk-rows", type=int, default=IMPORT_CHUNK_ROWS)
+    p_show = sub.add_parser("show", help="查看病例趋势")
+    p_show.add_argument("patient_id")
+    args = parser.parse_args(argv)
+
+    store = HistoryStore(args.db)
+    if args.command == "import":
+        t0 = time.perf_counter()
+        total, rejects = import_file(store, args.input, args.date_col, args.chunk_rows)
+        for r in rejects[:20]:
+            print(f"第 {r['row']} 行已跳过：{r['error']}", file=sys.stderr)
+        print(f"已导入 {total} 条，拒收 {len(rejects)} 条，用时 {time.perf_counter() - t0:.2f}s", file=sys.stderr)
+    else:
+        print(json.dumps({"trend": store.trend(args.patient_id), "series": store.series(args.patient_id)},
+                         ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+import hashlib
+import io
+
+# ================= 化验单图片预处理 =================
+# 手机原图动辄数 MB，直接传 PIL 图片时 SDK 会按原分辨率转成无损 WebP。
+# 这里先按 EXIF 摆正、转灰度、限制最长边、重新 JPEG 压缩，再以 blob 形式提交。
+# PIL 只在真正有图片上传时才导入，不拖慢页面冷启动。
+
+ORIENTATION_TAG = 0x0112
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def _encode(img, fmt, **params):
+    out = io.BytesIO()
+    img.save(out, format=fmt, **params)
+    return out.getvalue()
+
+
+def preprocess_image(data, max_edge=1600, grayscale=True, quality=80):
+    """原始图片字节 → (提交给模型的 blob, 预览用 PIL 图片, 统计信息)"""
+    from PIL import Image, ImageOps
+
+    src = Image.open(io.BytesIO(data))
+    mime = Image.MIME.get(src.format, "image/jpeg")
+    # 先按 EXIF 摆正，后面任何一步失败时回退的都是摆正后的图片，而不是横躺的原始字节
+    try:
+        upright = ImageOps.exif_transpose(src)
+        rotated = src.getexif().get(ORIENTATION_TAG, 1) not in (0, 1)
+    except (OSError, ValueError, SyntaxError):
+        upright, rotated = src, False
+
+    try:
+        img = upright.convert("L") if grayscale else upright.convert("RGB")
+        if max_edge and max(img.size) > max_edge:
+            img.thumbnail((max_edge, max_edge), Image.LANCZOS)
+        jpeg = _encode(img, "JPEG", quality=quality, optimize=True)
+    except (OSError, ValueError):
+        img, jpeg = upright, None
+
+    if jpeg is not None and (len(jpeg) < len(data) or rotated):
+        blob = {"mime_type": "image/jpeg", "data": jpeg}
+    elif rotated:
+        # 转码失败：无损提交摆正后的图片
+        try:
+            blob = {"mime_type": "image/png", "data": _encode(upright, "PNG")}
+        except (OSError, ValueError):
+            blob = {"mime_type": mime, "data": data}
+    else:
+        # 极少数情况下 (已高度压缩的小图) 重新编码反而更大，且无需旋转，此时保留原文件
+        blob = {"mime_type": mime, "data": data}
+
+    stats = {"original_bytes": len(data), "sent_bytes": len(blob["data"]), "size": img.size}
+    return blob, img, stats
@@ -0,0 +1,333 @@
+"""LIS 化验导出的流式批量入库：分块读取 → 单位归一 → eGFR / KFRE → 增量写列式文件。
+
+    python -m ckd.ingest lis_export.csv -o scored.parquet --rejects rejects.ndjson --workers 4
+    python -m ckd.ingest cleaned_kidney_data.csv -o scored.feather
+
+- 主进程只按记录切块 (数引号判断记录边界，不解析)，CSV 解析、单位换算与评分都在子进程里完成；
+  同时在途的块数固定为 workers × 2，内存占用与输入文件大小无关。
+- 结果按输入顺序逐块追加写入 Parquet (每块一个 row group) 或 Feather/Arrow IPC (需 pyarrow)。
+- 单行数据有问题 (含字段数不符、引号不闭合) 时不会中断整批：该行写入 rejects 文件 (NDJSON，含数据行号、原因与原始字段)。
+- 输入可为 .csv 或 .csv.gz；列名不区分大小写，常见别名见 COLUMN_ALIASES。
+"""
+import argparse
+import csv
+import gzip
+import io
+import itertools
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from ckd.metrics import get_registry
+
+INGEST_CHUNK_ROWS = 100_000
+
+# 规范列名 → LIS 导出里常见的列名 (小写比较)
+COLUMN_ALIASES = {
+    "id": ["id", "patient_id", "pid", "mrn", "病例id", "患者id"],
+    "date": ["date", "result_date", "collection_date", "sample_date", "检验日期"],
+    "age": ["age", "年龄"],
+    "sex": ["sex", "gender", "性别"],
+    "creatinine": ["creatinine", "scr", "sc", "crea", "血肌酐", "肌酐"],
+    "creatinine_unit": ["creatinine_unit", "scr_unit", "sc_unit", "crea_unit", "肌酐单位"],
+    "egfr": ["egfr"],
+    "uacr": ["uacr", "acr", "尿白蛋白肌酐比"],
+    "uacr_unit": ["uacr_unit", "acr_unit", "uacr单位"],
+}
+REQUIRED_COLUMNS = ["age", "sex", "uacr"]
+# 按字符串读入的列；其余数值列交给 C 解析器直接转 float (含非数字取值的列才退回逐值转换)
+TEXT_COLUMNS = ["id", "date", "sex", "creatinine_unit", "uacr_unit"]
+
+OUTPUT_COLUMNS = [
+    ("row", "int64"), ("id", "string"), ("date", "string"), ("age", "float64"), ("sex", "string"),
+    ("scr_umol", "float64"), ("egfr", "float64"), ("egfr_source", "string"), ("uacr_mg_g", "float64"),
+    ("risk_2yr", "float64"), ("risk_5yr", "float64"), ("gfr_category", "string"),
+    ("albuminuria_category", "string"), ("stage", "string"),
+]
+
+
+def resolve_columns(header):
+    """表头 → {规范列名: 原列名}；缺少必需列时抛 ValueError (整份文件无法处理)"""
+    names = {name.strip().lower(): name for name in header}
+    mapping = {}
+    for canonical, aliases in COLUMN_ALIASES.items():
+        for alias in aliases:
+            if alias in names:
+                mapping[canonical] = names[alias]
+                break
+    missing = [c for c in REQUIRED_COLUMNS if c not in mapping]
+    if "egfr" not in mapping and "creatinine" not in mapping:
+        missing.append("egfr / creatinine")
+    if missing:
+        raise ValueError(f"缺少必需列: {', '.join(missing)} (表头: {', '.join(header)})")
+    return mapping
+
+
+# ================= 子进程：单块处理 =================
+def _uacr_unit_known(unit):
+    """standardize_uacr 对无法识别的单位按 mg/g 处理；入库时宁可拒收，避免把 mg/L 之类当成比值"""
+    from ckd.units import UACR_MG_G_UNITS, _uacr_unit_kind
+    u = unit.lower().strip()
+    return u in ("", "nan", "none") or u in UACR_MG_G_UNITS or _uacr_unit_kind(u) != 0
+
+
+def _first_reason(checks, n):
+    """按优先级取每行第一个命中的拒收原因；全部未命中为 None"""
+    import numpy as np
+    reason = np.full(n, None, dtype=object)
+    for mask, text in checks:
+        reason[(reason == None) & mask] = text  # noqa: E711 (逐元素比较)
+    return reason
+
+
+def _has_overflow(header_line, text):
+    """是否有记录的字段数多于表头；不含引号的块 (绝大多数) 只数逗号"""
+    width = len(next(csv.reader([header_line])))
+    if '"' not in text:
+        return any(line.count(",") >= width for line in text.splitlines())
+    try:
+        return any(len(fields) > width for fields in csv.reader(io.StringIO(text)))
+    except csv.Error:
+        return True
+
+
+def _split_records(header_line, text, start_row):
+    """整块不能直接交给 read_csv 时用 csv.reader 逐条记录解析：字段数多于表头、无法解析的记录记入拒收，
+    其余记录重新拼成 CSV。返回 (CSV 文本, 各记录的数据行号, 拒收列表)"""
+    width = len(next(csv.reader([header_line])))
+    body = io.StringIO()
+    writer = csv.writer(body, lineterminator="\n")
+    reader = csv.reader(io.StringIO(text))
+    rows, rejects, row = [], [], start_row
+    while True:
+        try:
+            fields = next(reader)
+        except StopIteration:
+            break
+        except csv.Error as e:
+            # reader 出错后会丢弃这条记录、从下一行接着解析
+            rejects.append({"row": row, "reason": f"CSV 格式错误: {e}", "raw": None})
+            row += 1
+            continue
+        if len(fields) > width:
+            rejects.append({"row": row, "reason": f"字段数 {len(fields)} 多于表头的 {width} 列 (列可能错位)", "raw": fields})
+        else:
+            writer.writerow(fields)
+            rows.append(row)
+        row += 1
+    return body.getvalue(), rows, rejects
+
+
+def process_chunk(header_line, text, start_row, mapping, scr_unit=None):
+    """一块 CSV 文本 → (结果 DataFrame, 拒收列表, 耗时秒)；start_row 为块内首条记录的数据行号 (从 1 起)"""
+    import numpy as np
+    import pandas as pd
+
+    from ckd.scoring import _male_mask
+    from ckd.service import score_frame
+    from ckd.units import _unit_codes, standardize_creatinine_batch
+
+    t0 = time.perf_counter()
+    # 只解析用得到的列；read_csv 指定 usecols 时会静默丢掉多出的字段，字段数多于表头的行 (多半已错位) 要先挑出来
+    read = lambda body: pd.read_csv(io.StringIO(header_line + body), usecols=list(mapping.values()), index_col=False,
+                                    skip_blank_lines=False, low_memory=False,
+                                    dtype={mapping[c]: str for c in TEXT_COLUMNS if c in mapping})
+    raw = None
+    if not _has_overflow(header_line, text):
+        try:
+            raw = read(text)
+            rows, format_rejects = np.arange(start_row, start_row + len(raw)), []
+        except pd.errors.ParserError:
+            pass
+    if raw is None:
+        # 逐条记录重新解析，只拒收有问题的记录，其余照常处理
+        body, rows, format_rejects = _split_records(header_line, text, start_row)
+        raw = read(body)
+    n = len(raw)
+    raw.index = np.asarray(rows, dtype="int64")
+    col = lambda name: raw[mapping[name]] if name in mapping else pd.Series([None] * n, index=raw.index, dtype=object)
+    num = lambda name: pd.to_numeric(col(name), errors="coerce").to_numpy(dtype="float64")
+
+    scr_units = pd.Series([scr_unit] * n, index=raw.index, dtype=object) if scr_unit else col("creatinine_unit")
+    scr_in = num("creatinine")
+    scr_umol = standardize_creatinine_batch(scr_in, scr_units)
+    uacr_units = col("uacr_unit")
+    uacr_in = num("uacr")
+    age = num("age")
+
+    frame = pd.DataFrame({
+        "id": col("id"), "age": age, "sex": col("sex"), "egfr": num("egfr"),
+        "scr_umol": scr_umol, "uacr": uacr_in, "uacr_unit": uacr_units,
+    }, index=raw.index)
+    scored = score_frame(frame)
+
+    uacr_known = _unit_codes(uacr_units, _uacr_unit_known).astype(bool)
+    sex_text = col("sex").fillna("").map(str).str.strip()
+    reason = _first_reason([
+        (raw.isna().all(axis=1).to_numpy(), "空行"),
+        (col("id").isna().to_numpy() if "id" in mapping else np.zeros(n, bool), "id 缺失"),
+        (np.isnan(age), "年龄缺失或无法解析"),
+        ((sex_text == "").to_numpy(), "性别缺失"),
+        (~np.isnan(scr_in) & np.isnan(scr_umol), "肌酐单位无法识别"),
+        (~uacr_known, "uACR 单位无法识别"),
+        (np.isnan(uacr_in), "uACR 缺失或无法解析"),
+        (np.isnan(scored["egfr"].to_numpy(dtype="float64")), "eGFR 缺失且无法由肌酐补算"),
+        (scored["error"].notna().to_numpy(), "KFRE 无法计算"),
+    ], n)
+
+    ok = reason == None  # noqa: E711
+    out = pd.DataFrame({
+        "row": raw.index.to_numpy(dtype="int64"),
+        "id": col("id"),
+        "date": col("date"),
+        "age": age,
+        "sex": np.where(_male_mask(col("sex")), "Male", "Female"),
+        "scr_umol": scr_umol,
+    }, index=raw.index)
+    for name in ("egfr", "egfr_source", "uacr_mg_g", "risk_2yr", "risk_5yr", "gfr_category",
+                 "albuminuria_category", "stage"):
+        out[name] = scored[name]
+    out = out[ok].astype({name: dtype for name, dtype in OUTPUT_COLUMNS})
+
+    rejects = []
+    if not ok.all():
+        bad = raw[~ok].astype(object).where(raw[~ok].notna(), None)
+        rejects = [{"row": int(row), "reason": r, "raw": fields}
+                   for row, r, fields in zip(bad.index, reason[~ok], bad.to_dict("records"))]
+    if format_rejects:
+        rejects = sorted(rejects + format_rejects, key=lambda r: r["row"])
+    return out, rejects, time.perf_counter() - t0
+
+
+# ================= 主进程：切块 / 调度 / 顺序写出 =================
+def _open_text(path):
+    if path == "-":
+        return sys.stdin
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8-sig", newline="")
+    return open(path, "r", encoding="utf-8-sig", newline="")
+
+
+def iter_text_chunks(f, chunk_rows):
+    """按记录切块，不做解析：yield (块内首条记录的数据行号, 文本)。
+
+    按双引号个数的奇偶判断记录是否结束，引号内带换行的字段不会被切到两个块里；
+    不含引号的块 (绝大多数) 直接按行数计。
+    """
+    start = 1
+    while True:
+        lines = list(itertools.islice(f, chunk_rows))
+        if not lines:
+            return
+        records = len(lines)
+        if any('"' in line for line in lines):
+            records, open_quote = 0, False
+            for line in lines:
+                open_quote ^= line.count('"') % 2 == 1
+                records += not open_quote
+            # 块尾停在引号字段中间：继续读到这条记录结束 (引号始终不闭合时读到文件尾)
+            while open_quote:
+                line = next(f, None)
+                if line is None:
+                    records += 1
+                    break
+                lines.append(line)
+                open_quote ^= line.count('"') % 2 == 1
+                records += not open_quote
+        yield start, "".join(lines)
+        start += records
+
+
+class ColumnarWriter:
+    """按块追加写出：.parquet 每块一个 row group；.feather / .arrow 写 Arrow IPC 文件"""
+
+    def __init__(self, path):
+        import pyarrow as pa
+        self.path = path
+        self.schema = pa.schema([(name, pa.string() if dtype == "string" else pa.from_numpy_dtype(dtype))
+                                 for name, dtype in OUTPUT_COLUMNS])
+        if path.endswith(".parquet"):
+            import pyarrow.parquet as pq
+            self._writer = pq.ParquetWriter(path, self.schema, compression="zstd")
+        elif path.endswith((".feather", ".arrow")):
+            self._writer = pa.ipc.new_file(path, self.schema)
+        else:
+            raise ValueError("输出文件需以 .parquet / .feather / .arrow 结尾")
+
+    def write(self, df):
+        import pyarrow as pa
+        if len(df):
+            self._writer.write_table(pa.Table.from_pandas(df, schema=self.schema, preserve_index=False))
+
+    def close(self):
+        self._writer.close()
+
+
+def ingest(src, dst, rejects_path=None, chunk_rows=INGEST_CHUNK_ROWS, workers=None, scr_unit=None):
+    """流式入库；返回 {"rows", "written", "rejected", "seconds", "rows_per_s"}"""
+    workers = workers or os.cpu_count() or 1
+    t0 = time.perf_counter()
+    stats = {"rows": 0, "written": 0, "rejected": 0}
+    f = _open_text(src)
+    writer = reject_f = pool = None
+    try:
+        header_line = f.readline()
+        mapping = resolve_columns(next(csv.reader([header_line])))
+        writer = ColumnarWriter(dst)
+        reject_f = open(rejects_path, "w", encoding="utf-8") if rejects_path else None
+
+        def drain(result):
+            out, rejects, seconds = result
+            writer.write(out)
+            if reject_f:
+                reject_f.writelines(json.dumps(r, ensure_ascii=False) + "\n" for r in rejects)
+            stats["rows"] += len(out) + len(rejects)
+            stats["written"] += len(out)
+            stats["rejected"] += len(rejects)
+            get_registry().record("ingest_chunk", seconds, rows=len(out) + len(rejects), rejected=len(rejects))
+
+        chunks = iter_text_chunks(f, chunk_rows)
+        if workers <= 1:
+            for start, text in chunks:
+                drain(process_chunk(header_line, text, start, mapping, scr_unit))
+        else:
+            # 在途块数有上限：最早提交的块完成后才读入新块，并按提交顺序写出
+            pool = ProcessPoolExecutor(max_workers=workers)
+            pending = deque()
+            for start, text in chunks:
+                pending.append(pool.submit(process_chunk, header_line, text, start, mapping, scr_unit))
+                if len(pending) >= workers * 2:
+                    drain(pending.popleft().result())
+            while pending:
+                drain(pending.popleft().result())
+    finally:
+        if pool: pool.shutdown(cancel_futures=True)
+        if writer: writer.close()
+        if reject_f: reject_f.close()
+        if f is not sys.stdin: f.close()
+
+    stats["seconds"] = time.perf_counter() - t0
+    stats["rows_per_s"] = stats["rows"] / stats["seconds"] if stats["seconds"] else 0.0
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="LIS 化验导出流式入库 (单位归一 + eGFR / KFRE + 列式输出)")
+    parser.add_argument("input", help="CSV 或 CSV.gz，- 表示标准输入")
+    parser.add_argument("-o", "--output", required=True, help=".parquet / .feather / .arrow")
+    parser.add_argument("--rejects", help="拒收行写入此 NDJSON 文件")
+    parser.add_argument("--chunk-rows", type=int, default=INGEST_CHUNK_ROWS)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="工作进程数")
+    parser.add_argument("--scr-unit", help="整份文件统一的肌酐单位 (文件没有肌酐单位列时使用；缺省按数值判断)")
+    args = parser.parse_args(argv)
+
+    stats = ingest(args.input, args.output, args.rejects, args.chunk_rows, args.workers, args.scr_unit)
+    print(f"已处理 {stats['rows']} 行：写入 {stats['written']}，拒收 {stats['rejected']}，"
+          f"用时 {stats['seconds']:.2f}s ({stats['rows_per_s']:,.0f} 行/秒)", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+import json
+import math
+import os
+import re
+from collections import Counter
+
+from ckd.staging import albuminuria_category, gfr_category
+
+# ================= 知识库检索 (本地 BM25 索引) =================
+# 不再把全部指南原文塞进 Prompt：按段落切块建索引，只取与患者分期相关的 top-k 段落。
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+KB_SOURCES = [
+    ("KDIGO 2024", "kdigo_guidelines_2024.txt"),
+    ("中国指南 2023", "中国慢性肾脏病早期评价与管理指南 (2023).txt"),
+    ("Comprehensive Clinical Nephrology", "Comprehensive Clinical Nephrology .txt"),
+]
+INDEX_PATH = os.path.join(BASE_DIR, ".kb_index.json")
+INDEX_VERSION = 1
+
+CHUNK_CHARS = 320          # 单个段落块的目标长度 (字符)
+PINNED_SECTIONS = ["报告生成规范"]  # 无论检索结果如何都要带上的章节 (引用规范等)
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+_SECTION_RE = re.compile(r"^\s*(\d+)\.\s*\S")
+_ASCII_RE = re.compile(r"[a-z0-9][a-z0-9.+/-]*")
+_CJK_RE = re.compile(r"[一-鿿]+")
+
+
+def tokenize(text):
+    """中英混合分词：英文/数字按词，中文按相邻二字组 (单字片段保留单字)"""
+    text = str(text).lower()
+    tokens = _ASCII_RE.findall(text)
+    for run in _CJK_RE.findall(text):
+        if len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+def estimate_tokens(text):
+    """粗略估算 LLM token 数：每个汉字约 1 token，其余字符约 4 个 1 token"""
+    text = str(text)
+    cjk = sum(len(run) for run in _CJK_RE.findall(text))
+    return cjk + math.ceil((len(text) - cjk) / 4)
+
+
+def chunk_text(text, source, max_chars=CHUNK_CHARS):
+    """按编号章节 + 行边界切块，每块带上所属章节标题，方便模型引用"""
+    chunks = []
+    section, buf = "", []
+
+    def flush():
+        body = "\n".join(buf).strip()
+        if body:
+            chunks.append({"source": source, "section": section, "text": body})
+        buf.clear()
+
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        if _SECTION_RE.match(line):
+            flush()
+            section = line.strip()
+            buf.append(section)
+            continue
+        if buf and sum(len(x) for x in buf) + len(line) > max_chars:
+            flush()
+            if section:
+                buf.append(f"{section} (续)")
+        buf.append(line.rstrip())
+    flush()
+    return chunks
+
+
+class KnowledgeIndex:
+    """BM25 段落索引，可序列化为 JSON 存盘"""
+
+    def __init__(self, chunks, manifest):
+        self.chunks = chunks
+        self.manifest = manifest
+        self._tfs = [Counter(tokenize(c["text"])) for c in chunks]
+        self._lens = [sum(tf.values()) for tf in self._tfs]
+        self._avgdl = (sum(self._lens) / len(self._lens)) if self._lens else 0.0
+        df = Counter()
+        for tf in self._tfs:
+            df.update(tf.keys())
+        n = len(chunks)
+        self._idf = {t: math.log(1 + (n - d + 0.5) / (d + 0.5)) for t, d in df.items()}
+
+    @classmethod
+    def build(cls, base_dir=BASE_DIR, sources=KB_SOURCES):
+        chunks = []
+        manifest = _source_manifest(base_dir, sources)
+        for label, fname in sources:
+            path = os.path.join(base_dir, fname)
+            if not os.path.exists(path):
+                continue
+            with open(path, "r", encoding="utf-8") as f:
+                chunks.extend(chunk_text(f.read(), label))
+        return cls(chunks, manifest)
+
+    def save(self, path=INDEX_PATH):
+        payload = {"version": INDEX_VERSION, "manifest": self.manifest, "chunks": self.chunks}
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(payload, f, ensure_ascii=False)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path=INDEX_PATH):
+        with open(path, "r", encoding="utf-8") as f:
+            payload = json.load(f)
+        if payload.get("version") != INDEX_VERSION:
+            raise ValueError("索引版本不匹配")
+        return cls(payload["chunks"], payload["manifest"])
+
+    @property
+    def version(self):
+        """知识库版本号：由各源文件的 mtime/大小决定，可作为缓存键的一部分"""
+        return "|".join(f"{k}:{v[0]}:{v[1]}" for k, v in sorted(self.manifest.items()))
+
+    def score(self, query):
+        q = tokenize(query)
+        scores = []
+        for tf, dl in zip(self._tfs, self._lens):
+            s = 0.0
+            for t in q:
+                f = tf.get(t)
+                if not f:
+                    continue
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * dl / (self._avgdl or 1))
+                s += self._idf[t] * f * (BM25_K1 + 1) / (f + norm)
+            scores.append(s)
+        return scores
+
+    def search(self, query, k=6, token_budget=None):
+        """返回 top-k 段落 (按原文顺序)；给定 token_budget 时在预算内贪心选取"""
+        scores = self.score(query)
+        pinned = [i for i, c in enumerate(self.chunks)
+                  if any(p in c["section"] for p in PINNED_SECTIONS)]
+        ranked = sorted((i for i, s in enumerate(scores) if s > 0 and i not in pinned),
+                        key=lambda i: -scores[i])
+
+        picked, used = [], 0
+        for i in pinned + ranked:
+            if len(picked) >= k + len(pinned):
+                break
+            cost = estimate_tokens(self.chunks[i]["text"])
+            if token_budget is not None and used + cost > token_budget:
+                continue
+            picked.append(i)
+            used += cost
+        return [self.chunks[i] for i in sorted(picked)]
+
+
+def _source_manifest(base_dir, sources):
+    manifest = {}
+    for _, fname in sources:
+        path = os.path.join(base_dir, fname)
+        try:
+            st_ = os.stat(path)
+            manifest[fname] = [st_.st_mtime_ns, st_.st_size]
+        except OSError:
+            manifest[fname] = [0, 0]
+    return manifest
+
+
+_INDEX_CACHE = {}
+
+
+def get_index(base_dir=BASE_DIR, index_path=INDEX_PATH, sources=KB_SOURCES):
+    """取得最新索引：源文件 mtime/大小未变则复用内存或磁盘索引，否则重建并落盘"""
+    manifest = _source_manifest(base_dir, sources)
+    cached = _INDEX_CACHE.get(index_path)
+    if cached is not None and cached.manifest == manifest:
+        return cached
+
+    index = None
+    if os.path.exists(index_path):
+        try:
+            index = KnowledgeIndex.load(index_path)
+        except Exception:
+            index = None
+    if index is None or index.manifest != manifest:
+        index = KnowledgeIndex.build(base_dir, sources)
+        try:
+            index.save(index_path)
+        except OSError:
+            pass  # 只读部署时仅保留内存索引
+    _INDEX_CACHE[index_path] = index
+    return index
+
+
+def build_patient_query(patient):
+    """根据患者 eGFR / uACR 分期拼出检索词 (分期、阈值、用药与转诊关键词)"""
+    terms = ["CKD", "KFRE", "转诊", "监测"]
+    g = gfr_category(patient.get("egfr"))
+    a = albuminuria_category(patient.get("uacr"))
+    if g:
+        terms += [g, "eGFR", "GFR 分期"]
+        if g in ("G3a", "G3b", "G4", "G5"):
+            terms += ["蛋白质摄入", "SGLT2", "二甲双胍", "胰岛素"]
+        if g in ("G4", "G5"):
+            terms += ["透析", "肾脏替代治疗", "肾衰竭"]
+    if a:
+        terms += [a, "ACR", "uACR", "白蛋白尿"]
+        if a in ("A2", "A3"):
+            terms += ["ACEi", "ARB", "RAS 阻断剂", "SGLT2 抑制剂", "非奈利酮"]
+    if patient.get("bp"):
+        terms += ["血压", "SBP", "mmHg"]
+    if patient.get("hba1c") or patient.get("glucose") or str(patient.get("dm", "")).lower() == "yes":
+        terms += ["糖尿病", "HbA1c", "血糖", "DKD"]
+    if str(patient.get("htn", "")).lower() == "yes":
+        terms += ["高血压"]
+    return " ".join(terms)
+
+
+def retrieve_for_patient(patient, k=6, token_budget=1500, index=None):
+    """检索与患者相关的指南段落，返回可直接放进 Prompt 的文本"""
+    index = index or get_index()
+    passages = index.search(build_patient_query(patient), k=k, token_budget=token_budget)
+    return format_passages(passages)
+
+
+def retrieve_with_version(patient, k=6, token_budget=1500):
+    """检索段落并返回 (文本, 知识库版本)；版本含检索参数，用于报告缓存键 (页面与批量导出一致)"""
+    index = get_index()
+    return retrieve_for_patient(patient, k=k, token_budget=token_budget, index=index), \
+        f"{index.version}|k={k}|budget={token_budget}"
+
+
+def format_passages(passages):
+    return "\n\n".join(f"[{p['source']}] {p['text']}" for p in passages)
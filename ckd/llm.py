@@ -0,0 +1,273 @@
+import base64
+import contextlib
+import json
+import random
+import threading
+import time
+
+from ckd.gate import GATE, INTERACTIVE, request_key
+
+# ================= LLM 后端抽象层 =================
+# 提取与报告两条链路统一走 backend.generate()：
+#   - 超时、指数退避重试、共享客户端 (连接复用) 在这里统一处理；
+#   - CKD_LLM_BACKEND=gemini (默认) 走 Google Gemini；
+#     CKD_LLM_BACKEND=http 走任意兼容的 HTTP 服务，例如本地替身 `python -m ckd.standin_server`。
+# generate(stream=False) 返回 LLMResponse；stream=True 返回 LLMStream (逐段文本迭代器)。
+# get_backend() 创建的实例挂上进程级 GATE (ckd.gate)：相同请求跨会话合并，每次实际请求都按优先级排队限流。
+
+DEFAULT_MODEL = "gemini-3-pro-preview"
+_RETRYABLE_NAMES = {
+    "ServiceUnavailable", "TooManyRequests", "ResourceExhausted", "DeadlineExceeded",
+    "InternalServerError", "GatewayTimeout", "Timeout", "ConnectTimeout", "ReadTimeout",
+    "ConnectionError",
+}
+
+
+class LLMError(RuntimeError):
+    def __init__(self, message, retryable=False):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+class LLMResponse:
+    def __init__(self, text, usage=None):
+        self.text = text
+        self.usage = usage or {}
+
+
+class LLMStream:
+    """流式结果：迭代得到文本片段；迭代结束后 .text / .usage 可用"""
+
+    def __init__(self, chunks, usage):
+        self._chunks = chunks
+        self.usage = usage
+        self.text = ""
+
+    def __iter__(self):
+        for piece in self._chunks:
+            self.text += piece
+            yield piece
+
+
+def is_retryable(exc):
+    if isinstance(exc, LLMError):
+        return exc.retryable
+    if isinstance(exc, (ConnectionError, TimeoutError)):
+        return True
+    return type(exc).__name__ in _RETRYABLE_NAMES
+
+
+class LLMBackend:
+    """后端基类：子类实现 _generate / _stream，重试与退避在这里统一处理"""
+
+    name = "base"
+
+    def __init__(self, model_name=DEFAULT_MODEL, timeout=120.0, max_retries=2, backoff=1.0):
+        self.model_name = model_name
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+
+    def _sleep_before_retry(self, attempt):
+        time.sleep(self.backoff * (2 ** attempt) * (0.5 + random.random()))
+
+    gate = None
+
+    def _slot(self, priority):
+        if self.gate is None:
+            return contextlib.nullcontext()
+        return self.gate.limiter.slot(priority)
+
+    def generate(self, contents, json_output=False, temperature=None, stream=False, priority=INTERACTIVE):
+        """priority: "interactive" (页面操作) 或 "batch" (批量任务)，排队时交互请求优先"""
+        gate = self.gate
+        if gate is None:
+            return self._generate_once(contents, json_output, temperature, stream, priority)
+        key = request_key(self.model_name, contents, json_output, temperature, stream)
+        if stream:
+            return gate.flight.stream(
+                key, lambda usage: self._stream_with_retry(contents, json_output, temperature, usage, priority))
+        return gate.flight.call(
+            key, lambda: self._generate_once(contents, json_output, temperature, False, priority))
+
+    def _generate_once(self, contents, json_output, temperature, stream, priority):
+        if stream:
+            usage = {}
+            return LLMStream(self._stream_with_retry(contents, json_output, temperature, usage, priority), usage)
+        for attempt in range(self.max_retries + 1):
+            try:
+                with self._slot(priority):
+                    return self._generate(contents, json_output, temperature)
+            except Exception as e:
+                if attempt >= self.max_retries or not is_retryable(e):
+                    raise
+                self._sleep_before_retry(attempt)
+
+    def _stream_with_retry(self, contents, json_output, temperature, usage, priority=INTERACTIVE):
+        # 只有在还没产出任何片段之前才重试，避免重复渲染
+        for attempt in range(self.max_retries + 1):
+            started = False
+            try:
+                with self._slot(priority):
+                    for text in self._stream(contents, json_output, temperature, usage):
+                        started = True
+                        yield text
+                return
+            except Exception as e:
+                if started or attempt >= self.max_retries or not is_retryable(e):
+                    raise
+                self._sleep_before_retry(attempt)
+
+    def _generate(self, contents, json_output, temperature):
+        raise NotImplementedError
+
+    def _stream(self, contents, json_output, temperature, usage):
+        res = self._generate(contents, json_output, temperature)
+        usage.update(res.usage)
+        yield res.text
+
+
+class GeminiBackend(LLMBackend):
+    name = "gemini"
+
+    def __init__(self, api_key, model_name=DEFAULT_MODEL, proxy=None, **kwargs):
+        super().__init__(model_name=model_name, **kwargs)
+        import google.generativeai as genai
+        self._genai = genai
+        genai.configure(api_key=api_key)
+        self._model = genai.GenerativeModel(model_name)
+        if proxy:
+            # 代理只作用于本后端自己的 gRPC 通道，不改进程环境变量 (其他 HTTP 客户端不受影响)
+            self._model._client = self._proxied_client(api_key, proxy)
+
+    @staticmethod
+    def _proxied_client(api_key, proxy):
+        from google.ai import generativelanguage as glm
+        from google.ai.generativelanguage_v1beta.services.generative_service.transports import (
+            GenerativeServiceGrpcTransport,
+        )
+
+        def channel(host, options=(), **kwargs):
+            return GenerativeServiceGrpcTransport.create_channel(
+                host, options=[*options, ("grpc.http_proxy", proxy)], **kwargs)
+
+        return glm.GenerativeServiceClient(
+            transport=lambda **kw: GenerativeServiceGrpcTransport(channel=channel, **kw),
+            client_options={"api_key": api_key})
+
+    def _config(self, json_output, temperature):
+        kwargs = {}
+        if temperature is not None: kwargs["temperature"] = temperature
+        if json_output: kwargs["response_mime_type"] = "application/json"
+        return self._genai.types.GenerationConfig(**kwargs) if kwargs else None
+
+    @staticmethod
+    def _usage(res):
+        meta = getattr(res, "usage_metadata", None)
+        if meta is None:
+            return {}
+        return {
+            "prompt_tokens": getattr(meta, "prompt_token_count", None),
+            "output_tokens": getattr(meta, "candidates_token_count", None),
+            "total_tokens": getattr(meta, "total_token_count", None),
+        }
+
+    def _generate(self, contents, json_output, temperature):
+        res = self._model.generate_content(
+            contents, generation_config=self._config(json_output, temperature),
+            request_options={"timeout": self.timeout})
+        return LLMResponse(res.text, self._usage(res))
+
+    def _stream(self, contents, json_output, temperature, usage):
+        res = self._model.generate_content(
+            contents, generation_config=self._config(json_output, temperature),
+            request_options={"timeout": self.timeout}, stream=True)
+        for chunk in res:
+            yield chunk.text
+        usage.update(self._usage(res))
+
+
+class HTTPBackend(LLMBackend):
+    """通用 HTTP JSON 后端 (协议见 ckd.standin_server)；使用共享 Session 复用连接"""
+
+    name = "http"
+
+    def __init__(self, base_url, model_name="standin", api_key=None, pool_size=16, **kwargs):
+        super().__init__(model_name=model_name, **kwargs)
+        import requests
+        from requests.adapters import HTTPAdapter
+        self._requests = requests
+        self.base_url = base_url.rstrip("/")
+        self._session = requests.Session()
+        self._session.trust_env = False  # 本地替身不走代理
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+        if api_key:
+            self._session.headers["Authorization"] = f"Bearer {api_key}"
+
+    @staticmethod
+    def _encode_part(part):
+        if isinstance(part, dict) and "data" in part:
+            return {"mime_type": part.get("mime_type"), "data": base64.b64encode(part["data"]).decode("ascii")}
+        return str(part)
+
+    def _post(self, contents, json_output, temperature, stream):
+        parts = contents if isinstance(contents, list) else [contents]
+        body = {
+            "model": self.model_name,
+            "contents": [self._encode_part(p) for p in parts],
+            "json": json_output,
+            "temperature": temperature,
+            "stream": stream,
+        }
+        try:
+            resp = self._session.post(f"{self.base_url}/v1/generate", json=body,
+                                      timeout=self.timeout, stream=stream)
+        except self._requests.RequestException as e:
+            raise LLMError(f"LLM 服务连接失败: {e}", retryable=True) from e
+        if resp.status_code >= 400:
+            retryable = resp.status_code == 429 or resp.status_code >= 500
+            raise LLMError(f"LLM 服务返回 {resp.status_code}: {resp.text[:200]}", retryable=retryable)
+        return resp
+
+    def _generate(self, contents, json_output, temperature):
+        data = self._post(contents, json_output, temperature, stream=False).json()
+        return LLMResponse(data.get("text", ""), data.get("usage"))
+
+    def _stream(self, contents, json_output, temperature, usage):
+        resp = self._post(contents, json_output, temperature, stream=True)
+        with resp:
+            for line in resp.iter_lines(decode_unicode=True):
+                if not line:
+                    continue
+                event = json.loads(line)
+                if event.get("usage"):
+                    usage.update(event["usage"])
+                if event.get("text"):
+                    yield event["text"]
+
+
+_BACKENDS = {}
+_BACKENDS_LOCK = threading.Lock()
+
+
+def get_backend(kind="gemini", model_name=None, api_key=None, base_url=None, proxy=None,
+                timeout=120.0, max_retries=2, backoff=1.0):
+    """按配置取共享后端实例 (同一配置在进程内只创建一次)"""
+    key = (kind, model_name, api_key, base_url, proxy, timeout, max_retries, backoff)
+    with _BACKENDS_LOCK:
+        backend = _BACKENDS.get(key)
+        if backend is None:
+            common = {"timeout": timeout, "max_retries": max_retries, "backoff": backoff}
+            if kind == "gemini":
+                backend = GeminiBackend(api_key, model_name=model_name or DEFAULT_MODEL, proxy=proxy, **common)
+            elif kind == "http":
+                if not base_url:
+                    raise LLMError("CKD_LLM_BACKEND=http 需要同时配置 CKD_LLM_BASE_URL")
+                backend = HTTPBackend(base_url, model_name=model_name or "standin", api_key=api_key, **common)
+            else:
+                raise LLMError(f"未知的 LLM 后端: {kind}")
+            backend.gate = GATE
+            _BACKENDS[key] = backend
+        return backend
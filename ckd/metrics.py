@@ -0,0 +1,230 @@
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from logging.handlers import RotatingFileHandler
+
+from ckd.report_cache import CACHE_DIR
+
+# ================= 分阶段耗时 / Token 统计 =================
+# with stage("llm_report") as m: ...; m["prompt_tokens"] = 123
+#   - 每次事件写一行 JSON 到滚动日志 (.ckd_cache/metrics.log)；
+#   - 进程内保留每个阶段最近 WINDOW 次耗时，用于 p50/p95；
+#   - 以 Prometheus 文本格式导出到 .ckd_cache/metrics.prom，或通过 /metrics 端点暴露。
+WINDOW = 1000
+LOG_PATH = os.path.join(CACHE_DIR, "metrics.log")
+PROM_PATH = os.path.join(CACHE_DIR, "metrics.prom")
+PROM_WRITE_INTERVAL = 5.0
+
+# 事件里的这些数值字段会累加成计数器
+TOKEN_FIELDS = ("prompt_tokens", "output_tokens")
+BYTES_FIELDS = ("request_chars", "response_chars")
+
+
+def _quantile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(round(q * (len(sorted_values) - 1))))]
+
+
+class MetricsRegistry:
+    def __init__(self, log_path=LOG_PATH, prom_path=PROM_PATH, window=WINDOW):
+        self.prom_path = prom_path
+        self._lock = threading.Lock()
+        self._windows = defaultdict(lambda: deque(maxlen=window))
+        self._count = defaultdict(int)
+        self._sum = defaultdict(float)
+        self._errors = defaultdict(int)
+        self._totals = defaultdict(float)  # (stage, field) -> 累计值
+        self._counters = defaultdict(int)  # (name, ((label, value), ...)) -> 次数
+        self._last_prom_write = 0.0
+        self.log_path = log_path
+        self._log = None
+        self._log_lock = threading.Lock()
+
+    def _logger(self):
+        """滚动日志在第一次记录事件时才创建 (仅 import 不会建目录 / 写文件)"""
+        if self._log is not None:
+            return self._log
+        with self._log_lock:
+            if self._log is None:
+                log = logging.getLogger(f"ckd.metrics.{id(self)}")
+                log.propagate = False
+                log.setLevel(logging.INFO)
+                try:
+                    os.makedirs(os.path.dirname(self.log_path) or ".", exist_ok=True)
+                    handler = RotatingFileHandler(self.log_path, maxBytes=5 * 1024 * 1024, backupCount=3,
+                                                  encoding="utf-8")
+                    handler.setFormatter(logging.Formatter("%(message)s"))
+                    log.addHandler(handler)
+                except OSError:
+                    log.addHandler(logging.NullHandler())
+                self._log = log
+        return self._log
+
+    def record(self, stage, seconds, error=False, **attrs):
+        with self._lock:
+            self._windows[stage].append(seconds)
+            self._count[stage] += 1
+            self._sum[stage] += seconds
+            if error:
+                self._errors[stage] += 1
+            for field in TOKEN_FIELDS + BYTES_FIELDS:
+                if isinstance(attrs.get(field), (int, float)):
+                    self._totals[(stage, field)] += attrs[field]
+        event = {"ts": round(time.time(), 3), "stage": stage, "seconds": round(seconds, 6), "error": error}
+        event.update(attrs)
+        self._logger().info(json.dumps(event, ensure_ascii=False, default=str))
+        self._maybe_write_prom()
+
+    def increment(self, name, amount=1, **labels):
+        """业务计数器 (如 LLM 调用被规则引擎 / 缓存拦截的次数)，导出为 ckd_<name>_total"""
+        with self._lock:
+            self._counters[(name, tuple(sorted((k, str(v)) for k, v in labels.items())))] += amount
+
+    def counter(self, name, **labels):
+        """按标签过滤求和；不给标签时返回该计数器全部标签的合计"""
+        want = {k: str(v) for k, v in labels.items()}
+        with self._lock:
+            return sum(v for (n, lbl), v in self._counters.items() if n == name and want.items() <= dict(lbl).items())
+
+    @contextmanager
+    def stage(self, name, **attrs):
+        """计时上下文；块内可往返回的 dict 里补充 token / 大小等字段"""
+        info = dict(attrs)
+        t0 = time.perf_counter()
+        try:
+            yield info
+        except BaseException:
+            self.record(name, time.perf_counter() - t0, error=True, **info)
+            raise
+        self.record(name, time.perf_counter() - t0, **info)
+
+    def summary(self):
+        """每个阶段的次数 / p50 / p95 / 均值 (秒)，供侧边栏展示"""
+        with self._lock:
+            rows = []
+            for stage_name in sorted(self._count):
+                window = sorted(self._windows[stage_name])
+                rows.append({
+                    "stage": stage_name,
+                    "count": self._count[stage_name],
+                    "errors": self._errors[stage_name],
+                    "p50_ms": _quantile(window, 0.5) * 1000,
+                    "p95_ms": _quantile(window, 0.95) * 1000,
+                    "mean_ms": self._sum[stage_name] / self._count[stage_name] * 1000,
+                    "prompt_tokens": self._totals.get((stage_name, "prompt_tokens"), 0),
+                    "output_tokens": self._totals.get((stage_name, "output_tokens"), 0),
+                })
+            return rows
+
+    def render_prometheus(self):
+        with self._lock:
+            lines = [
+                "# HELP ckd_stage_duration_seconds Per-stage latency of the CKD agent pipeline.",
+                "# TYPE ckd_stage_duration_seconds summary",
+            ]
+            for stage_name in sorted(self._count):
+                window = sorted(self._windows[stage_name])
+                for q in (0.5, 0.95):
+                    lines.append(f'ckd_stage_duration_seconds{{stage="{stage_name}",quantile="{q}"}} {_quantile(window, q):.6f}')
+                lines.append(f'ckd_stage_duration_seconds_sum{{stage="{stage_name}"}} {self._sum[stage_name]:.6f}')
+                lines.append(f'ckd_stage_duration_seconds_count{{stage="{stage_name}"}} {self._count[stage_name]}')
+            lines += ["# HELP ckd_stage_errors_total Stage executions that raised.",
+                      "# TYPE ckd_stage_errors_total counter"]
+            for stage_name in sorted(self._count):
+                lines.append(f'ckd_stage_errors_total{{stage="{stage_name}"}} {self._errors[stage_name]}')
+            lines += ["# HELP ckd_llm_tokens_total LLM token usage reported by the backend.",
+                      "# TYPE ckd_llm_tokens_total counter"]
+            for (stage_name, field), value in sorted(self._totals.items()):
+                if field in TOKEN_FIELDS:
+                    kind = field.split("_")[0]
+                    lines.append(f'ckd_llm_tokens_total{{stage="{stage_name}",kind="{kind}"}} {value:g}')
+            lines += ["# HELP ckd_payload_chars_total Prompt / response size in characters.",
+                      "# TYPE ckd_payload_chars_total counter"]
+            for (stage_name, field), value in sorted(self._totals.items()):
+                if field in BYTES_FIELDS:
+                    direction = field.split("_")[0]
+                    lines.append(f'ckd_payload_chars_total{{stage="{stage_name}",direction="{direction}"}} {value:g}')
+            for name in sorted({n for n, _ in self._counters}):
+                lines += [f"# TYPE ckd_{name}_total counter"]
+                for (n, labels), value in sorted(self._counters.items()):
+                    if n == name:
+                        label_text = ",".join(f'{k}="{v}"' for k, v in labels)
+                        lines.append(f"ckd_{name}_total{{{label_text}}} {value}")
+            return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path=None):
+        path = path or self.prom_path
+        try:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            tmp = f"{path}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.write(self.render_prometheus())
+            os.replace(tmp, path)
+        except OSError:
+            pass
+
+    def _maybe_write_prom(self):
+        now = time.monotonic()
+        if now - self._last_prom_write >= PROM_WRITE_INTERVAL:
+            self._last_prom_write = now
+            self.write_prometheus()
+
+
+_REGISTRY = None
+_REGISTRY_LOCK = threading.Lock()
+
+
+def get_registry():
+    """进程内共享的指标注册表，首次调用时创建 (退出时写一次 metrics.prom)"""
+    global _REGISTRY
+    if _REGISTRY is None:
+        with _REGISTRY_LOCK:
+            if _REGISTRY is None:
+                registry = MetricsRegistry()
+                atexit.register(registry.write_prometheus)
+                _REGISTRY = registry
+    return _REGISTRY
+
+
+def stage(name, **attrs):
+    return get_registry().stage(name, **attrs)
+
+
+_SERVERS = {}
+_SERVERS_LOCK = threading.Lock()
+
+
+def start_metrics_server(port, host="127.0.0.1", registry=None):
+    """在后台线程暴露 GET /metrics (Prometheus 文本格式)；同一端口只启动一次。默认只监听本机"""
+    registry = registry or get_registry()
+    with _SERVERS_LOCK:
+        if port in _SERVERS:
+            return _SERVERS[port]
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, fmt, *args):
+                pass
+
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                body = registry.render_prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        _SERVERS[port] = server
+        return server
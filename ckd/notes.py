@@ -0,0 +1,187 @@
+import re
+
+# ================= 文本病历本地解析 (中 / 英文化验描述) =================
+# "男 62岁 Scr 156 umol/L uACR 45 mg/mmol" 这类手输文本不必调用模型：
+# 这里用正则直接解析出与 EXTRACTION_PROMPT 相同结构的 JSON；
+# 只有核心字段不全、或文本里出现了关键词却解析不出数值时，才交给模型补全。
+
+_NUM = r"(\d+(?:\.\d+)?)"
+_SEP = r"\s*(?:[:：=]|为|是)?\s*"
+# 单位别名 → 规范写法 (按匹配优先级排列：长的在前)
+_UNITS = [
+    (r"[uμµ]mol\s*/\s*l", "umol/L"),
+    (r"mmol\s*/\s*mol", "mmol/mol"),
+    (r"mmol\s*/\s*l", "mmol/L"),
+    (r"mg\s*/\s*mmol", "mg/mmol"),
+    (r"[uμµ]g\s*/\s*mg", "ug/mg"),
+    (r"mg\s*/\s*dl", "mg/dL"),
+    (r"mg\s*/\s*g", "mg/g"),
+    (r"mg\s*/\s*l", "mg/L"),
+    (r"g\s*/\s*g", "g/g"),
+    (r"ml\s*/\s*min(?:\s*/\s*1\.73\s*m(?:2|²)?)?", "ml/min/1.73m²"),
+    (r"%", "%"),
+]
+_UNIT_RE = re.compile(r"\s*(" + "|".join(p for p, _ in _UNITS) + r")", re.IGNORECASE)
+
+
+def _latin(words):
+    """英文关键词两侧不能紧贴字母 (避免 cr 命中 creatinine 中间、acr 命中 uacr 之外的单词)"""
+    return r"(?<![A-Za-z])(?:" + words + r")(?![A-Za-z])"
+
+
+# (字段, 关键词正则, 缺省单位)；按顺序匹配，先匹配的文本片段会被遮盖，
+# 所以 "尿微量白蛋白/肌酐比值" 不会再被当成尿白蛋白或血肌酐。
+_LAB_FIELDS = [
+    ("uacr_raw", r"尿(?:微量)?白蛋白\s*[/／]?\s*(?:尿)?肌酐(?:比值|比)?|白蛋白\s*[/／]\s*肌酐(?:比值|比)?|"
+                 + _latin(r"u-?acr|acr|albumin[- ](?:to[- ])?creatinine ratio"), ""),
+    ("u_albumin_raw", r"尿(?:微量)?白蛋白|" + _latin(r"m-?alb|u-?alb|urine albumin|urinary albumin"), "mg/L"),
+    ("u_creatinine_raw", r"尿肌酐|" + _latin(r"u-?cr(?:ea)?|urine creatinine|urinary creatinine"), ""),
+    ("creatinine_raw", r"(?:血清|血)?肌酐|" + _latin(r"s-?cr(?:ea)?|serum creatinine|creatinine|crea|cr"), ""),
+    ("hba1c", r"糖化血红蛋白|" + _latin(r"hba1c|hb\s*a1c|a1c"), "%"),
+    ("glucose", r"空腹血糖|血糖|" + _latin(r"fpg|fbg|glu(?:cose)?"), ""),
+]
+_EGFR_KEY = r"估算肾小球滤过率|肾小球滤过率|" + _latin(r"e-?gfr")
+# 关键词后紧跟 (12 个字符内) 数字却没能解析时才算"未能解析"；"血压偏高"、"肌酐正常" 这类定性描述不算
+_HINT_TAIL = r".{0,12}?\d"
+
+
+def _compile_field(keyword):
+    return (re.compile(r"(?:" + keyword + r")" + _SEP + _NUM, re.IGNORECASE),
+            re.compile(r"(?:" + keyword + r")", re.IGNORECASE),
+            re.compile(r"(?:" + keyword + r")" + _HINT_TAIL, re.IGNORECASE))
+
+
+_LAB_RES = [(field, *_compile_field(keyword), unit) for field, keyword, unit in _LAB_FIELDS]
+_EGFR_RES = _compile_field(_EGFR_KEY)
+_BP_PATTERNS = [
+    re.compile(r"(?:血压|" + _latin(r"bp|blood pressure") + r")" + _SEP + r"(\d{2,3})\s*[/／]\s*(\d{2,3})", re.IGNORECASE),
+    re.compile(r"(\d{2,3})\s*[/／]\s*(\d{2,3})\s*mm\s*hg", re.IGNORECASE),
+]
+_AGE_PATTERNS = [
+    re.compile(r"(\d{1,3})\s*(?:岁|周岁)"),
+    re.compile(r"(?:年龄|" + _latin(r"age") + r")" + _SEP + r"(\d{1,3})", re.IGNORECASE),
+    re.compile(r"(\d{1,3})\s*-?\s*(?:years?[- ]old|y/o|yo|yrs?)(?![A-Za-z])", re.IGNORECASE),
+    re.compile(r"(?<![\d.])(\d{1,3})\s*[MF](?![A-Za-z])"),
+]
+_SEX_PATTERNS = [
+    (re.compile(r"女"), "女"),
+    (re.compile(r"男"), "男"),
+    (re.compile(_latin(r"female|woman"), re.IGNORECASE), "Female"),
+    (re.compile(_latin(r"male|man"), re.IGNORECASE), "Male"),
+    (re.compile(r"(?:" + _latin(r"sex|gender") + r")" + _SEP + r"([MF])(?![A-Za-z])", re.IGNORECASE), None),
+    (re.compile(r"(?<![\d.])\d{1,3}\s*([MF])(?![A-Za-z])"), None),
+]
+_BP_HINT = re.compile(r"(?:血压|" + _latin(r"bp|blood pressure") + r")" + _HINT_TAIL, re.IGNORECASE)
+
+
+def _normalize_unit(raw):
+    for pattern, canonical in _UNITS:
+        if re.fullmatch(pattern, raw.strip(), re.IGNORECASE):
+            return canonical
+    return raw.strip()
+
+
+def _to_number(text):
+    value = float(text)
+    return int(value) if value.is_integer() else value
+
+
+def _mask(text, span):
+    start, end = span
+    return text[:start] + " " * (end - start) + text[end:]
+
+
+def _find_value(text, value_re, key_re, default_unit):
+    """关键词 + 数值 (+ 单位)；返回 ({"value", "unit"}, 匹配区间)，或 (None, 关键词区间 / None)"""
+    m = value_re.search(text)
+    if not m:
+        key = key_re.search(text)
+        return None, (key.span() if key else None)
+    end = m.end()
+    unit = default_unit
+    u = _UNIT_RE.match(text, end)
+    if u:
+        unit = _normalize_unit(u.group(1))
+        end = u.end()
+    return {"value": _to_number(m.group(1)), "unit": unit}, (m.start(), end)
+
+
+def parse_clinical_note(text):
+    """手输病历文本 → (与提取提示词同结构的 dict, 未能解析的字段列表)。
+
+    未能解析的字段包括：核心字段缺失 (年龄、性别、eGFR 或肌酐、uACR 或尿白蛋白 + 尿肌酐)，
+    以及文本中提到了关键词但没有解析出数值的字段。列表为空时可以不调用模型。
+    """
+    work = text or ""
+    result, pending, found = {}, [], []
+
+    for field, value_re, key_re, hint_re, default_unit in _LAB_RES:
+        value, span = _find_value(work, value_re, key_re, default_unit)
+        if value is not None:
+            result[field] = value
+            found.append(field)
+        elif span is not None and hint_re.search(work):
+            pending.append(field)
+        if span is not None:
+            work = _mask(work, span)
+
+    value_re, _, hint_re = _EGFR_RES
+    m = value_re.search(work)
+    if m:
+        result["egfr_stated"] = _to_number(m.group(1))
+        found.append("egfr_stated")
+        work = _mask(work, m.span())
+    elif hint_re.search(work):
+        pending.append("egfr_stated")
+
+    for pattern in _BP_PATTERNS:
+        m = pattern.search(work)
+        if m:
+            result["blood_pressure"] = {"sbp": int(m.group(1)), "dbp": int(m.group(2))}
+            found.append("blood_pressure")
+            work = _mask(work, m.span())
+            break
+    else:
+        if _BP_HINT.search(work):
+            pending.append("blood_pressure")
+
+    for pattern in _AGE_PATTERNS:
+        m = pattern.search(work)
+        if m:
+            result["age"] = int(m.group(1))
+            found.append("age")
+            break
+    else:
+        pending.append("age")
+
+    for pattern, sex in _SEX_PATTERNS:
+        m = pattern.search(work)
+        if m:
+            result["sex"] = sex or ("Male" if m.group(1).upper() == "M" else "Female")
+            found.append("sex")
+            break
+    else:
+        pending.append("sex")
+
+    if "egfr_stated" not in result and "creatinine_raw" not in result:
+        pending.append("egfr_stated / creatinine_raw")
+    if "uacr_raw" not in result and not ("u_albumin_raw" in result and "u_creatinine_raw" in result):
+        pending.append("uacr_raw")
+
+    pending = list(dict.fromkeys(pending))
+    summary = f"本地解析识别 {len(found)} 项：{', '.join(found) or '无'}"
+    if pending:
+        summary += f"；未能解析：{', '.join(pending)}"
+    result["report_summary"] = summary
+    return result, pending
+
+
+def fill_missing(model_result, local_result):
+    """模型结果补全本地解析：本地已解析的字段 (用户原文给出的数值) 优先"""
+    merged = dict(model_result or {})
+    for key, value in local_result.items():
+        if key != "report_summary":
+            merged[key] = value
+    summaries = [s for s in (local_result.get("report_summary"), (model_result or {}).get("report_summary")) if s]
+    merged["report_summary"] = "；".join(summaries)
+    return merged
@@ -0,0 +1,155 @@
+import json
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+from ckd.report_cache import CACHE_DIR
+
+# ================= 病例库 (解析一次 + id 索引 + 列式缓存) =================
+# CSV 只在文件 mtime/大小变化时重新解析；解析结果落盘为 Feather (需 pyarrow)，
+# 下次冷启动直接内存映射读取。按 id 查找走哈希索引，下拉框按页/前缀检索。
+
+
+def _file_signature(path):
+    st_ = os.stat(path)
+    return [st_.st_mtime_ns, st_.st_size]
+
+
+def patient_from_record(raw, patient_id):
+    """病例库一行 → 页面 / 报告使用的患者字典"""
+    return {
+        "age": raw['age'], "sex": raw['sex'],
+        "egfr": raw['egfr'], "uacr": raw['uacr'],
+        "source": f"Database ID: {patient_id}",
+        "patient_id": str(patient_id),
+        "htn": raw.get('htn', 'Unknown'),
+        "dm": raw.get('dm', 'Unknown'),
+        "bp": {"sbp": raw.get('sbp'), "dbp": raw.get('dbp')} if 'sbp' in raw else None,
+        "glucose": None,
+        "hba1c": None
+    }
+
+
+class PatientStore:
+    def __init__(self, csv_path, id_col="id", cache_dir=CACHE_DIR):
+        self.csv_path = csv_path
+        self.id_col = id_col
+        self.cache_dir = cache_dir
+        self._lock = threading.Lock()
+        self._signature = None
+        self._df = None
+        self._index = None
+        self._sorted_keys = None
+        self._sorted_pos = None
+        self.refresh()
+
+    # ---------- 加载与失效 ----------
+    @property
+    def _columnar_path(self):
+        name = os.path.splitext(os.path.basename(self.csv_path))[0]
+        return os.path.join(self.cache_dir, f"{name}.feather")
+
+    def _read_columnar(self, signature):
+        meta_path = f"{self._columnar_path}.json"
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                if json.load(f).get("source") != signature:
+                    return None
+            from pyarrow import feather
+            return feather.read_table(self._columnar_path, memory_map=True).to_pandas()
+        except (OSError, ValueError, ImportError):
+            return None
+
+    def _write_columnar(self, df, signature):
+        try:
+            from pyarrow import feather
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp = f"{self._columnar_path}.tmp"
+            feather.write_feather(df.reset_index(drop=True), tmp)
+            os.replace(tmp, self._columnar_path)
+            with open(f"{self._columnar_path}.json", "w", encoding="utf-8") as f:
+                json.dump({"source": signature}, f)
+        except (OSError, ValueError, ImportError):
+            pass  # 没有 pyarrow 或目录只读时只用内存结果
+
+    def refresh(self):
+        """源文件变化时重建；未变化时几乎零开销 (一次 stat)"""
+        signature = _file_signature(self.csv_path)
+        if signature == self._signature:
+            return False
+        with self._lock:
+            if signature == self._signature:
+                return False
+            df = self._read_columnar(signature)
+            if df is None:
+                df = pd.read_csv(self.csv_path)
+                self._write_columnar(df, signature)
+            self._build(df)
+            self._signature = signature
+        return True
+
+    def _build(self, df):
+        self._df = df.reset_index(drop=True)
+        self._index = pd.Index(self._df[self.id_col])
+        # 前缀检索用：字符串 id 排序后二分查找
+        keys = self._df[self.id_col].astype(str).to_numpy(dtype=str)
+        order = np.argsort(keys, kind="stable")
+        self._sorted_keys = keys[order]
+        self._sorted_pos = order
+
+    # ---------- 查询 ----------
+    @property
+    def version(self):
+        return self._signature
+
+    @property
+    def frame(self):
+        return self._df
+
+    def __len__(self):
+        return len(self._df)
+
+    def get(self, patient_id):
+        """按 id 取单个病例 (dict)；不存在时返回 None"""
+        try:
+            pos = self._index.get_loc(patient_id)
+        except (KeyError, TypeError):
+            return None
+        if not isinstance(pos, (int, np.integer)):
+            # 重复 id：与原 df[df['id'] == id].iloc[0] 一样取第一条
+            pos = int(np.flatnonzero(pos)[0]) if isinstance(pos, np.ndarray) else pos.start
+        return self._df.iloc[pos].to_dict()
+
+    def lookup(self, patient_id):
+        """按用户输入的 id 查找：先按原值，再按整数 (CSV 里的 id 多为 int64)"""
+        raw = self.get(patient_id)
+        if raw is None and isinstance(patient_id, str):
+            try:
+                raw = self.get(int(patient_id.strip()))
+            except ValueError:
+                raw = self.get(patient_id.strip())
+        return raw
+
+    def _match_range(self, query):
+        q = str(query).strip()
+        lo = np.searchsorted(self._sorted_keys, q, side="left")
+        hi = np.searchsorted(self._sorted_keys, q + "\uffff", side="left")
+        return lo, hi
+
+    def count(self, query=None):
+        if not query:
+            return len(self._df)
+        lo, hi = self._match_range(query)
+        return int(hi - lo)
+
+    def page(self, page, page_size=50, query=None):
+        """返回第 page 页 (从 0 开始) 的 id 列表；query 为 id 前缀"""
+        start = max(page, 0) * page_size
+        if not query:
+            positions = np.arange(start, min(start + page_size, len(self._df)))
+        else:
+            lo, hi = self._match_range(query)
+            positions = self._sorted_pos[lo + start:min(lo + start + page_size, hi)]
+        return self._df[self.id_col].to_numpy()[positions].tolist()
@@ -0,0 +1,255 @@
+# ================= 报告卡片渲染 / 提示词 (一次性 / 流式共用) =================
+# 各 render_* 只依赖传入的占位 slot，streamlit 仅在 make_report_slots 里按需导入；
+# 卡片 HTML 由 *_html 生成，报告导出 (ckd.export) 复用同一套版式。
+REPORT_CARD_KEYS = ["expert_assessment", "diagnosis", "referral", "medications", "lifestyle"]
+
+def assessment_html(assess):
+    # 容错处理：如果 assess 是字符串（虽然不太可能），转为字典
+    if isinstance(assess, str): assess = {"content": assess}
+    return f"""
+    <div class="expert-card">
+        <h4 style="margin:0 0 10px 0; color:#F57F17; font-size:1.1em;">🧠 首席专家深度综述</h4>
+        <p style="margin:0; color:#333; line-height:1.6; font-size:1.05em; font-weight:500;">
+            {assess.get('content', '未生成点评内容')}
+        </p>
+    </div>
+    """
+
+def render_assessment(slot, assess):
+    slot.markdown(assessment_html(assess), unsafe_allow_html=True)
+
+def diagnosis_html(diag):
+    # 【容错修复】检查类型，如果是字符串，手动包装成字典，防止报错
+    if isinstance(diag, str): diag = {"summary": diag, "detail": "详见综述", "citation": "N/A"}
+    return f"""
+    <div style="background-color:#E3F2FD; padding:15px; border-radius:10px; border-left: 5px solid #2196F3; margin-bottom:15px;">
+        <h4 style="margin:0; color:#0D47A1;">🩺 诊断: {diag.get('summary', '未知')}</h4>
+        <p style="margin:8px 0; color:#333;">{diag.get('detail', '暂无详情')}</p>
+        <div style="font-size:0.85em; color:#546E7A; border-top:1px dashed #BBDEFB; padding-top:5px;">📚 {diag.get('citation', 'N/A')}</div>
+    </div>
+    """
+
+def render_diagnosis(slot, diag):
+    slot.markdown(diagnosis_html(diag), unsafe_allow_html=True)
+
+def referral_html(ref):
+    if isinstance(ref, str): ref = {"advice": ref, "citation": "N/A"}
+    return f"""
+    <div style="background-color:#E8F5E9; padding:15px; border-radius:10px; border-left: 5px solid #4CAF50; margin-bottom:15px;">
+        <h4 style="margin:0; color:#1B5E20;">🏥 转诊建议</h4>
+        <p style="margin:8px 0; color:#333;">{ref.get('advice', '暂无建议')}</p>
+        <div style="font-size:0.85em; color:#558B2F; border-top:1px dashed #C8E6C9; padding-top:5px;">📚 {ref.get('citation', 'N/A')}</div>
+    </div>
+    """
+
+def render_referral(slot, ref):
+    slot.markdown(referral_html(ref), unsafe_allow_html=True)
+
+def medication_html(drug):
+    # 【容错修复】如果 drug 是字符串（比如 AI 返回了文本列表），将其转化为对象
+    if isinstance(drug, str):
+        drug = {"drug": drug, "status": "提示", "reason": "详情请见综述", "citation": "N/A"}
+    is_positive = "推荐" in drug.get('status', '') and "不" not in drug.get('status', '')
+    icon, color = ("✅", "#1B5E20") if is_positive else ("⚠️", "#B71C1C")
+    return f"""
+    <div style="border:1px solid #eee; background-color:#FAFAFA; padding:12px; border-radius:8px; margin-bottom:10px;">
+        <div style="display:flex; justify-content:space-between; align-items:center;">
+            <strong>{icon} {drug.get('drug')}</strong>
+            <span style="background-color:{color}; color:white; padding:2px 8px; border-radius:12px; font-size:0.8em;">{drug.get('status')}</span>
+        </div>
+        <div style="margin-top:8px; color:#444;">{drug.get('reason')}</div>
+        <div style="margin-top:5px; font-size:0.8em; color:#999; text-align:right;">📖 依据: {drug.get('citation', 'N/A')}</div>
+    </div>
+    """
+
+def render_medication(slot, drug):
+    slot.markdown(medication_html(drug), unsafe_allow_html=True)
+
+def lifestyle_html(life):
+    if isinstance(life, str): life = {"advice": life, "citation": "N/A"}
+    return f"""
+    <div style="border-left: 3px solid #FF9800; padding-left:10px; color:#555;">
+        {life.get('advice', '暂无建议')}<br>
+        <span style="font-size:0.8em; color:#999;">📖 {life.get('citation', 'N/A')}</span>
+    </div>
+    """
+
+def render_lifestyle(slot, life):
+    slot.markdown(lifestyle_html(life), unsafe_allow_html=True)
+
+def make_report_slots():
+    """先按版式占好各卡片的位置，字段到达时再填充 (顺序与原一次性渲染一致)"""
+    import streamlit as st
+    slots = {"expert_assessment": st.empty(), "_done": set()}
+    c1, c2 = st.columns(2)
+    with c1: slots["diagnosis"] = st.empty()
+    with c2: slots["referral"] = st.empty()
+    st.markdown("#### 💊 循证用药筛查")
+    slots["medications"] = st.container()
+    st.markdown("#### 🥗 生活方式管理")
+    slots["lifestyle"] = st.empty()
+    return slots
+
+def render_report_field(slots, path, value):
+    """渲染一个已完成的报告字段；path 为 (key, i) 时表示 medications 的第 i 个元素"""
+    if isinstance(path, tuple):
+        if path[0] == "medications":
+            render_medication(slots["medications"], value)
+            slots["_done"].add("medications")
+        return
+    if path == "medications":
+        if "medications" not in slots["_done"]:
+            for drug in (value if isinstance(value, list) else [value]):
+                render_medication(slots["medications"], drug)
+    elif path == "expert_assessment": render_assessment(slots[path], value)
+    elif path == "diagnosis": render_diagnosis(slots[path], value)
+    elif path == "referral": render_referral(slots[path], value)
+    elif path == "lifestyle": render_lifestyle(slots[path], value)
+    slots["_done"].add(path)
+
+def finish_report(slots):
+    """模型漏掉的字段按原逻辑显示默认文案"""
+    for key in REPORT_CARD_KEYS:
+        if key not in slots["_done"]:
+            render_report_field(slots, key, [] if key == "medications" else {})
+
+
+# 原报告提示词 (JSON 结构强制模型输出对象而非字符串)
+EXPERT_PROMPT_TEMPLATE = """
+            你是一位专业的肾脏病专家。请基于以下知识库摘录分析患者情况。
+            知识库：{kb_text}
+            患者数据：Age {age}, eGFR {egfr}, uACR {uacr}, BP {bp}
+            
+            请严格按照以下 JSON 结构输出 (不要 Markdown):
+            {{
+                "expert_assessment": {{ "content": "专家深度综述..." }},
+                "diagnosis": {{ "summary": "诊断结论", "detail": "详细分期说明", "citation": "依据" }},
+                "referral": {{ "advice": "转诊建议", "citation": "依据" }},
+                "medications": [
+                    {{ "drug": "SGLT2i/RASi等", "status": "推荐/不推荐/待评估", "reason": "...", "citation": "..." }}
+                ],
+                "lifestyle": {{ "advice": "...", "citation": "..." }}
+            }}
+            """
+
+
+def build_expert_prompt(patient, kb_text, bp_str):
+    return EXPERT_PROMPT_TEMPLATE.format(kb_text=kb_text, age=patient['age'], egfr=patient['egfr'],
+                                         uacr=patient['uacr'], bp=bp_str)
+
+
+def format_bp(patient):
+    """血压显示文本 (指标卡、提示词与导出文档共用)"""
+    bp = patient.get('bp') or {}
+    return f"{bp.get('sbp', '?')}/{bp.get('dbp', '?')}" if bp.get('sbp') else "未见数据"
+
+
+def risk_color_for(risk_5yr):
+    """5 年风险配色：< 3% 绿、< 5% 黄、其余红"""
+    return "#2E7D32" if risk_5yr < 3 else "#F9A825" if risk_5yr < 5 else "#D32F2F"
+
+
+def risk_trajectory_values(risks):
+    """第 0-5 年的风险走势点 (页面图表与导出文档共用)"""
+    risk_5yr = risks['5yr']
+    return [0, risk_5yr * 0.2, risks['2yr'], risk_5yr * 0.6, risk_5yr * 0.8, risk_5yr]
+
+
+def risk_trajectory_spec(risks, color):
+    """5 年风险走势面积图的 Vega-Lite 规格。
+
+    直接交给 st.vega_lite_chart，不经过 st.area_chart → altair：冷启动省去 altair 导入，
+    每次重跑也省去 altair 的 schema 校验。
+    """
+    return {
+        "data": {"values": [{"Year": f"Y{i}", "Risk": v} for i, v in enumerate(risk_trajectory_values(risks))]},
+        "mark": {"type": "area", "color": color, "opacity": 0.7, "line": {"color": color}},
+        "encoding": {
+            "x": {"field": "Year", "type": "nominal", "axis": {"labelAngle": 0}},
+            "y": {"field": "Risk", "type": "quantitative"},
+        },
+    }
+
+
+def history_trend_spec(series, color):
+    """随访趋势图：eGFR (左轴) 与 KFRE 5 年风险 (右轴) 按检验日期画折线；series 来自 HistoryStore.series"""
+    x = {"field": "date", "type": "temporal", "title": None, "axis": {"format": "%Y-%m"}}
+    return {
+        "data": {"values": series},
+        "layer": [
+            {"mark": {"type": "line", "point": True, "color": "#0E4D92"},
+             "encoding": {"x": x, "y": {"field": "egfr", "type": "quantitative", "title": "eGFR",
+                                        "axis": {"titleColor": "#0E4D92"}}}},
+            {"transform": [{"filter": "datum.risk_5yr != null"}],
+             "mark": {"type": "line", "point": True, "color": color, "strokeDash": [4, 3]},
+             "encoding": {"x": x, "y": {"field": "risk_5yr", "type": "quantitative", "title": "5年风险 %",
+                                        "axis": {"titleColor": color}}}},
+        ],
+        "resolve": {"scale": {"y": "independent"}},
+    }
+
+
+# ================= 模板报告 (常规低风险病例，不调用模型) =================
+# 字段结构与模型报告一致，直接交给 render_report_field 渲染；用药规则对应 kdigo_guidelines_2024.txt 第 3 章。
+_G_DESC = {"G1": "正常或增高", "G2": "轻度下降", "G3a": "轻度至中度下降", "G3b": "中度至重度下降",
+           "G4": "重度下降", "G5": "肾衰竭"}
+_A_DESC = {"A1": "正常至轻度增加", "A2": "中度增加", "A3": "重度增加"}
+
+
+def _is_yes(value):
+    return str(value).strip().lower() in ("yes", "y", "1", "true", "是", "有")
+
+
+def build_rule_report(patient, assessment, risks):
+    """由规则引擎结果生成与模型报告同结构的 dict"""
+    egfr, uacr = float(patient['egfr']), float(patient['uacr'])
+    g, a = assessment['gfr_category'], assessment['albuminuria_category']
+    age = patient.get('age')
+    htn, dm = _is_yes(patient.get('htn')), _is_yes(patient.get('dm'))
+
+    medications = []
+    if egfr >= 20 and uacr >= 200:
+        medications.append({"drug": "SGLT2 抑制剂", "status": "推荐", "reason": "eGFR ≥ 20 且 ACR ≥ 200 mg/g",
+                            "citation": "KDIGO 2024 Rec 3.7.2"})
+    else:
+        medications.append({"drug": "SGLT2 抑制剂", "status": "暂不需要",
+                            "reason": "未达启动指征 (eGFR ≥ 20 且 ACR ≥ 200 mg/g)；合并心衰时仍应使用",
+                            "citation": "KDIGO 2024 Rec 3.7.2"})
+    if htn and a in ("A2", "A3"):
+        medications.append({"drug": "RAS 阻断剂 (ACEi 或 ARB，二者禁联用)", "status": "推荐",
+                            "reason": f"高血压合并 {a} 白蛋白尿", "citation": "KDIGO 2024 Rec 3.6.1-3.6.3"})
+    else:
+        medications.append({"drug": "RAS 阻断剂 (ACEi / ARB)", "status": "待评估",
+                            "reason": "仅在高血压合并 A2 / A3 白蛋白尿时启用", "citation": "KDIGO 2024 Rec 3.6.1-3.6.3"})
+    if dm and egfr > 25 and a in ("A2", "A3"):
+        medications.append({"drug": "非奈利酮 (ns-MRA)", "status": "待评估",
+                            "reason": "2 型糖尿病合并白蛋白尿，已用最大耐受剂量 RASi 且血钾正常时可加用",
+                            "citation": "KDIGO 2024 Chapter 3 (ns-MRA)"})
+    if age is not None and float(age) >= 50:
+        medications.append({"drug": "他汀类降脂药", "status": "推荐", "reason": "年龄 ≥ 50 岁",
+                            "citation": "KDIGO 2024 Rec 3.1.1"})
+
+    lifestyle = "限钠 < 2 g/天 (食盐 < 5 g/天)；每周至少 150 分钟中等强度运动；可耐受时收缩压目标 < 120 mmHg。"
+    if g in ("G3a", "G3b", "G4", "G5"):
+        lifestyle += "蛋白摄入 0.8 g/kg/天。"
+
+    return {
+        "expert_assessment": {"content": (
+            f"患者 {age} 岁，eGFR {patient['egfr']} ml/min/1.73m²，uACR {patient['uacr']} mg/g，"
+            f"CGA 分期 {g}{a}，KDIGO 热图为{assessment['risk_level']}。"
+            f"KFRE 2 年肾衰风险 {risks['2yr']}%，5 年 {risks['5yr']}% (< 3%)，无转诊指征，属常规管理病例。"
+            f"本报告由本地 KDIGO 规则生成。"
+        )},
+        "diagnosis": {
+            "summary": f"CGA 分期 {g}{a} ({assessment['risk_level']})",
+            "detail": f"GFR {g} ({_G_DESC.get(g, '')})，白蛋白尿 {a} ({_A_DESC.get(a, '')})。"
+                      f"肾脏结构或功能异常持续 > 3 个月方可确诊 CKD。",
+            "citation": "KDIGO 2024 Chapter 1",
+        },
+        "referral": {
+            "advice": f"KFRE 5 年风险 < 3%，建议在初级保健机构 (社区医院) 管理；{assessment['monitoring']}监测 eGFR 和 ACR。",
+            "citation": "KDIGO 2024 Practice Point 2.2.1",
+        },
+        "medications": medications,
+        "lifestyle": {"advice": lifestyle, "citation": "KDIGO 2024 Rec 3.2.1 / 3.4.1"},
+    }
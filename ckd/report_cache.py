@@ -0,0 +1,159 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from ckd.knowledge import BASE_DIR
+
+# ================= 专家报告缓存 (内存 LRU + SQLite 磁盘层) =================
+CACHE_DIR = os.environ.get("CKD_CACHE_DIR", os.path.join(BASE_DIR, ".ckd_cache"))
+REPORT_DB_PATH = os.path.join(CACHE_DIR, "reports.sqlite")
+
+
+def _num(value, ndigits):
+    try:
+        v = round(float(value), ndigits)
+    except (TypeError, ValueError):
+        return None
+    return None if v != v else v
+
+
+def _sub_value(d, key):
+    return _num(d.get(key), 2) if isinstance(d, dict) else None
+
+
+# 仅这些字段进入缓存键；数值先做与界面显示一致的取整，避免 62 与 62.0 算作不同病例
+def normalize_patient(patient):
+    """把患者字典归一成稳定、可哈希的特征 (与来源 / 展示字段无关)"""
+    from ckd.scoring import MALE_TOKENS  # 性别判定与评分共用一份取值表；延迟导入，保持本模块不依赖 numpy
+
+    bp = patient.get("bp") or {}
+    return {
+        "age": _num(patient.get("age"), 0),
+        "sex": "male" if str(patient.get("sex")).lower() in MALE_TOKENS else "female",
+        "egfr": _num(patient.get("egfr"), 1),
+        "uacr": _num(patient.get("uacr"), 2),
+        "sbp": _sub_value(bp, "sbp"),
+        "dbp": _sub_value(bp, "dbp"),
+        "hba1c": _sub_value(patient.get("hba1c"), "value"),
+        "glucose": _sub_value(patient.get("glucose"), "value"),
+        "htn": str(patient.get("htn", "")).lower() or None,
+        "dm": str(patient.get("dm", "")).lower() or None,
+    }
+
+
+def report_cache_key(patient, kb_version, model_name):
+    """内容寻址键：sha256(归一化特征 + 知识库版本 + 模型名)"""
+    payload = {"patient": normalize_patient(patient), "kb": kb_version, "model": model_name}
+    raw = json.dumps(payload, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class ReportCache:
+    """两级缓存：进程内 LRU 命中即返回；未命中再查 SQLite，按 TTL 与容量淘汰"""
+
+    def __init__(self, db_path=REPORT_DB_PATH, memory_items=256, ttl_seconds=7 * 24 * 3600,
+                 max_disk_items=5000, max_disk_bytes=50 * 1024 * 1024):
+        self.db_path = db_path
+        self.memory_items = memory_items
+        self.ttl_seconds = ttl_seconds
+        self.max_disk_items = max_disk_items
+        self.max_disk_bytes = max_disk_bytes
+        self._mem = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0, "writes": 0}
+
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS reports (
+                key TEXT PRIMARY KEY, value TEXT NOT NULL,
+                created REAL NOT NULL, accessed REAL NOT NULL, size INTEGER NOT NULL
+            )""")
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_reports_accessed ON reports(accessed)")
+        self._db.commit()
+
+    # ---------- 内存层 ----------
+    def _mem_get(self, key, now):
+        item = self._mem.get(key)
+        if item is None:
+            return None
+        created, value = item
+        if now - created > self.ttl_seconds:
+            del self._mem[key]
+            return None
+        self._mem.move_to_end(key)
+        return value
+
+    def _mem_put(self, key, value, created):
+        self._mem[key] = (created, value)
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.memory_items:
+            self._mem.popitem(last=False)
+
+    # ---------- 对外接口 ----------
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            value = self._mem_get(key, now)
+            if value is not None:
+                self.stats["memory_hits"] += 1
+                return json.loads(value)
+
+            row = self._db.execute("SELECT value, created FROM reports WHERE key = ?", (key,)).fetchone()
+            if row is None or now - row[1] > self.ttl_seconds:
+                if row is not None:
+                    self._db.execute("DELETE FROM reports WHERE key = ?", (key,))
+                    self._db.commit()
+                    self.stats["evictions"] += 1
+                self.stats["misses"] += 1
+                return None
+
+            self._db.execute("UPDATE reports SET accessed = ? WHERE key = ?", (now, key))
+            self._db.commit()
+            self._mem_put(key, row[0], row[1])
+            self.stats["disk_hits"] += 1
+            return json.loads(row[0])
+
+    def put(self, key, report):
+        now = time.time()
+        value = json.dumps(report, ensure_ascii=False)
+        with self._lock:
+            self._mem_put(key, value, now)
+            self._db.execute(
+                "INSERT OR REPLACE INTO reports (key, value, created, accessed, size) VALUES (?, ?, ?, ?, ?)",
+                (key, value, now, now, len(value.encode("utf-8"))))
+            self._evict(now)
+            self._db.commit()
+            self.stats["writes"] += 1
+
+    def _evict(self, now):
+        cur = self._db.execute("DELETE FROM reports WHERE created < ?", (now - self.ttl_seconds,))
+        evicted = max(cur.rowcount, 0)
+        count, total = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM reports").fetchone()
+        # 按最近访问时间从旧到新淘汰，直到条数与体积都回到上限以内
+        if count > self.max_disk_items or total > self.max_disk_bytes:
+            for key, size in self._db.execute("SELECT key, size FROM reports ORDER BY accessed ASC").fetchall():
+                if count <= self.max_disk_items and total <= self.max_disk_bytes:
+                    break
+                self._db.execute("DELETE FROM reports WHERE key = ?", (key,))
+                self._mem.pop(key, None)
+                count -= 1
+                total -= size
+                evicted += 1
+        self.stats["evictions"] += evicted
+
+    def clear(self):
+        with self._lock:
+            self._mem.clear()
+            self._db.execute("DELETE FROM reports")
+            self._db.commit()
+
+    @property
+    def hit_rate(self):
+        hits = self.stats["memory_hits"] + self.stats["disk_hits"]
+        total = hits + self.stats["misses"]
+        return hits / total if total else 0.0
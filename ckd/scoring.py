@@ -0,0 +1,175 @@
+import math
+
+import numpy as np
+import pandas as pd
+
+# ================= 1. 核心算法区 (KFRE Model 3) =================
+MALE_TOKENS = ['male', '男', 'm', '1']
+
+# KFRE 4 变量模型系数 (Tangri et al. 2011)
+BETA_AGE, MEAN_AGE = -0.2167, 7.0355
+BETA_SEX, MEAN_SEX = 0.2694, 0.56422
+BETA_EGFR, MEAN_EGFR = -0.55418, 7.2216
+BETA_ACR, MEAN_ACR = 0.45608, 5.2774
+S0_5YR = 0.9240
+S0_2YR = 0.9832
+
+
+def calculate_kfre_precise(age, sex, egfr, acr):
+    """同时返回 2年 和 5年 风险 (Tangri et al. 2011)"""
+    try:
+        age = float(age)
+        egfr = float(egfr)
+        acr = float(acr)
+        is_male = 1.0 if str(sex).lower() in MALE_TOKENS else 0.0
+        acr_val = acr if acr > 0 else 1.0
+
+        log_acr = math.log(acr_val)
+        age_scaled = age / 10.0
+        egfr_scaled = egfr / 5.0
+
+        lp = (BETA_AGE * (age_scaled - MEAN_AGE)) + \
+             (BETA_SEX * (is_male - MEAN_SEX)) + \
+             (BETA_EGFR * (egfr_scaled - MEAN_EGFR)) + \
+             (BETA_ACR * (log_acr - MEAN_ACR))
+
+        risk_5yr = 1.0 - math.pow(S0_5YR, math.exp(lp))
+        risk_2yr = 1.0 - math.pow(S0_2YR, math.exp(lp))
+
+        return {"2yr": round(risk_2yr * 100, 2), "5yr": round(risk_5yr * 100, 2)}
+    except Exception as e:
+        return {"error": str(e)}
+
+
+# ================= 2. 辅助计算工具 (CKD-EPI 2021) =================
+def calculate_egfr_ckdepi(scr_umol, age, sex_str):
+    """根据肌酐(umol/L)计算 eGFR"""
+    try:
+        scr_mgdl = float(scr_umol) / 88.4
+        age_val = float(age)
+        is_male = str(sex_str).lower() in MALE_TOKENS
+
+        kappa = 0.9 if is_male else 0.7
+        alpha = -0.302 if is_male else -0.241
+
+        factor1 = min(scr_mgdl / kappa, 1) ** alpha
+        factor2 = max(scr_mgdl / kappa, 1) ** -1.209
+        factor3 = 0.993 ** age_val
+        factor4 = 1.018 if not is_male else 1.0
+
+        egfr = 142 * factor1 * factor2 * factor3 * factor4
+        return round(egfr, 1)
+    except:
+        return None
+
+
+# ================= 3. 批量向量化计算 (整队列评分) =================
+# 与标量函数逐行一致：NumPy 的 exp/pow 与 math 可能相差 1 ulp，
+# 只有落在四舍五入临界点附近时才会影响结果，这些行回退到标量函数重算。
+_TIE_EPS = 1e-6
+
+
+def _as_float(values):
+    """任意列 → float64 数组，无法解析的值记为 NaN（对应标量版的 float() 失败）"""
+    return pd.to_numeric(pd.Series(values), errors="coerce").to_numpy(dtype="float64", copy=True)
+
+
+def _male_mask(sex):
+    """与标量版 str(sex).lower() in MALE_TOKENS 完全一致的逐行判定"""
+    s = pd.Series(sex, dtype="object")
+    return s.map(str).str.lower().isin(MALE_TOKENS).to_numpy()
+
+
+def _round_like_python(values, ndigits, valid, recompute):
+    """向量化 round，并对临界点附近的行调用 recompute(i) 取标量结果"""
+    scale = 10.0 ** ndigits
+    with np.errstate(invalid="ignore"):
+        out = np.round(values, ndigits)
+        scaled = values * scale
+        near_tie = valid & (np.abs(scaled - np.floor(scaled) - 0.5) < _TIE_EPS)
+    for i in np.flatnonzero(near_tie):
+        out[i] = recompute(i)
+    return out
+
+
+def calculate_kfre_batch(age, sex, egfr, acr):
+    """批量 KFRE：返回 {"2yr", "5yr", "valid"} 三个等长数组，无效行风险为 NaN 而不抛异常"""
+    age_v = _as_float(age)
+    egfr_v = _as_float(egfr)
+    acr_v = _as_float(acr)
+    male = _male_mask(sex)
+    n = len(age_v)
+    if not (len(egfr_v) == len(acr_v) == len(male) == n):
+        raise ValueError("age / sex / egfr / acr 列长度不一致")
+
+    valid = np.isfinite(age_v) & np.isfinite(egfr_v) & ~np.isnan(acr_v)
+    acr_safe = np.where(acr_v > 0, acr_v, 1.0)
+
+    with np.errstate(all="ignore"):
+        lp = (BETA_AGE * (age_v / 10.0 - MEAN_AGE)) + \
+             (BETA_SEX * (male.astype("float64") - MEAN_SEX)) + \
+             (BETA_EGFR * (egfr_v / 5.0 - MEAN_EGFR)) + \
+             (BETA_ACR * (np.log(acr_safe) - MEAN_ACR))
+        hazard = np.exp(lp)
+        # 标量版 math.exp 溢出会报错，这里按行屏蔽
+        valid &= np.isfinite(hazard)
+        raw_5yr = (1.0 - np.power(S0_5YR, hazard)) * 100
+        raw_2yr = (1.0 - np.power(S0_2YR, hazard)) * 100
+
+    def _scalar(i, key):
+        return calculate_kfre_precise(age_v[i], "male" if male[i] else "female", egfr_v[i], acr_v[i])[key]
+
+    risk_5yr = _round_like_python(raw_5yr, 2, valid, lambda i: _scalar(i, "5yr"))
+    risk_2yr = _round_like_python(raw_2yr, 2, valid, lambda i: _scalar(i, "2yr"))
+    risk_5yr[~valid] = np.nan
+    risk_2yr[~valid] = np.nan
+    return {"2yr": risk_2yr, "5yr": risk_5yr, "valid": valid}
+
+
+def calculate_egfr_ckdepi_batch(scr_umol, age, sex):
+    """批量 CKD-EPI 2021：肌酐(umol/L) → eGFR 数组，无效行 (肌酐<=0 / 缺失) 为 NaN"""
+    scr_v = _as_float(scr_umol)
+    scr_mgdl = scr_v / 88.4
+    age_v = _as_float(age)
+    male = _male_mask(sex)
+    if not (len(age_v) == len(male) == len(scr_mgdl)):
+        raise ValueError("scr / age / sex 列长度不一致")
+
+    valid = np.isfinite(scr_mgdl) & (scr_mgdl > 0) & np.isfinite(age_v)
+    kappa = np.where(male, 0.9, 0.7)
+    alpha = np.where(male, -0.302, -0.241)
+
+    with np.errstate(all="ignore"):
+        ratio = scr_mgdl / kappa
+        raw = 142 * np.power(np.minimum(ratio, 1), alpha) \
+                  * np.power(np.maximum(ratio, 1), -1.209) \
+                  * np.power(0.993, age_v) \
+                  * np.where(male, 1.0, 1.018)
+    valid &= np.isfinite(raw)
+
+    def _scalar(i):
+        return calculate_egfr_ckdepi(scr_v[i], age_v[i], "male" if male[i] else "female")
+
+    egfr = _round_like_python(raw, 1, valid, _scalar)
+    egfr[~valid] = np.nan
+    return egfr
+
+
+def score_cohort(df, age_col="age", sex_col="sex", egfr_col="egfr", uacr_col="uacr", scr_umol_col=None):
+    """整队列一次性评分：返回与 df 同索引的 egfr / risk_2yr / risk_5yr / valid 四列。
+
+    若给出 scr_umol_col，则 eGFR 缺失的行用 CKD-EPI 2021 由肌酐补算（与 Tab 2 的补算逻辑一致）。
+    """
+    n = len(df)
+    egfr = _as_float(df[egfr_col]) if egfr_col in df else np.full(n, np.nan)
+    if scr_umol_col is not None:
+        calc = calculate_egfr_ckdepi_batch(df[scr_umol_col], df[age_col], df[sex_col])
+        egfr = np.where(np.isnan(egfr), calc, egfr)
+
+    risks = calculate_kfre_batch(df[age_col], df[sex_col], egfr, df[uacr_col])
+    return pd.DataFrame({
+        "egfr": egfr,
+        "risk_2yr": risks["2yr"],
+        "risk_5yr": risks["5yr"],
+        "valid": risks["valid"],
+    }, index=df.index)
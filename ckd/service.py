@@ -0,0 +1,290 @@
+"""无界面批量评分服务：EHR 对接用，不经过 Streamlit 页面。
+
+    python -m ckd.service serve --port 8780 --workers 4
+    curl -X POST http://127.0.0.1:8780/v1/score -H "Content-Type: application/json" \
+         -d '[{"id": "p1", "age": 63, "sex": "male", "egfr": 38, "uacr": 45, "uacr_unit": "mg/mmol"}]'
+    python -m ckd.service score patients.ndjson -o scored.ndjson      # 离线文件批量评分
+
+也可以交给任意 WSGI 服务器托管多进程，例如 `gunicorn -w 4 ckd.service:app`。
+
+每个病例的字段：
+    id (原样返回)、age、sex、egfr (可缺省)、scr_umol (eGFR 缺省时按 CKD-EPI 2021 补算)、
+    uacr + uacr_unit (默认 mg/g，换算规则与页面的 standardize_uacr 相同)
+返回：
+    id、egfr、egfr_source (stated / ckd_epi)、uacr_mg_g、risk_2yr、risk_5yr (%)、
+    gfr_category、albuminuria_category、stage (如 "G3a A2")、error
+"""
+import argparse
+import json
+import os
+import signal
+import sys
+import time
+from socketserver import ThreadingMixIn
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+import numpy as np
+import pandas as pd
+
+from ckd.metrics import get_registry
+from ckd.scoring import calculate_egfr_ckdepi_batch, calculate_kfre_batch
+from ckd.staging import albuminuria_category_batch, gfr_category_batch
+from ckd.units import standardize_uacr_batch
+
+MAX_BODY_BYTES = int(os.environ.get("CKD_SERVICE_MAX_BODY_MB", 64)) * 1024 * 1024
+CLI_BATCH_ROWS = 50_000
+
+
+# ================= 批量评分 (整批向量化) =================
+def score_frame(df):
+    """病例 DataFrame → 结果 DataFrame (同索引)；缺失列按空值处理，无效行给出 error 而不抛异常"""
+    n = len(df)
+    col = lambda name: df[name] if name in df else pd.Series([None] * n, index=df.index, dtype="object")
+
+    uacr = standardize_uacr_batch(col("uacr"), col("uacr_unit"))
+    egfr = pd.to_numeric(col("egfr"), errors="coerce").to_numpy(dtype="float64")
+    stated = ~np.isnan(egfr)
+    calc = calculate_egfr_ckdepi_batch(col("scr_umol"), col("age"), col("sex"))
+    egfr = np.where(stated, egfr, calc)
+    egfr_source = np.where(stated, "stated", np.where(np.isnan(calc), None, "ckd_epi")).astype(object)
+
+    risks = calculate_kfre_batch(col("age"), col("sex"), egfr, uacr)
+    g_cat = gfr_category_batch(egfr)
+    a_cat = albuminuria_category_batch(uacr)
+    stage = np.where(pd.isna(g_cat) | pd.isna(a_cat), None, g_cat.astype(str) + " " + a_cat.astype(str))
+
+    out = pd.DataFrame({
+        "id": col("id").to_numpy(dtype=object),
+        "egfr": egfr,
+        "egfr_source": egfr_source,
+        "uacr_mg_g": uacr,
+        "risk_2yr": risks["2yr"],
+        "risk_5yr": risks["5yr"],
+        "gfr_category": g_cat,
+        "albuminuria_category": a_cat,
+        "stage": stage.astype(object),
+        "error": np.where(risks["valid"], None, "age / egfr (或 scr_umol) / uacr 缺失或无法解析").astype(object),
+    }, index=df.index)
+    return out
+
+
+def score_records(records):
+    """病例 dict 列表 → 结果 dict 列表 (NaN 转为 None，可直接 JSON 序列化)"""
+    if not records:
+        return []
+    t0 = time.perf_counter()
+    out = score_frame(pd.DataFrame.from_records(records))
+    # 部分记录缺 id 时 DataFrame 会把整列转成 float，这里直接取原值保证原样返回
+    out["id"] = [r.get("id") for r in records]
+    rows = _to_records(out)
+    get_registry().record("service_score", time.perf_counter() - t0, rows=len(rows),
+                          invalid=int(sum(r["error"] is not None for r in rows)))
+    return rows
+
+
+def _to_records(df):
+    """比 DataFrame.to_dict("records") 快数倍：逐列转成 Python 列表 (NaN → None) 后再按行拼装"""
+    columns = []
+    for name in df.columns:
+        columns.append([None if v != v else v for v in df[name].tolist()])
+    names = list(df.columns)
+    return [dict(zip(names, row)) for row in zip(*columns)]
+
+
+def _parse_ndjson(text):
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+
+def _dump_ndjson(rows):
+    return "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in rows)
+
+
+# ================= HTTP (WSGI) =================
+def _respond(start_response, status, body, content_type="application/json; charset=utf-8"):
+    data = body.encode("utf-8")
+    start_response(status, [("Content-Type", content_type), ("Content-Length", str(len(data)))])
+    return [data]
+
+
+def _error(start_response, status, message):
+    return _respond(start_response, status, json.dumps({"error": message}, ensure_ascii=False))
+
+
+def app(environ, start_response):
+    """POST /v1/score (JSON 数组 / {"patients": [...]} / NDJSON)，GET /healthz，GET /metrics"""
+    method = environ.get("REQUEST_METHOD", "GET")
+    path = environ.get("PATH_INFO", "")
+
+    if method == "GET" and path == "/healthz":
+        return _respond(start_response, "200 OK", json.dumps({"status": "ok", "pid": os.getpid()}))
+    if method == "GET" and path == "/metrics":
+        return _respond(start_response, "200 OK", get_registry().render_prometheus(),
+                        "text/plain; version=0.0.4; charset=utf-8")
+    if path != "/v1/score":
+        return _error(start_response, "404 Not Found", f"unknown path {path}")
+    if method != "POST":
+        return _error(start_response, "405 Method Not Allowed", "use POST")
+
+    try:
+        length = int(environ.get("CONTENT_LENGTH") or 0)
+    except ValueError:
+        length = 0
+    if length > MAX_BODY_BYTES:
+        return _error(start_response, "413 Payload Too Large", f"body exceeds {MAX_BODY_BYTES} bytes")
+    body = environ["wsgi.input"].read(length).decode("utf-8") if length else ""
+    ndjson = "ndjson" in environ.get("CONTENT_TYPE", "") or "jsonl" in environ.get("CONTENT_TYPE", "")
+
+    try:
+        if ndjson:
+            records, wrapped = _parse_ndjson(body), False
+        else:
+            payload = json.loads(body or "[]")
+            wrapped = isinstance(payload, dict)
+            records = payload.get("patients", []) if wrapped else payload
+        if not isinstance(records, list) or not all(isinstance(r, dict) for r in records):
+            raise ValueError("expected an array of patient objects")
+    except ValueError as e:
+        return _error(start_response, "400 Bad Request", f"invalid input: {e}")
+
+    rows = score_records(records)
+    if ndjson:
+        return _respond(start_response, "200 OK", _dump_ndjson(rows), "application/x-ndjson; charset=utf-8")
+    result = {"results": rows} if wrapped else rows
+    return _respond(start_response, "200 OK", json.dumps(result, ensure_ascii=False))
+
+
+class _ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+class _QuietHandler(WSGIRequestHandler):
+    def log_message(self, fmt, *args):
+        pass
+
+
+def _raise_interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+
+def serve(host="127.0.0.1", port=8780, workers=1):
+    """多进程 (pre-fork) 模型：主进程绑定端口后 fork 出 workers 个子进程共享同一监听 socket。
+
+    每个子进程内部再用线程处理并发连接；评分本身是整批 NumPy 计算。
+    不支持 fork 的平台 (Windows) 退化为单进程。
+    """
+    server = make_server(host, port, app, server_class=_ThreadingWSGIServer, handler_class=_QuietHandler)
+    if workers > 1 and not hasattr(os, "fork"):
+        print("当前平台不支持 fork，以单进程运行 (可改用 WSGI 服务器托管多进程)")
+        workers = 1
+    print(f"CKD 评分服务已启动: http://{host}:{server.server_address[1]} (workers={workers})")
+
+    if workers <= 1:
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+        return
+
+    children = []
+    for _ in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            try:
+                server.serve_forever()
+            finally:
+                os._exit(0)
+        children.append(pid)
+    # 主进程收到 SIGTERM 时同样回收子进程
+    signal.signal(signal.SIGTERM, _raise_interrupt)
+    try:
+        for pid in children:
+            os.waitpid(pid, 0)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+        server.server_close()
+
+
+# ================= 离线 CLI =================
+def _iter_batches(path, batch_rows):
+    """JSON 数组一次读入；NDJSON 按 batch_rows 行一批流式读取，内存占用与文件大小无关"""
+    f = sys.stdin if path == "-" else open(path, "r", encoding="utf-8")
+    try:
+        if path.endswith(".json"):
+            payload = json.load(f)
+            records = payload.get("patients", []) if isinstance(payload, dict) else payload
+            for i in range(0, len(records), batch_rows):
+                yield records[i:i + batch_rows]
+            return
+        batch = []
+        for line in f:
+            if line.strip():
+                batch.append(json.loads(line))
+            if len(batch) >= batch_rows:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+def score_file(src, dst="-", batch_rows=CLI_BATCH_ROWS):
+    """src 为 .json (数组) 或 NDJSON；dst 以 .json 结尾时写 JSON 数组，否则写 NDJSON"""
+    out = sys.stdout if dst == "-" else open(dst, "w", encoding="utf-8")
+    as_array = dst.endswith(".json")
+    total = 0
+    try:
+        if as_array: out.write("[")
+        for batch in _iter_batches(src, batch_rows):
+            rows = score_records(batch)
+            if as_array:
+                for r in rows:
+                    out.write(("," if total else "") + "\n" + json.dumps(r, ensure_ascii=False))
+                    total += 1
+            else:
+                out.write(_dump_ndjson(rows))
+                total += len(rows)
+        if as_array: out.write("]\n")
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    return total
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="CKD 批量评分服务 (KFRE / eGFR / CGA 分期)")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_serve = sub.add_parser("serve", help="启动 HTTP 服务")
+    p_serve.add_argument("--host", default="127.0.0.1")
+    p_serve.add_argument("--port", type=int, default=8780)
+    p_serve.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="工作进程数")
+
+    p_score = sub.add_parser("score", help="离线评分文件 (JSON 数组或 NDJSON，- 表示标准输入)")
+    p_score.add_argument("input")
+    p_score.add_argument("-o", "--output", default="-", help="输出路径，.json 结尾写数组，否则写 NDJSON")
+    p_score.add_argument("--batch-rows", type=int, default=CLI_BATCH_ROWS)
+    args = parser.parse_args(argv)
+
+    if args.command == "serve":
+        serve(args.host, args.port, args.workers)
+    else:
+        t0 = time.perf_counter()
+        n = score_file(args.input, args.output, args.batch_rows)
+        print(f"已评分 {n} 例，用时 {time.perf_counter() - t0:.2f}s", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+# ================= KDIGO CGA 分期 (GFR × 白蛋白尿) =================
+# 阈值与 kdigo_guidelines_2024.txt 第 1 章保持一致
+
+
+def gfr_category(egfr):
+    """eGFR (ml/min/1.73m²) → G1 / G2 / G3a / G3b / G4 / G5，无法解析时返回 None"""
+    try:
+        v = float(egfr)
+    except (TypeError, ValueError):
+        return None
+    if v != v:
+        return None
+    if v >= 90: return "G1"
+    if v >= 60: return "G2"
+    if v >= 45: return "G3a"
+    if v >= 30: return "G3b"
+    if v >= 15: return "G4"
+    return "G5"
+
+
+def albuminuria_category(uacr):
+    """uACR (mg/g) → A1 / A2 / A3，无法解析时返回 None"""
+    try:
+        v = float(uacr)
+    except (TypeError, ValueError):
+        return None
+    if v != v:
+        return None
+    if v < 30: return "A1"
+    if v <= 300: return "A2"
+    return "A3"
+
+
+# ================= 本地 KDIGO 规则引擎 (热图 / 转诊 / 监测频率) =================
+# 规则逐条对应 kdigo_guidelines_2024.txt 第 1、2 章；常规低风险病例据此直接出模板报告，不调用模型。
+HEATMAP_LEVELS = {"green": "低风险", "yellow": "中风险", "orange": "高风险", "red": "极高风险"}
+_HEATMAP = {
+    "G1": {"A1": "green", "A2": "yellow", "A3": "orange"},
+    "G2": {"A1": "green", "A2": "yellow", "A3": "orange"},
+    "G3a": {"A1": "yellow", "A2": "orange", "A3": "red"},
+    "G3b": {"A1": "orange", "A2": "red", "A3": "red"},
+    "G4": {"A1": "red", "A2": "red", "A3": "red"},
+    "G5": {"A1": "red", "A2": "red", "A3": "red"},
+}
+KFRE_PRIMARY_CARE_5YR = 3.0    # 5 年风险 < 3%：初级保健管理
+KFRE_VERY_HIGH_5YR = 5.0       # 5 年风险 > 5%：极高风险
+KFRE_MDT_2YR = 10.0            # 2 年风险 > 10%：多学科团队护理
+KFRE_KRT_PREP_2YR = 40.0       # 2 年风险 > 40%：肾脏替代治疗准备
+UACR_NEPHROTIC = 2000          # uACR > 2000 mg/g：紧急转诊
+EGFR_DECLINE_PER_YEAR = 5      # eGFR 每年下降 > 5：快速进展
+ROUTINE_COLORS = ("green", "yellow")
+
+
+def heatmap_color(g_cat, a_cat):
+    """KDIGO CGA 热图颜色 (green / yellow / orange / red)，分期缺失时返回 None"""
+    return _HEATMAP.get(g_cat, {}).get(a_cat)
+
+
+def monitoring_frequency(egfr, uacr, risk_5yr=None):
+    """每年监测 eGFR / ACR 的次数 (第 2 章监测频率)"""
+    r5 = risk_5yr if risk_5yr is not None else 0
+    if r5 > KFRE_VERY_HIGH_5YR or uacr > 700 or egfr < 30: return "每年至少 3-4 次"
+    if r5 >= KFRE_PRIMARY_CARE_5YR or uacr > 300 or egfr < 45: return "每年至少 2 次"
+    return "每年至少 1 次"
+
+
+def referral_reasons(egfr, uacr, risks, egfr_slope=None):
+    """转诊 / 强化管理指征列表；egfr_slope 为 eGFR 年变化 (ml/min/1.73m²/年，负数为下降)"""
+    reasons = []
+    r5, r2 = risks.get("5yr"), risks.get("2yr")
+    if uacr > UACR_NEPHROTIC:
+        reasons.append(f"uACR > {UACR_NEPHROTIC} mg/g，须按肾病综合征级别紧急转诊")
+    elif uacr >= 300:
+        reasons.append("uACR ≥ 300 mg/g (A3)，强制转诊专科")
+    if egfr < 30:
+        reasons.append("eGFR < 30 (G4-G5)")
+    if egfr_slope is not None and egfr_slope < -EGFR_DECLINE_PER_YEAR:
+        reasons.append(f"eGFR 快速下降 (每年 {egfr_slope:.1f} ml/min/1.73m²)")
+    if r5 is not None and r5 >= KFRE_PRIMARY_CARE_5YR:
+        reasons.append(f"KFRE 5 年风险 {r5}% ≥ {KFRE_PRIMARY_CARE_5YR:g}%，建议转诊肾内科")
+    if r2 is not None and r2 > KFRE_KRT_PREP_2YR:
+        reasons.append(f"KFRE 2 年风险 {r2}% > {KFRE_KRT_PREP_2YR:g}%，须进行肾脏替代治疗教育与通路准备")
+    elif r2 is not None and r2 > KFRE_MDT_2YR:
+        reasons.append(f"KFRE 2 年风险 {r2}% > {KFRE_MDT_2YR:g}%，建议多学科团队 (MDT) 护理")
+    return reasons
+
+
+def assess(egfr, uacr, risks, egfr_slope=None):
+    """eGFR + uACR + calculate_kfre_precise 结果 → 分期、热图颜色、转诊指征与是否属于常规病例。
+
+    routine=True 表示可直接使用模板报告：热图为绿 / 黄、KFRE 5 年风险 < 3%，且没有任何转诊指征。
+    """
+    g_cat, a_cat = gfr_category(egfr), albuminuria_category(uacr)
+    color = heatmap_color(g_cat, a_cat)
+    if color is None or "error" in risks:
+        return {"gfr_category": g_cat, "albuminuria_category": a_cat, "heatmap": None, "risk_level": None,
+                "monitoring": None, "referral": [], "routine": False, "complex_reasons": ["分期所需数据缺失"]}
+
+    egfr, uacr = float(egfr), float(uacr)
+    referral = referral_reasons(egfr, uacr, risks, egfr_slope)
+    complex_reasons = list(referral)
+    if color not in ROUTINE_COLORS:
+        complex_reasons.append(f"KDIGO 热图为{HEATMAP_LEVELS[color]} ({g_cat}{a_cat})")
+    return {
+        "gfr_category": g_cat,
+        "albuminuria_category": a_cat,
+        "heatmap": color,
+        "risk_level": HEATMAP_LEVELS[color],
+        "monitoring": monitoring_frequency(egfr, uacr, risks.get("5yr")),
+        "referral": referral,
+        "routine": not complex_reasons,
+        "complex_reasons": complex_reasons,
+    }
+
+
+# ================= 批量版本 (整队列 / 评分服务) =================
+# numpy 在函数内导入：knowledge 等轻量模块会导入本文件，不应因此牵出 numpy
+GFR_THRESHOLDS = [(90, "G1"), (60, "G2"), (45, "G3a"), (30, "G3b"), (15, "G4")]
+
+
+def gfr_category_batch(egfr):
+    """eGFR 数组 → 分期数组 (object)，NaN 行为 None；与 gfr_category 逐行一致"""
+    import numpy as np
+    v = np.asarray(egfr, dtype="float64")
+    conds = [v >= t for t, _ in GFR_THRESHOLDS] + [v < 15]
+    return np.select(conds, [c for _, c in GFR_THRESHOLDS] + ["G5"], default=None).astype(object)
+
+
+def albuminuria_category_batch(uacr):
+    """uACR 数组 (mg/g) → A1 / A2 / A3 数组 (object)，NaN 行为 None"""
+    import numpy as np
+    v = np.asarray(uacr, dtype="float64")
+    return np.select([v < 30, v <= 300, v > 300], ["A1", "A2", "A3"], default=None).astype(object)
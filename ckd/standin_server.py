@@ -0,0 +1,143 @@
+"""本地 LLM 替身服务：返回固定的提取 / 报告 JSON，用于离线压测与基准测试。
+
+启动:
+    python -m ckd.standin_server --port 8765 --report-latency 2.0 --extract-latency 0.8
+
+然后以替身后端运行页面:
+    CKD_LLM_BACKEND=http CKD_LLM_BASE_URL=http://127.0.0.1:8765 streamlit run app9.py
+
+协议 (HTTPBackend 使用):
+    POST /v1/generate  {"contents": [...], "json": bool, "stream": bool}
+    → 非流式: {"text": "...", "usage": {...}}
+    → 流式:   NDJSON，每行 {"text": "片段"}，最后一行 {"usage": {...}}
+"""
+import argparse
+import json
+import random
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CANNED_EXTRACTION = {
+    "age": 62, "sex": "男", "egfr_stated": None,
+    "blood_pressure": {"sbp": 138, "dbp": 86},
+    "hba1c": {"value": 7.1, "unit": "%"},
+    "glucose": {"value": 7.8, "unit": "mmol/L"},
+    "creatinine_raw": {"value": 156, "unit": "umol/L"},
+    "uacr_raw": {"value": 45, "unit": "mg/mmol"},
+    "u_albumin_raw": None,
+    "u_creatinine_raw": None,
+    "report_summary": "替身服务返回的固定提取结果。",
+}
+
+CANNED_REPORT = {
+    "expert_assessment": {"content": "患者 eGFR 与白蛋白尿提示 CKD 进展风险升高，建议强化肾脏保护治疗并定期随访。"},
+    "diagnosis": {"summary": "CKD G3b A3", "detail": "eGFR 30-44，uACR > 300 mg/g。", "citation": "KDIGO 2024 Chapter 1"},
+    "referral": {"advice": "建议转诊肾内科专科。", "citation": "KDIGO 2024 Practice Point 2.2"},
+    "medications": [
+        {"drug": "SGLT2i", "status": "推荐", "reason": "eGFR ≥ 20 且 ACR ≥ 200 mg/g。", "citation": "KDIGO 2024 Rec 3.7.2"},
+        {"drug": "ACEi/ARB", "status": "推荐", "reason": "A3 期白蛋白尿。", "citation": "KDIGO 2024 Rec 3.6.1"},
+    ],
+    "lifestyle": {"advice": "限钠 < 2 g/天，蛋白摄入 0.8 g/kg/天，每周 150 分钟中等强度运动。", "citation": "KDIGO 2024 Rec 3.2.1"},
+}
+
+# 提取提示词里的固定措辞，用来区分两类请求
+EXTRACTION_MARKER = "医疗数据录入员"
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    settings = {"report_latency": 2.0, "extract_latency": 0.8, "jitter": 0.2,
+                "chunk_chars": 24, "chunk_delay": 0.03, "error_rate": 0.0}
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def _send_json(self, code, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/healthz":
+            self._send_json(200, {"ok": True})
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        if self.path != "/v1/generate":
+            self._send_json(404, {"error": "not found"})
+            return
+        length = int(self.headers.get("Content-Length", 0))
+        req = json.loads(self.rfile.read(length) or b"{}")
+        s = self.settings
+
+        if s["error_rate"] and random.random() < s["error_rate"]:
+            self._send_json(503, {"error": "injected failure"})
+            return
+
+        prompt = " ".join(p for p in req.get("contents", []) if isinstance(p, str))
+        is_extraction = EXTRACTION_MARKER in prompt
+        payload = CANNED_EXTRACTION if is_extraction else CANNED_REPORT
+        text = json.dumps(payload, ensure_ascii=False)
+        latency = s["extract_latency"] if is_extraction else s["report_latency"]
+        latency = max(0.0, latency + random.uniform(-s["jitter"], s["jitter"]) * latency)
+        usage = {"prompt_tokens": len(prompt) // 2, "output_tokens": len(text) // 2}
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["output_tokens"]
+
+        if not req.get("stream"):
+            time.sleep(latency)
+            self._send_json(200, {"text": text, "usage": usage})
+            return
+
+        # 流式：首包前等待总延迟的一小部分，其余时间均摊到各片段
+        chunks = [text[i:i + s["chunk_chars"]] for i in range(0, len(text), s["chunk_chars"])]
+        time.sleep(latency * 0.2)
+        delay = max(s["chunk_delay"], latency * 0.8 / max(len(chunks), 1))
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson; charset=utf-8")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        events = [{"text": piece} for piece in chunks] + [{"usage": usage}]
+        for event in events:
+            line = (json.dumps(event, ensure_ascii=False) + "\n").encode("utf-8")
+            self.wfile.write(f"{len(line):X}\r\n".encode("ascii") + line + b"\r\n")
+            self.wfile.flush()
+            if "text" in event:
+                time.sleep(delay)
+        self.wfile.write(b"0\r\n\r\n")
+
+
+def make_server(host="127.0.0.1", port=8765, **settings):
+    handler = type("ConfiguredStandinHandler", (StandinHandler,),
+                   {"settings": {**StandinHandler.settings, **settings}})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="CKD Agent 本地 LLM 替身服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--report-latency", type=float, default=2.0, help="报告请求延迟 (秒)")
+    parser.add_argument("--extract-latency", type=float, default=0.8, help="提取请求延迟 (秒)")
+    parser.add_argument("--jitter", type=float, default=0.2, help="延迟随机抖动比例")
+    parser.add_argument("--chunk-chars", type=int, default=24, help="流式片段长度")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="随机返回 503 的比例，用于验证重试")
+    args = parser.parse_args(argv)
+
+    server = make_server(args.host, args.port, report_latency=args.report_latency,
+                         extract_latency=args.extract_latency, jitter=args.jitter,
+                         chunk_chars=args.chunk_chars, error_rate=args.error_rate)
+    print(f"LLM 替身服务已启动: http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
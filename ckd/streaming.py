@@ -0,0 +1,98 @@
+import json
+
+# ================= 增量 JSON 解析 (流式报告渲染) =================
+# 模型按 token 流式返回 JSON 文本；每当顶层对象的某个字段完整闭合，
+# 就立即产出 (key, value)，顶层数组字段 (如 medications) 的每个元素也逐个产出
+# ((key, index), value)。这样报告卡片可以一张一张地先后出现。
+
+
+class IncrementalJSONObjectParser:
+    def __init__(self):
+        self.text = ""
+        self.result = {}
+        self.done = False
+        self._i = 0
+        self._stack = []
+        self._in_str = False
+        self._esc = False
+        self._expect_key = False
+        self._key_start = None
+        self._key = None
+        self._value_start = None
+        self._item_start = None
+        self._item_idx = 0
+
+    def feed(self, chunk):
+        """追加一段文本，返回本次新闭合的字段事件列表"""
+        self.text += chunk or ""
+        t = self.text
+        events = []
+        while self._i < len(t) and not self.done:
+            i = self._i
+            ch = t[i]
+            self._i += 1
+
+            if self._in_str:
+                if self._esc:
+                    self._esc = False
+                elif ch == "\\":
+                    self._esc = True
+                elif ch == '"':
+                    self._in_str = False
+                    if self._key_start is not None:
+                        self._key = json.loads(t[self._key_start:i + 1])
+                        self._key_start = None
+                continue
+
+            depth = len(self._stack)
+            if depth == 0:
+                # 跳过 ```json 之类的前缀，直到顶层对象开始
+                if ch == "{":
+                    self._stack.append(ch)
+                    self._expect_key = True
+                continue
+
+            if ch == '"':
+                self._in_str = True
+                if depth == 1 and self._expect_key:
+                    self._key_start = i
+                    self._expect_key = False
+            elif ch in "{[":
+                self._stack.append(ch)
+                if depth == 1 and ch == "[":
+                    self._item_start = i + 1
+                    self._item_idx = 0
+            elif ch == ":" and depth == 1:
+                self._value_start = i + 1
+            elif ch == ",":
+                if depth == 1:
+                    self._emit_value(events, i)
+                    self._expect_key = True
+                elif depth == 2 and self._stack[1] == "[":
+                    self._emit_item(events, i)
+                    self._item_start = i + 1
+            elif ch in "}]":
+                if depth == 2 and ch == "]" and self._stack[1] == "[":
+                    self._emit_item(events, i)
+                self._stack.pop()
+                if depth == 1:
+                    self._emit_value(events, i)
+                    self.done = True
+        return events
+
+    def _emit_value(self, events, end):
+        if self._key is None or self._value_start is None:
+            return
+        raw = self.text[self._value_start:end].strip()
+        if raw:
+            value = json.loads(raw)
+            self.result[self._key] = value
+            events.append((self._key, value))
+        self._key = None
+        self._value_start = None
+
+    def _emit_item(self, events, end):
+        raw = self.text[self._item_start:end].strip()
+        if raw:
+            events.append(((self._key, self._item_idx), json.loads(raw)))
+            self._item_idx += 1
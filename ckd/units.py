@@ -0,0 +1,144 @@
+import numpy as np
+import pandas as pd
+
+from ckd.scoring import _as_float, _round_like_python
+
+# ================= 单位标准化 (uACR 统一到 mg/g) =================
+UACR_MG_G_UNITS = ["mg/g", "ug/mg", "μg/mg"]
+UACR_MG_MMOL_MARKERS = ["mg/mmol", "g/mol", "mg/mm"]
+UMOL_MARKERS = ["umol", "μmol", "um/l", "μm/l"]
+MG_MMOL_TO_MG_G = 8.84
+
+
+def standardize_uacr(value, unit):
+    if value is None: return None
+    try:
+        val = float(value)
+        u = str(unit).lower().strip()
+        if u in UACR_MG_G_UNITS: return val
+        elif any(x in u for x in UACR_MG_MMOL_MARKERS): return round(val * MG_MMOL_TO_MG_G, 2)
+        elif "g/g" in u: return val * 1000
+        else: return val
+    except: return None
+
+
+def recompute_uacr(u_alb, u_cre):
+    """尿微量白蛋白 (mg/L) + 尿肌酐 (mmol/L 或 umol/L) → uACR (mg/g)；条件不足或出错返回 None"""
+    # 只有当两个字典都不为空，且都有 "value" 时才计算
+    if not (isinstance(u_alb, dict) and isinstance(u_cre, dict) and u_alb.get("value") and u_cre.get("value")):
+        return None
+    try:
+        alb_val = float(u_alb["value"])
+        cre_val = float(u_cre["value"])
+        # 预处理单位字符串：去除空格、转小写、处理特殊字符
+        cre_unit = str(u_cre.get("unit", "")).lower().replace(" ", "")
+
+        # 识别 umol/L 并强制转换为 mmol/L
+        if any(x in cre_unit for x in UMOL_MARKERS):
+            cre_val = cre_val / 1000.0
+
+        # 计算比值 (mg/mmol) 并转换为标准单位 mg/g
+        if cre_val > 0:  # 防止除以0
+            return round(alb_val / cre_val * MG_MMOL_TO_MG_G, 2)
+    except (TypeError, ValueError):  # 数值无法解析时与其他换算函数一样静默返回 None
+        pass
+    return None
+
+
+# ================= 血肌酐单位 (统一到 umol/L，即 CKD-EPI 的输入单位) =================
+CREATININE_MG_DL_TO_UMOL_L = 88.4
+CREATININE_MG_DL_MARKERS = ["mg/dl", "mg%"]
+CREATININE_MMOL_MARKERS = ["mmol/l"]
+# 未注明单位时按数值判断：umol/L 的生理范围约 40–1500，低于 20 只可能是 mg/dL
+CREATININE_UNITLESS_MG_DL_MAX = 20
+
+
+def _creatinine_unit_kind(unit):
+    """0 = umol/L，1 = mg/dL，2 = mmol/L，3 = 未注明，-1 = 无法识别"""
+    u = str(unit).lower().replace(" ", "")
+    if u in ("", "none", "nan"): return 3
+    if any(x in u for x in UMOL_MARKERS): return 0
+    if any(x in u for x in CREATININE_MG_DL_MARKERS): return 1
+    if any(x in u for x in CREATININE_MMOL_MARKERS): return 2
+    return -1
+
+
+def standardize_creatinine(value, unit):
+    """血肌酐 → umol/L；数值无法解析或单位无法识别时返回 None"""
+    try:
+        val = float(value)
+    except (TypeError, ValueError):
+        return None
+    kind = _creatinine_unit_kind(unit)
+    if kind == 3:
+        kind = 1 if val < CREATININE_UNITLESS_MG_DL_MAX else 0
+    if kind == 1: return val * CREATININE_MG_DL_TO_UMOL_L
+    if kind == 2: return val * 1000
+    if kind == 0: return val
+    return None
+
+
+# ================= 批量版本 (与标量函数逐行一致) =================
+def _unit_codes(units, classify):
+    """单位列通常只有少数几种取值：对去重后的取值调用标量规则，再映射回整列"""
+    codes, uniques = pd.factorize(pd.Series(units, dtype="object").map(str), use_na_sentinel=False)
+    return np.array([classify(u) for u in uniques], dtype="int8")[codes]
+
+
+def _uacr_unit_kind(unit):
+    u = unit.lower().strip()
+    if u in UACR_MG_G_UNITS: return 0
+    if any(x in u for x in UACR_MG_MMOL_MARKERS): return 1
+    if "g/g" in u: return 2
+    return 0
+
+
+def standardize_uacr_batch(values, units):
+    """批量 uACR → mg/g；无法解析的值为 NaN"""
+    val = _as_float(values)
+    kind = _unit_codes(units, _uacr_unit_kind)
+    if len(kind) != len(val):
+        raise ValueError("values / units 列长度不一致")
+    out = val.copy()
+    mmol = kind == 1
+    with np.errstate(invalid="ignore", over="ignore"):
+        scaled = val * MG_MMOL_TO_MG_G
+        out[mmol] = _round_like_python(
+            scaled, 2, mmol & np.isfinite(scaled),
+            lambda i: standardize_uacr(val[i], "mg/mmol"))[mmol]
+        out[kind == 2] = val[kind == 2] * 1000
+    return out
+
+
+def recompute_uacr_batch(alb_values, cre_values, cre_units):
+    """批量原始值重算 uACR (mg/g)；不满足重算条件的行为 NaN"""
+    alb = _as_float(alb_values)
+    cre = _as_float(cre_values)
+    umol = _unit_codes(cre_units, lambda u: any(x in u.lower().replace(" ", "") for x in UMOL_MARKERS)).astype(bool)
+    if not (len(alb) == len(cre) == len(umol)):
+        raise ValueError("alb / cre / unit 列长度不一致")
+    cre_mmol = np.where(umol, cre / 1000.0, cre)
+    with np.errstate(all="ignore"):
+        raw = alb / cre_mmol * MG_MMOL_TO_MG_G
+    valid = np.isfinite(alb) & (alb != 0) & np.isfinite(cre_mmol) & (cre_mmol > 0) & np.isfinite(raw)
+
+    def _scalar(i):
+        return recompute_uacr({"value": alb[i]}, {"value": cre[i], "unit": "umol/L" if umol[i] else "mmol/L"})
+
+    out = _round_like_python(raw, 2, valid, _scalar)
+    out[~valid] = np.nan
+    return out
+
+
+def standardize_creatinine_batch(values, units):
+    """批量血肌酐 → umol/L；数值无法解析或单位无法识别的行为 NaN"""
+    val = _as_float(values)
+    kind = _unit_codes(units, _creatinine_unit_kind)
+    if len(kind) != len(val):
+        raise ValueError("values / units 列长度不一致")
+    kind = np.where(kind == 3, np.where(val < CREATININE_UNITLESS_MG_DL_MAX, 1, 0), kind)
+    out = np.full(len(val), np.nan)
+    out[kind == 0] = val[kind == 0]
+    out[kind == 1] = val[kind == 1] * CREATININE_MG_DL_TO_UMOL_L
+    out[kind == 2] = val[kind == 2] * 1000
+    return out
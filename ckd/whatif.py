@@ -0,0 +1,172 @@
+"""What-if 敏感性分析：eGFR × uACR 网格上的 KFRE 风险曲面。
+
+同一 (年龄档, 性别) 的整张网格一次向量化算完并缓存在进程内，拖动滑块只查缓存、算两个标量点，
+不会重新走提取 / 报告链路。KFRE 线性预测值对 eGFR 和 ln(uACR) 都是线性的，
+所以等风险线是 eGFR–ln(uACR) 平面上的直线，可以直接解析求出，不需要等值线插值。
+"""
+import functools
+import math
+
+# 网格范围：eGFR 每 0.5 一格，uACR 对数等距 (mg/g)
+EGFR_MIN, EGFR_MAX, EGFR_STEP = 5.0, 120.0, 0.5
+UACR_MIN, UACR_MAX, UACR_POINTS = 1.0, 5000.0, 241
+AGE_BAND_YEARS = 1          # 年龄档宽度 (岁)；曲面按档内代表年龄 (档宽为 1 时即整岁) 计算，患者本人的两个点用精确年龄另算
+CHART_CELLS = 48            # 曲面图每个方向最多显示的格子数 (计算仍用完整网格)
+CONTOUR_LEVELS = {"5yr": (3, 5, 10, 20, 40), "2yr": (1, 3, 10, 20, 40)}
+HORIZONS = {"5yr": "5 年风险", "2yr": "2 年风险"}
+
+
+def age_band(age, band_years=AGE_BAND_YEARS):
+    """年龄 → 年龄档编号"""
+    return int(math.floor(float(age) / band_years))
+
+
+def band_age(band, band_years=AGE_BAND_YEARS):
+    """年龄档 → 该档代表年龄 (档宽为 1 时即整岁)"""
+    return band * band_years + (band_years - 1) / 2
+
+
+def is_male(sex):
+    from ckd.scoring import MALE_TOKENS
+    return str(sex).lower() in MALE_TOKENS
+
+
+def _base_lp(age, male):
+    from ckd.scoring import BETA_AGE, BETA_SEX, MEAN_AGE, MEAN_SEX
+    return BETA_AGE * (age / 10.0 - MEAN_AGE) + BETA_SEX * (float(male) - MEAN_SEX)
+
+
+@functools.lru_cache(maxsize=64)
+def risk_surface(band, male, band_years=AGE_BAND_YEARS):
+    """(年龄档, 性别) 的完整风险网格：返回轴与 [uACR, eGFR] 形状的 2 年 / 5 年风险 (%)，数组只读"""
+    import numpy as np
+
+    from ckd.scoring import BETA_ACR, BETA_EGFR, MEAN_ACR, MEAN_EGFR, S0_2YR, S0_5YR
+
+    age = band_age(band, band_years)
+    egfr = np.arange(EGFR_MIN, EGFR_MAX + EGFR_STEP / 2, EGFR_STEP)
+    uacr = np.geomspace(UACR_MIN, UACR_MAX, UACR_POINTS)
+    lp = (_base_lp(age, male)
+          + (BETA_EGFR * (egfr / 5.0 - MEAN_EGFR))[None, :]
+          + (BETA_ACR * (np.log(uacr) - MEAN_ACR))[:, None])
+    hazard = np.exp(lp)
+    surface = {"band": band, "band_years": band_years, "age": age, "male": bool(male), "egfr": egfr, "uacr": uacr,
+               "5yr": (1.0 - np.power(S0_5YR, hazard)) * 100, "2yr": (1.0 - np.power(S0_2YR, hazard)) * 100}
+    for key in ("egfr", "uacr", "5yr", "2yr"):
+        surface[key].flags.writeable = False
+    return surface
+
+
+def surface_for(age, sex):
+    return risk_surface(age_band(age), is_male(sex))
+
+
+def what_if(age, sex, egfr, uacr, egfr_delta=0.0, uacr_change_pct=0.0):
+    """基线与情景 (eGFR 加减、uACR 按百分比变化) 的精确风险 (精确年龄)，与页面其它位置的 KFRE 数值一致"""
+    from ckd.scoring import calculate_kfre_precise
+
+    new_egfr = max(float(egfr) + egfr_delta, 1.0)
+    new_uacr = float(uacr) * (1 + uacr_change_pct / 100.0)
+    if new_uacr <= 0:
+        new_uacr = 1.0  # 与 calculate_kfre_precise 对 uACR ≤ 0 的处理一致，基线为 0 时情景 0% 与基线风险相同
+    return {
+        "baseline": {"egfr": float(egfr), "uacr": float(uacr), **calculate_kfre_precise(age, sex, egfr, uacr)},
+        "scenario": {"egfr": round(new_egfr, 1), "uacr": round(new_uacr, 1),
+                     **calculate_kfre_precise(age, sex, new_egfr, new_uacr)},
+    }
+
+
+def contour_lines(surface, horizon="5yr", levels=None):
+    """等风险线：对 uACR 轴上每一点解出风险恰为 level 的 eGFR (只保留落在网格范围内的点)"""
+    import numpy as np
+
+    from ckd.scoring import BETA_ACR, BETA_EGFR, MEAN_ACR, MEAN_EGFR, S0_2YR, S0_5YR
+
+    s0 = S0_5YR if horizon == "5yr" else S0_2YR
+    base = _base_lp(surface["age"], surface["male"])
+    uacr = surface["uacr"]
+    rows = []
+    for level in levels or CONTOUR_LEVELS[horizon]:
+        target_lp = math.log(math.log(1 - level / 100.0) / math.log(s0))
+        egfr = 5.0 * ((target_lp - base - BETA_ACR * (np.log(uacr) - MEAN_ACR)) / BETA_EGFR + MEAN_EGFR)
+        inside = (egfr >= EGFR_MIN) & (egfr <= EGFR_MAX)
+        rows += [{"level": f"{level:g}%", "egfr": round(float(e), 2), "uacr": round(float(a), 2)}
+                 for e, a in zip(egfr[inside], uacr[inside])]
+    return rows
+
+
+def _cells(axis, stride, log):
+    """抽样后的格子中心与上下边界 (对数轴按几何中点划分)"""
+    import numpy as np
+
+    centers = axis[::stride]
+    mids = np.sqrt(centers[1:] * centers[:-1]) if log else (centers[1:] + centers[:-1]) / 2
+    return centers, np.concatenate([[axis[0]], mids]), np.concatenate([mids, [axis[-1]]])
+
+
+@functools.lru_cache(maxsize=64)
+def _static_layers(band, male, band_years, horizon):
+    """热图格子与等风险线只随 (年龄档, 性别, 时限) 变化，滑块移动时直接复用"""
+    surface = risk_surface(band, male, band_years)
+    risk = surface[horizon]
+    e_stride = max(1, -(-len(surface["egfr"]) // CHART_CELLS))
+    a_stride = max(1, -(-len(surface["uacr"]) // CHART_CELLS))
+    e_c, e_lo, e_hi = _cells(surface["egfr"], e_stride, log=False)
+    a_c, a_lo, a_hi = _cells(surface["uacr"], a_stride, log=True)
+    sub = risk[::a_stride, ::e_stride]
+    cells = [{"e0": round(float(e_lo[j]), 2), "e1": round(float(e_hi[j]), 2), "egfr": round(float(e_c[j]), 1),
+              "a0": round(float(a_lo[i]), 2), "a1": round(float(a_hi[i]), 2), "uacr": round(float(a_c[i]), 1),
+              "risk": round(float(sub[i, j]), 2)}
+             for i in range(len(a_c)) for j in range(len(e_c))]
+    lines = contour_lines(surface, horizon)
+    labels = {}
+    for row in lines:
+        labels[row["level"]] = row  # 每条线取 uACR 最大处标注
+    return cells, lines, list(labels.values())
+
+
+def whatif_surface_spec(surface, horizon, result, color="#0E4D92"):
+    """风险曲面 (热图) + 等风险线 + 基线 / 情景两点的 Vega-Lite 规格"""
+    cells, lines, labels = _static_layers(surface["band"], surface["male"], surface["band_years"], horizon)
+    points = [{"label": "当前", "egfr": result["baseline"]["egfr"], "uacr": result["baseline"]["uacr"],
+               "risk": result["baseline"].get(horizon)},
+              {"label": "情景", "egfr": result["scenario"]["egfr"], "uacr": result["scenario"]["uacr"],
+               "risk": result["scenario"].get(horizon)}]
+
+    x = {"scale": {"domain": [EGFR_MIN, EGFR_MAX], "clamp": True}, "title": "eGFR (ml/min/1.73m²)"}
+    y = {"scale": {"type": "log", "domain": [UACR_MIN, UACR_MAX], "clamp": True}, "title": "uACR (mg/g)"}
+    title = HORIZONS[horizon]
+    return {
+        "height": 320,
+        "layer": [
+            {"data": {"values": cells}, "mark": {"type": "rect"},
+             "encoding": {"x": {"field": "e0", "type": "quantitative", **x}, "x2": {"field": "e1"},
+                          "y": {"field": "a0", "type": "quantitative", **y}, "y2": {"field": "a1"},
+                          "color": {"field": "risk", "type": "quantitative", "title": f"{title} %",
+                                    "scale": {"type": "log", "domain": [0.1, 100], "clamp": True,
+                                              "scheme": "yelloworangered"}},
+                          "tooltip": [{"field": "egfr", "title": "eGFR"}, {"field": "uacr", "title": "uACR"},
+                                      {"field": "risk", "title": f"{title} %"}]}},
+            {"data": {"values": lines}, "mark": {"type": "line", "color": "#37474F", "strokeWidth": 1},
+             "encoding": {"x": {"field": "egfr", "type": "quantitative", **x},
+                          "y": {"field": "uacr", "type": "quantitative", **y},
+                          "detail": {"field": "level"}, "order": {"field": "uacr", "type": "quantitative"}}},
+            {"data": {"values": labels},
+             "mark": {"type": "text", "color": "#37474F", "dy": -6, "fontSize": 11},
+             "encoding": {"x": {"field": "egfr", "type": "quantitative", **x},
+                          "y": {"field": "uacr", "type": "quantitative", **y}, "text": {"field": "level"}}},
+            {"data": {"values": points}, "mark": {"type": "line", "color": color, "strokeDash": [4, 3]},
+             "encoding": {"x": {"field": "egfr", "type": "quantitative", **x},
+                          "y": {"field": "uacr", "type": "quantitative", **y}}},
+            {"data": {"values": points},
+             "mark": {"type": "point", "filled": True, "size": 90, "stroke": "white", "strokeWidth": 1.5},
+             "encoding": {"x": {"field": "egfr", "type": "quantitative", **x},
+                          "y": {"field": "uacr", "type": "quantitative", **y},
+                          "shape": {"field": "label", "type": "nominal", "title": None,
+                                    "scale": {"domain": ["当前", "情景"], "range": ["circle", "diamond"]}},
+                          "color": {"value": color},
+                          "tooltip": [{"field": "label", "title": " "}, {"field": "egfr", "title": "eGFR"},
+                                      {"field": "uacr", "title": "uACR"},
+                                      {"field": "risk", "title": f"{title} %"}]}},
+        ],
+    }